@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Memory benchmark for documents queued in a connector, as 'dict' versus 'esdoc.EsDoc'.
+Each variant runs in a fresh process, and reports the growth in resident memory with the documents queued.
+
+Usage: python benchmark/esdoc_memory.py [number of documents]
+"""
+
+import sys, gc, multiprocessing
+import psutil
+from eslib import Processor
+from eslib.esdoc import EsDoc
+
+
+def make_dict(i, source):
+    return {"_index": "index", "_type": "doctype", "_id": str(i), "_source": source}
+
+def make_esdoc(i, source):
+    return EsDoc(_index="index", _type="doctype", _id=str(i), _source=source)
+
+
+def measure(make, n, result):
+    proc = Processor(name="sink")
+    connector = proc.create_connector(lambda doc: None, "input")
+    connector.accept_incoming()  # Accept, but do not run; documents stay queued
+    # The same '_source' for all, so that only the envelopes are measured
+    source = {"text": "hello"}
+
+    gc.collect()
+    before = psutil.Process().memory_info().rss
+    for i in xrange(n):
+        connector.receive(make(i, source))
+    gc.collect()
+    after = psutil.Process().memory_info().rss
+    result.value = after - before
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    print "%8s  %12s  %12s" % ("type", "MB queued", "bytes/doc")
+    for name, make in (("dict", make_dict), ("EsDoc", make_esdoc)):
+        result = multiprocessing.Value("l", 0)
+        p = multiprocessing.Process(target=measure, args=(make, n, result))
+        p.start()
+        p.join()
+        print "%8s  %12.1f  %12.1f" % (name, result.value / 1e6, float(result.value) / n)
+
+
+if __name__ == "__main__":
+    main()
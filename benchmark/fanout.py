@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Microbenchmark for Socket.send() fan-out. Measures the time per send() to 1, 4 and 16 subscribers,
+without any threads running; the subscribing connectors are accepting, but their queues are drained
+between rounds instead of being processed.
+
+Usage: python benchmark/fanout.py [number of documents]
+"""
+
+import sys, time
+from eslib import Processor
+
+
+class Sink(Processor):
+    def __init__(self, **kwargs):
+        super(Sink, self).__init__(**kwargs)
+        self.create_connector(self._incoming, "input")
+
+    def _incoming(self, document):
+        pass
+
+
+def measure(subscribers, n):
+    source = Processor(name="source")
+    socket = source.create_socket("output")
+    sinks = [Sink(name="sink%d" % i) for i in range(subscribers)]
+    for sink in sinks:
+        sink.subscribe(source)
+        sink.connectors["input"].accept_incoming()
+
+    document = {"_id": "1", "_source": {"text": "hello"}}
+    best = None
+    for round in range(5):
+        started = time.time()
+        for i in xrange(n):
+            socket.send(document)
+        elapsed = time.time() - started
+        best = elapsed if best is None else min(best, elapsed)
+        for sink in sinks:
+            sink.connectors["input"]._clear()
+    return best
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print "%11s  %12s  %12s" % ("subscribers", "usec/send", "sends/sec")
+    for subscribers in (1, 4, 16):
+        elapsed = measure(subscribers, n)
+        print "%11d  %12.2f  %12d" % (subscribers, elapsed / n * 1e6, n / elapsed)
+
+
+if __name__ == "__main__":
+    main()
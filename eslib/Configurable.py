@@ -1,3 +1,51 @@
+import re
+
+
+_identifier = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+class ConfigSnapshot(object):
+    """
+    A frozen copy of a Config, with defaults resolved, for fast attribute access in hot paths.
+    Each key is a slot of its own, so reading it is a plain attribute lookup. Create one with Config.snapshot().
+    Note that the values themselves are not copied; do not modify lists and dicts in them.
+    """
+
+    __slots__ = ("_items",)
+
+    _classes = {}  # Snapshot classes by their tuple of keys
+
+    @classmethod
+    def _create(cls, items):
+        keys = tuple(sorted(key for key in items if _identifier.match(key) and not hasattr(ConfigSnapshot, key)))
+        snapshot_class = cls._classes.get(keys)
+        if snapshot_class is None:
+            snapshot_class = cls._classes.setdefault(keys, type("ConfigSnapshot", (ConfigSnapshot,), {"__slots__": keys}))
+        snapshot = object.__new__(snapshot_class)
+        object.__setattr__(snapshot, "_items", items)
+        for key in keys:
+            object.__setattr__(snapshot, key, items[key])
+        return snapshot
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Config snapshot is read-only.")
+
+    def __getitem__(self, key):
+        return self._items[key]
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        return self._items.get(key, default)
+
+    def asdict(self):
+        return dict(self._items)
+
+    def __repr__(self):
+        return "ConfigSnapshot(%r)" % self._items
+
+
 class Config(object):
     def __init__(self, **config):
         super(Config, self).__init__()
@@ -43,7 +91,24 @@ class Config(object):
     def get_user_attributes(self):
         return {key: val for key, val in self.__dict__.iteritems() if key not in self.defaults}
 
+    def snapshot(self):
+        "Return a ConfigSnapshot of the current values, with defaults resolved."
+        items = dict(self.defaults)
+        items.update((key, val) for key, val in self.__dict__.iteritems() if key != "defaults")
+        return ConfigSnapshot._create(items)
+
 class Configurable(object):
     def __init__(self, **kwargs):
         super(Configurable, self).__init__()
         self.config = Config(**kwargs)
+
+    def compile_config(self):
+        "Compile 'config' into the frozen snapshot 'settings', replacing the previous one in a single assignment."
+        self.settings = self.config.snapshot()
+        return self.settings
+
+    def __getattr__(self, name):
+        # Only called for missing attributes; compile 'settings' the first time it is needed
+        if name == "settings":
+            return self.compile_config()
+        raise AttributeError("'%s' object has no attribute '%s'" % (self.__class__.__name__, name))
@@ -3,20 +3,84 @@
 from __future__ import absolute_import
 
 from .Terminal import Terminal
+from .Socket import _capture
+from .Scheduler import Scheduler
+from .SpillQueue import SpillQueue
 import Queue
-import threading
-import time
+import os, threading, time
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 
-class Connector(Terminal):
+# Upper bounds (in seconds) of the buckets in a connector's 'latency' histogram, with a last bucket for the rest.
+LATENCY_BOUNDS = (0.0001, 0.001, 0.01, 0.1, 1.0)
+
+# Max number of calls to 'method' in one step of a scheduled connector's run loop, before letting others run.
+SCHEDULED_STEP_SIZE = 100
+
+# Connectors with a process backend for their workers, by id. Registered before the worker processes are forked, so
+# that the children inherit the connector (and its owner, fully opened) and can look it up here.
+_process_targets = {}
+
+def _call_captured(connector, item):
+    "Call the connector method on 'item', returning what it sent to sockets as a list of (socket name, document)."
+    _capture.buffer = captured = []
+    try:
+        if connector.batch:
+            connector._call_batch(item)
+        else:
+            connector._call(item)
+    finally:
+        _capture.buffer = None
+    return captured
+
+def _call_captured_in_thread(task):
+    connector, item = task
+    return _call_captured(connector, item)
+
+def _call_captured_in_process(task):
+    key, item = task
+    return _call_captured(_process_targets[key], item)
 
-    def __init__(self, name, protocol=None, method=None):
-        self.sleep = 0.1 #0.001  # Check for data in incoming queue this often (then burst through as much as possible)
 
+class Connector(Terminal):
+
+    def __init__(self, name, protocol=None, method=None, batch=False, max_batch=100, capacity=None, fuse=None, workers=None, scheduled=None):
         super(Connector, self).__init__(name, protocol)
         self.type = Connector
         self.queue = Queue.Queue()
         self.method = method
+        self.batch = batch          # If True, 'method' is called with a list of documents instead of one at a time
+        self.max_batch = max_batch  # Max number of documents to hand over in a single call to 'method' in batch mode
+        self.capacity = capacity    # Max queued documents before senders block; None means owner's 'queue_capacity'
+        self.fuse = fuse            # Call 'method' directly in the sender's thread; None means owner's 'fuse' config
+        self.workers = workers      # Number of concurrent calls to 'method'; None means owner's 'workers' config
+        self.scheduled = scheduled  # Run on the shared Scheduler's threads; None means owner's 'scheduled_connectors'
+
+        self._fused = False             # Resolved from 'fuse' when we start accepting input
+        self._fuse_lock = threading.RLock()  # Serializes calls to 'method' between senders and our own thread when fused
+        self._workers = 1               # Resolved from 'workers' when we start accepting input
+        self._pool = None               # Worker pool when running with more than one worker
+        self._scheduled = False         # Resolved from 'scheduled' when we start accepting input
+
+        # Congestion state, flipped as the queue size passes the watermarks (resolved from the owner's config when
+        # we start accepting input) and reported to the owner. 0 means never congested.
+        self.congested = False
+        self._congestion_high = 0
+        self._congestion_low = 0
+        self._congestion_lock = threading.Lock()  # Serializes flips between senders and our own thread
+
+        # Signalled whenever there is something for the run loop to look at; new items in the queue or a change
+        # in execution status. The run loop blocks on this instead of polling the queue. It is only cleared when
+        # the run loop runs out of work, so while it is busy, senders need not signal anything.
+        self._wakeup = threading.Event()
+        self._run_done = threading.Event()  # Set when the run loop has finished
+        self._run_done.set()
+
+        # Statistics; plain counters, updated only by the thread that calls 'method' (or under the fuse lock)
+        self.count = 0                # Number of documents delivered to 'method'
+        self.processing_time = 0.0    # Total time spent in 'method', in seconds
+        self.latency = [0] * (len(LATENCY_BOUNDS) + 1)  # Histogram of time per call, bucketed by LATENCY_BOUNDS
 
         # Execution control status
         self._thread = None
@@ -26,61 +90,297 @@ class Connector(Terminal):
         self.suspended = False
         self.aborted = False
 
+    @property
+    def log(self):
+        return self.owner.log
+
     #region Queue management
 
     def _clear(self):
-        "Clear the queue."
+        "Clear the queue. A spilling queue is instead saved to disk, to be picked up again on the next run."
+        if isinstance(self.queue, SpillQueue):
+            self.queue.close()
         while not self.queue.empty():
             self.queue.get_nowait()
             self.queue.task_done()
+        self._check_congestion()
+
+    def _check_congestion(self):
+        "Flip the congestion state if the queue size has passed the relevant watermark."
+        # Unlocked first; the lock is only needed to flip, which is rare
+        size = self.queue._qsize()
+        if self.congested:
+            if size > self._congestion_low:
+                return
+        elif not (self._congestion_high and size > self._congestion_high):
+            return
+        with self._congestion_lock:
+            size = self.queue._qsize()  # No need for the queue lock for a mere peek
+            if self.congested:
+                if size <= self._congestion_low:
+                    self.congested = False
+                    if self.owner:
+                        self.owner.set_congested(self, False)
+            elif self._congestion_high and size > self._congestion_high:
+                self.congested = True
+                if self.owner:
+                    self.owner.set_congested(self, True)
 
     @property
     def pending(self):
         "Report number of pending items in queue."
         return self.queue.qsize()
 
+    def _get_many(self, max_items):
+        "Grab up to 'max_items' from the queue, holding the queue lock only once."
+        q = self.queue
+        with q.mutex:
+            n = min(max_items, q._qsize())
+            items = [q._get() for i in xrange(n)]
+            if n:
+                q.unfinished_tasks -= n
+                if not q.unfinished_tasks:
+                    q.all_tasks_done.notify_all()
+                q.not_full.notify(n)
+        return items
+
+    def _record(self, count, elapsed):
+        "Update statistics after a call to 'method' with 'count' documents, taking 'elapsed' seconds."
+        self.count += count
+        self.processing_time += elapsed
+        bucket = 0
+        for bound in LATENCY_BOUNDS:
+            if elapsed < bound:
+                break
+            bucket += 1
+        self.latency[bucket] += 1
+
     def _process(self):
-        "Grab item from queue and call the pre-registered method on it."
-        if not self.queue.empty():
+        "Grab item (or a batch of items) from queue and call the pre-registered method on it."
+        started = time.time()
+        if self._fused:
+            with self._fuse_lock:
+                count = self._process_queued()
+                if count:
+                    self._record(count, time.time() - started)
+        else:
+            count = self._process_queued()
+            if count:
+                self._record(count, time.time() - started)
+        if self.congested:
+            self._check_congestion()
+
+    def _process_queued(self):
+        "Returns the number of documents processed."
+        if self._pool:
+            return self._process_parallel()
+        elif self.batch:
+            documents = [document for document in self._get_many(self.max_batch) if document]
+            if documents:
+                self._call_batch(documents)
+            return len(documents)
+        elif not self.queue.empty():
             document = self.queue.get_nowait()
             self.queue.task_done()
             if document:
-                if self.method:
-                    try:
-                        self.method(document)
-                    except Exception as e:
-                        msg = "Unhandled exception in processor '%s' func '%s' while processing a document." % (self.owner.name, self.method.__name__)
-                        self.owner.doclog.exception(msg)
-                        self.owner.log.exception(msg)
+                self._call(document)
+                return 1
+        return 0
+
+    def _process_parallel(self):
+        "Let the worker pool process a chunk of queued items and send their output, in order if so configured."
+        items = [item for item in self._get_many(max(self.max_batch, self._workers)) if item]
+        count = len(items)
+        if not count:
+            return 0
+        if self.batch:
+            # Split the batch between the workers
+            size = (len(items) + self._workers - 1) // self._workers
+            items = [items[i:i+size] for i in xrange(0, len(items), size)]
+
+        if self.owner.config.worker_backend == "process":
+            tasks = [(id(self), item) for item in items]
+            func = _call_captured_in_process
+        else:
+            tasks = [(self, item) for item in items]
+            func = _call_captured_in_thread
+
+        try:
+            if self.owner.config.workers_ordered:
+                # Reorder buffer; output is sent in the order the items arrived, as soon as each one is ready
+                results = self._pool.imap(func, tasks)
+            else:
+                # Output is sent in the order the items finish
+                results = self._pool.imap_unordered(func, tasks)
+            for captured in results:
+                self._send_captured(captured)
+        except Exception as e:
+            msg = "Unhandled exception in processor '%s' func '%s' while processing %d items in workers." % (self.owner.name, self.method.__name__, len(items))
+            self.owner.doclog.exception(msg)
+            self.owner.log.exception(msg)
+        return count
+
+    def _send_captured(self, captured):
+        for socket_name, document in captured:
+            self.owner.sockets[socket_name].send(document)
+
+    def _set_capturing(self, capturing):
+        "Tell the owner's sockets whether to look for output to capture from workers."
+        if self.owner:
+            capturing = capturing or any(c._pool for c in self.owner.connectors.itervalues() if c is not self)
+            for socket in self.owner.sockets.itervalues():
+                socket._capturing = capturing
+
+    def _start_pool(self):
+        if self._workers <= 1:
+            return
+        self._set_capturing(True)  # Before worker processes are forked, so they capture too
+        if self.owner.config.worker_backend == "process":
+            # The worker processes are forked here, so they get a copy of the processor in its current (opened) state.
+            _process_targets[id(self)] = self
+            self._pool = multiprocessing.Pool(self._workers)
+        else:
+            self._pool = ThreadPool(self._workers)
+
+    def _stop_pool(self):
+        if not self._pool:
+            return
+        if self.aborted:
+            self._pool.terminate()
+        else:
+            self._pool.close()
+        self._pool.join()
+        self._pool = None
+        _process_targets.pop(id(self), None)
+        self._set_capturing(False)
+
+    def renew_workers(self):
+        "Replace worker processes, so they get a copy of the current processor state. (E.g. after a restart.)"
+        if self._pool and self.owner.config.worker_backend == "process":
+            self._stop_pool()
+            self._start_pool()
+
+    def _call(self, document):
+        if self.method:
+            try:
+                self.method(document)
+            except Exception as e:
+                msg = "Unhandled exception in processor '%s' func '%s' while processing a document." % (self.owner.name, self.method.__name__)
+                self.owner.doclog.exception(msg)
+                self.owner.log.exception(msg)
+
+    def _call_batch(self, documents):
+        if self.method:
+            try:
+                self.method(documents)
+            except Exception as e:
+                msg = "Unhandled exception in processor '%s' func '%s' while processing a batch of %d documents." % (self.owner.name, self.method.__name__, len(documents))
+                self.owner.doclog.exception(msg)
+                self.owner.log.exception(msg)
+
+    def _call_fused(self, document):
+        "Process the document directly in the sender's thread if we can. Returns False if it must be queued instead."
+        with self._fuse_lock:
+            # Only bypass the queue when it is empty; otherwise we would overtake documents queued up before
+            # (e.g. while suspended).
+            if not self.accepting:
+                return True  # Dropped; we stopped accepting while waiting for the lock
+            if not self.running or self.suspended or not self.queue.empty():
+                return False
+            if document:
+                started = time.time()
+                if self.batch:
+                    self._call_batch([document])
+                else:
+                    self._call(document)
+                self._record(1, time.time() - started)
+            return True
 
     def receive(self, document):
-        "Put document on the incoming queue for this connector. Called by sockets."
+        """
+        Put document on the incoming queue for this connector. Called by sockets.
+        If the queue is bounded and full, this blocks until there is room or we stop accepting input.
+        """
         if self.accepting:
-            self.queue.put(document)  # Infinite queue, so it should never block
+            if self._fused and self._call_fused(document):
+                return
+            if self.queue.maxsize > 0:
+                self._put_bounded(document)
+            else:
+                self.queue.put(document)  # Infinite queue, so it should never block
+            self._signal()
+            if self._congestion_high and not self.congested:
+                self._check_congestion()
+
+    def _put_bounded(self, document):
+        q = self.queue
+        # A scheduler thread must never wait here; if all of them did, none would be left to step the consumers.
+        # Senders on scheduler threads overfill the queue instead, and are held back by congestion alone.
+        block = not Scheduler.in_worker()
+        with q.not_full:
+            # Note: Waiting without timeout; stop() and abort() will wake us up.
+            while block and self.accepting and q._qsize() >= q.maxsize:
+                q.not_full.wait()
+            if not self.accepting:
+                return  # Dropped, as with anything arriving after we stopped accepting
+            q._put(document)
+            q.unfinished_tasks += 1
+            q.not_empty.notify()
+
+    def _release_senders(self):
+        "Wake up all senders blocked on a full queue, so they can see that we no longer accept input."
+        with self.queue.not_full:
+            self.queue.not_full.notify_all()
 
     #endregion Queue management
 
     #region Operation management
 
-    def _run(self):
+    def _signal(self):
+        "Let the run loop know that there is something to look at."
+        if not self._wakeup.is_set():
+            self._wakeup.set()
+            if self._scheduled:
+                Scheduler.shared().wake(self)
+
+    def _run_steps(self):
+        "The run loop, yielding None when it must wait to be signalled, or 0 to let others run in between."
         while self.running:
-            if self.sleep:
-                time.sleep(self.sleep)
-            if not self.running:
-                break
             if self.stopping and (self.suspended or self.queue.empty()):
+                if self._fused:
+                    with self._fuse_lock:
+                        pass  # Let a call in progress in a sender's thread finish before we report that we are done
                 # Notify owner that we are finished stopping
                 self.owner.production_stopped()
                 # Now we can finally stop
                 self.stopping = False
                 self.running = False
-            elif not self.suspended:
+            elif not self.suspended and not self.queue.empty():
+                steps = 0
                 while self.running and not self.suspended and not self.queue.empty():
                     self._process()
+                    steps += 1
+                    if steps == SCHEDULED_STEP_SIZE and self._scheduled:
+                        steps = 0
+                        yield 0
+            else:
+                # Nothing to do; wait until a document arrives or we are told to stop, abort, suspend or resume.
+                # Note: Anything signalled after clearing the event leaves it set (and wakes us up when scheduled),
+                #       and is caught by the checks below, so we cannot miss it.
+                self._wakeup.clear()
+                if self.running and not self.stopping and (self.suspended or self.queue.empty()):
+                    yield None
 
         # Clean out the queue (in case we just aborted)
         self._clear()
         self.stopping = False  # In case we were stopping while aborted
+        self._stop_pool()
+        self._run_done.set()
+
+    def _run(self):
+        for delay in self._run_steps():
+            if delay is None:
+                self._wakeup.wait()
 
     # Note: The reason for the split of run() and accept_incoming():
     #       The entire system should first be accepting data before the individual
@@ -97,39 +397,98 @@ class Connector(Terminal):
         if not self.accepting:
             raise Exception("Connector is not accepting input before call to run(). Call accept_incoming() on all connectors in the system first.")
 
+        self._wait_run_done()  # Let a previous run loop finish cleaning up
+
         self.aborted = False
         self.stopping = False
         self.suspended = False
         self.running = True
 
-        self._thread = threading.Thread(target=self._run)
-        self._thread.start()
+        self._start_pool()
+        self._run_done.clear()
+        self._wakeup.set()
+        if self._scheduled:
+            Scheduler.shared().add(self)
+        else:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.start()
 
     def accept_incoming(self):
         "Should be called for all connectors in the system before processes start running and processing!"
         if self.stopping:
             raise Exception("Connector is stopping. Refusing to accept new incoming again until fully stopped.")
+        capacity = self.capacity
+        if capacity is None:
+            capacity = self.owner.config.queue_capacity if self.owner else 0
+        spill_dir = self.owner.config.spill_dir if self.owner else None
+        if spill_dir:
+            self._wait_run_done()  # An aborted run loop may not have saved (and closed) the queue yet
+        if spill_dir and not (isinstance(self.queue, SpillQueue) and not self.queue.closed):
+            # Documents spilled in a previous run (or by a process that died) are picked up here
+            path = os.path.join(spill_dir, "%s.%s" % (self.owner.name, self.name))
+            self.queue = SpillQueue(path, self.owner.config.spill_threshold)
+        self.queue.maxsize = capacity or 0
+        fuse = self.fuse
+        if fuse is None:
+            fuse = self.owner.config.fuse if self.owner else False
+        workers = self.workers
+        if workers is None:
+            workers = self.owner.config.workers if self.owner else 1
+        self._workers = workers or 1
+        self._fused = bool(fuse) and self._workers <= 1  # Fusing would bypass the workers
+        scheduled = self.scheduled
+        if scheduled is None:
+            scheduled = self.owner.config.scheduled_connectors if self.owner else False
+        self._scheduled = bool(scheduled)
+        high = (self.owner.config.congestion_limit if self.owner else 0) or 0
+        low = self.owner.config.congestion_low if self.owner else None
+        self._congestion_high = high
+        self._congestion_low = high // 2 if low is None else min(low, high)
         self.accepting = True
 
-    def stop(self):
+    def _wait_run_done(self):
+        "Wait for a previous run loop to finish, unless called from that run loop's own thread."
+        if self._thread and self._thread is threading.current_thread():
+            return
+        self._run_done.wait()
+
+    def stop(self, wait=True):
+        "Stop accepting input, and stop running once the queue is processed. Waits for that unless 'wait' is False."
         self.accepting = False
         self.stopping = True  # We must wait for items in the queue to be processed before we finally stop running
-        if self._thread and self._thread.isAlive():
-            try:
-                self._thread.join()  # NOTE: Are we sure we want to wait for this ??
-            except:
-                pass  # Ignore
+        self._signal()
+        self._release_senders()
+        if wait:
+            self.join()
+
+    def join(self):
+        "Wait for the run loop to finish."
+        if self._scheduled:
+            # Waiting from a scheduler thread could starve the scheduler of threads to finish the run loops on
+            if not Scheduler.in_worker():
+                self._run_done.wait()
+        else:
+            thread = self._thread
+            if thread and thread.isAlive():
+                try:
+                    thread.join()  # NOTE: Are we sure we want to wait for this ??
+                except:
+                    pass  # Ignore
         self._thread = None
 
     def abort(self):
         self.aborted = True
         self.accepting = False
         self.running = False  # Run loop will stop immediately
+        self._signal()
+        self._release_senders()
 
     def suspend(self):
         self.suspended = True
+        self._signal()
 
     def resume(self):
         self.suspended = False
+        self._signal()
 
     #endregion Operation management
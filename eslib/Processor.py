@@ -10,41 +10,70 @@ from .Configurable import Configurable
 from .Terminal import Terminal
 from .Terminal import TerminalProtocolException
 from .TerminalInfo import TerminalInfo
-from .Connector import Connector
+from .Connector import Connector, LATENCY_BOUNDS
 from .Socket import Socket
+from .Scheduler import Scheduler
 import weakref
 
-# # NOT IN USE YET (OR EVER):
-#
-# class ProcessorStatistics(object):
-#     def __init__(self, owner):
-#         """
-#         :param Processor owner:
-#         """
-#         self.processor = owner
-#
-#         self.input_count      = 0  # Number delivered to processor methods by connectors
-#         self.output_count     = 0  # Number written to output sockets
-#         self.pending_count    = 0  # Currently pending processing; sum of input and internal processing queues; incl. waiting for write
-#         self.processed_count  = 0
-#         self.started_time     = 0
-#         self.ended_time       = 0
-#         self.elapsed_time     = 0
-#         self.eta_time         = 0  # Estimated time to finished
-#         self.processing_time  = 0  # Time inside connector target method, generator tick method or shutdown method
-#         self.iteration_number = 0  # Number of times processor has been started
-#         self.processing_velocity_hour   = 0
-#         self.processing_velocity_minute = 0
-#         self.processing_velocity_second = 0
-#         self.pending_growth_hour   = 0
-#         self.pending_growth_minute = 0
-#         self.pending_growth_second = 0
-#
-#         # These are not particular to the document processor, but to the entire process
-#         self.thread_count     = 0
-#         self.max_thread_count = 0  # PER PROCESS
-#         self.memory_used      = 0  # PER PROCESS
-#         self.max_memory_used  = 0  # PER PROCESS
+# Labels for the buckets of a connector's 'latency' histogram (time per call to the connector's method)
+LATENCY_LABELS = tuple("<%gms" % (bound * 1000) for bound in LATENCY_BOUNDS) + (">=%gms" % (LATENCY_BOUNDS[-1] * 1000),)
+
+# Serializes updates to the congestion state of processors across the graph
+_congestion_lock = threading.RLock()
+
+class ProcessorStatistics(object):
+    """
+    Runtime statistics for a processor. The counters live in the terminals and the processor's run loop, where they
+    are cheap to update; they are only collected here when asked for with get().
+    """
+
+    def __init__(self, owner):
+        """
+        :param Processor owner:
+        """
+        self.processor = owner
+
+        self.started_time     = 0
+        self.ended_time       = 0
+        self.iteration_number = 0    # Number of times processor has been started
+        self.tick_count       = 0    # Number of calls to generator/monitor on_tick()
+        self.tick_time        = 0.0  # Time spent in generator/monitor on_tick(), in seconds
+
+    def get(self):
+        "Return a snapshot of the statistics as a dictionary."
+        proc = self.processor
+
+        connectors = {}
+        for connector in proc.connectors.itervalues():
+            connectors[connector.name] = {
+                "count"           : connector.count,
+                "queued"          : connector.pending,
+                "processing_time" : connector.processing_time,
+                "latency"         : dict(zip(LATENCY_LABELS, connector.latency))
+            }
+        sockets = {}
+        for socket in proc.sockets.itervalues():
+            sockets[socket.name] = {"count": socket.count}
+
+        elapsed = 0
+        if proc.running:
+            elapsed = time.time() - self.started_time
+        elif self.started_time:
+            elapsed = self.ended_time - self.started_time
+
+        return {
+            "status"          : proc.status,
+            "iteration"       : self.iteration_number,
+            "started"         : self.started_time,
+            "elapsed"         : elapsed,
+            "input_count"     : sum(c["count"] for c in connectors.itervalues()),
+            "output_count"    : sum(s["count"] for s in sockets.itervalues()),
+            "pending_count"   : sum(c["queued"] for c in connectors.itervalues()),
+            "processing_time" : sum(c["processing_time"] for c in connectors.itervalues()) + self.tick_time,
+            "tick_count"      : self.tick_count,
+            "connectors"      : connectors,
+            "sockets"         : sockets
+        }
 
 
 class Processor(Configurable):
@@ -52,7 +81,8 @@ class Processor(Configurable):
 
     def __init__(self, service=None, **kwargs):
         super(Processor, self).__init__(**kwargs)
-        self.sleep = 0.001
+        self.sleep = 0.001       # Default delay between generator ticks; None means wait until woken up
+        self.scheduled = False   # Run generator ticks on the shared Scheduler's threads instead of a thread of our own
 
         self.service = None
         if service:
@@ -60,7 +90,16 @@ class Processor(Configurable):
 
         self.config.set_default(
             name             = self.__class__.__name__,
-            congestion_limit = 10000
+            congestion_limit = 10000,    # Connector queue size above which we are congested; 0 = never congested
+            congestion_low   = None,     # Queue size at or below which congestion clears; None = half of 'congestion_limit'
+            queue_capacity   = 0,        # Default max queued documents per connector before senders block; 0 = unbounded
+            spill_dir        = None,     # Directory to spill connector queues to when they grow long; None = never spill
+            spill_threshold  = 10000,    # Queued documents kept in memory per connector before spilling to 'spill_dir'
+            fuse             = False,    # Default for whether connectors process documents directly in the sender's thread
+            workers          = 1,        # Default number of concurrent calls to each connector's method
+            worker_backend   = "thread", # Run workers as "thread" or (forked) "process"
+            workers_ordered  = True,     # Send output from workers in the order the documents arrived
+            scheduled_connectors = False # Default for whether connectors run on the shared Scheduler's threads
         )
 
         self._setup_logging()
@@ -77,6 +116,7 @@ class Processor(Configurable):
         self.connectors = {}
         self.default_connector = None
         self.default_socket    = None
+        self.has_output = False  # Whether any socket has output; kept up to date by the sockets
 
         # Execution control status, needed by generators and monitors
         self.accepting  = False
@@ -88,12 +128,23 @@ class Processor(Configurable):
         self.keepalive  = False  # True means that this processor will not be stopped automatically when a producer stops.
 
         self._thread = None
+        self._tick_event = threading.Event()  # Set by wakeup(); cuts short the wait before the next generator tick
+        self._next_tick = None  # Delay before the next tick, as requested with schedule_tick() during a tick
+        self._run_done = threading.Event()  # Set when the generator run loop has finished
+        self._run_done.set()
+        self._status_changed = threading.Condition()  # Notified when we stop running or are done restarting
         self._runchan_count = 0  # Number of running producers, whether connector or local monitor/generator thread
+        self._runchan_lock = threading.Lock()  # Protects _runchan_count, which producers update from their own threads
         self._initialized = False  # Set only by _setup() and _close() methods! (To avoid infinite circular setup of processor graph.)
 
+        # Congestion state; see set_congested()
+        self._congestion_reasons = set()  # Reasons we are congested ourselves; congested connectors, or other keys
+        self._congested = frozenset()     # Congested processors downstream of us (including us); replaced on change
+
         # Variables for keeping track of progress.
         self.total = None  # Not applicable
         self.count = 0
+        self.stats = ProcessorStatistics(self)
 
     def __str__(self):
         return "%s|%s" % (self.__class__.__name__, self.name)
@@ -138,7 +189,7 @@ class Processor(Configurable):
 
     #region Terminal creation
 
-    def create_connector(self, method, name=None, protocol=None, description=None, is_default=False):
+    def create_connector(self, method, name=None, protocol=None, description=None, is_default=False, batch=False, max_batch=100, capacity=None, fuse=None, workers=None, scheduled=None):
         """
         Create a connector (input) for this processor.
 
@@ -148,9 +199,20 @@ class Processor(Configurable):
         :param str    description : Description text for the connector.
         :param bool   is_default  : Whether this should be registered as the default connector that can be addressed
                                     without a name. Only one can exist for a set of connectors for a processor.
+        :param bool   batch       : Call 'method' with a list of all (up to 'max_batch') queued items instead of
+                                    once per item.
+        :param int    max_batch   : Max number of items to deliver per call to 'method' when 'batch' is set.
+        :param int    capacity    : Max number of queued items before senders block (backpressure). 0 is unbounded.
+                                    If None, the processor's 'queue_capacity' config is used.
+        :param bool   fuse        : Call 'method' directly in the sending processor's thread instead of queueing the
+                                    item for our own connector thread. If None, the processor's 'fuse' config is used.
+        :param int    workers     : Number of concurrent calls to 'method'. If None, the processor's 'workers' config
+                                    is used. See also the 'worker_backend' and 'workers_ordered' config.
+        :param bool   scheduled   : Process queued items on the shared Scheduler's threads instead of a thread of the
+                                    connector's own. If None, the processor's 'scheduled_connectors' config is used.
         :return Connector : Returns the new connector.
         """
-        terminal = Connector(name, protocol, method)
+        terminal = Connector(name, protocol, method, batch, max_batch, capacity, fuse, workers, scheduled)
         if terminal.name in self.connectors:
             raise Exception("Connector name '%s' already exists for processor '%s'." % (terminal.name, self.name))
         terminal.owner = self
@@ -267,6 +329,7 @@ class Processor(Configurable):
         # Attach connector as output target for socket
         socket.attach(connector)
         connector.attach(socket)
+        producer._refresh_congestion()
 
         return self # For fluent programming
 
@@ -284,6 +347,7 @@ class Processor(Configurable):
                 for socket in connector.get_connections(producer, socket_name):
                     socket.detach(connector)
                     connector.detach(socket)
+                    socket.owner._refresh_congestion()
 
         return self # For fluent programming
 
@@ -306,6 +370,7 @@ class Processor(Configurable):
         # Attach connector as output target for socket
         socket.attach(connector)
         connector.attach(socket)
+        self._refresh_congestion()
 
         return self # For fluent programming
 
@@ -323,14 +388,13 @@ class Processor(Configurable):
                 for connector in socket.get_connections(subscriber, connector_name):
                     socket.detach(connector)
                     connector.detach(socket)
+        self._refresh_congestion()
 
         return self # For fluent programming
 
-    @property
-    def has_output(self):
-        for socket in self.sockets.itervalues():
-            if socket.has_output: return True
-        return False
+    def _update_has_output(self):
+        "Called by our sockets when their connections or callbacks change."
+        self.has_output = any(socket.has_output for socket in self.sockets.itervalues())
 
     def connector_info(self, *args):
         "Return list of info for connectors named in *args, or all connectors."
@@ -381,18 +445,24 @@ class Processor(Configurable):
 
     def on_close   (self): pass
 
+    def on_reconfigure(self):
+        """
+        Called by reconfigure() after 'settings' has been replaced, while the processor may be running and
+        processing documents in other threads. Rebuild state compiled from the config here, and replace it
+        in a single assignment. If this raises, the previous config is restored.
+        """
+        pass
+
     def is_congested(self):
         """
-        Checks if our connectors queues are to large.
+        Whether this processor itself is congested. Connectors report this as their queues pass the
+        'congestion_limit' and 'congestion_low' watermarks. Override this if you have other reasons
+        to be congested (such as an internal queue); re-evaluate them, report with set_congested(),
+        and return the result from here. It is called on processors found in congestion().
 
-        :return:
+        :return bool:
         """
-        if self.config.congestion_limit == 0:
-            return False
-        for connector in self.connectors.itervalues():
-            if connector.queue.qsize() > self.config.congestion_limit:
-                return True
-        return False
+        return bool(self._congestion_reasons)
 
     #endregion Handlers for all processor types
 
@@ -418,9 +488,10 @@ class Processor(Configurable):
 
     #region Operation management
 
-    def _run(self):
+    def _run_steps(self):
+        "The generator run loop, yielding the delay before each round. (None means wait until woken up.)"
 
-        self._runchan_count += 1
+        # Note: We were counted as a running producer in _start_running(), before this loop started.
 
         try:
             self.on_startup()
@@ -428,8 +499,12 @@ class Processor(Configurable):
             self.log.exception("Unhandled exception in on_startup() -- proceeding.")
 
         while self.running:
-            if self.sleep:
-                time.sleep(self.sleep)
+            delay = self.sleep
+            if self._next_tick is not None:
+                delay = self._next_tick if delay is None else min(delay, self._next_tick)
+                self._next_tick = None
+            yield delay
+            self._tick_event.clear()
 
             if self.stopping:
                 if self.restarting or self._runchan_count == 1:  # restarting or it is only us left running...
@@ -439,15 +514,37 @@ class Processor(Configurable):
                         self.log.exception("Unhandled exception in on_shutdown() -- proceeding.")
                     self.production_stopped(self.restarting)  # Ready to close down
             elif not self.suspended:
+                started = time.time()
                 try:
                     self.on_tick()
                 except Exception as e:
                     self.log.exception("Unhandled exception in on_tick() -- proceeding.")
+                self.stats.tick_count += 1
+                self.stats.tick_time += time.time() - started
 
         if self.aborted:
             # note: on_abort() should have been called already, or we should never have gotten here
             self._close()
-            self._runchan_count -= 1  # If stopped normally, it was decreased in call to production_stopped()
+            with self._runchan_lock:
+                self._runchan_count -= 1  # If stopped normally, it was decreased in call to production_stopped()
+
+        self._run_done.set()
+
+    def _run(self):
+        for delay in self._run_steps():
+            if delay is None or delay > 0:
+                self._tick_event.wait(delay)
+
+    def wakeup(self):
+        "Let a generator tick (or react to a change in status) now, instead of after the current delay."
+        self._tick_event.set()
+        if self.scheduled:
+            Scheduler.shared().wake(self)
+
+    def schedule_tick(self, delay):
+        "Call from on_tick() to have the next tick in 'delay' seconds, if that is sooner than 'sleep'."
+        if self._next_tick is None or delay < self._next_tick:
+            self._next_tick = max(0, delay)
 
     def start(self):
         "Start running (if not already so) and start accepting and/or generating new data. Cascading to all subscribers."
@@ -467,6 +564,7 @@ class Processor(Configurable):
         if self._initialized:
             return
 
+        self.compile_config()
         try:
             self.on_open()
         except Exception as e:
@@ -488,6 +586,7 @@ class Processor(Configurable):
             self.log.exception("Unhandled exception in on_close() -- proceeding.")
 
         self._initialized = False
+        self.stats.ended_time = time.time()
         # Note: Do NOT tell subscribers to close. They will do this themselves after they have been stopped or aborted.
 
         # Notify everyone subscribing to 'event_stopped' or 'event_aborted' events
@@ -526,12 +625,20 @@ class Processor(Configurable):
         if self.running:
             return
 
+        # Count all producers before any of them start, so that none can stop and see the count reach
+        # zero while another (such as the generator run loop) has yet to be counted.
+        with self._runchan_lock:
+            if not self.restarting:
+                self._runchan_count = len(self.connectors)
+            if self.is_generator:
+                self._runchan_count += 1
+
         if not self.restarting:
-            self._runchan_count = 0  # Should not really be necessary if all is well..
+            self.stats.started_time = time.time()
+            self.stats.iteration_number += 1
             # Tell all connectors to start running
             for connector in self.connectors.itervalues():
                 connector.run()
-                self._runchan_count += 1
         # Start running this, if generator/monitor
         self.aborted = False
         self.stopping = False
@@ -547,14 +654,21 @@ class Processor(Configurable):
 
 
         if self.is_generator:
-            self._thread = threading.Thread(target=self._run)
-            self._thread.start()
+            self._run_done.clear()
+            self._next_tick = None
+            if self.scheduled:
+                Scheduler.shared().add(self)
+            else:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.start()
 
         if self.restarting:
             # Resume all connectors
             for connector in self.connectors.itervalues():
+                connector.renew_workers()
                 connector.resume()
             self.restarting = False
+            self._notify_status()
 
         # Notify everyone subscribing to 'event_started' events
         for func in self.event_started:
@@ -580,26 +694,37 @@ class Processor(Configurable):
             # Suspend all connectors
             for connector in self.connectors.itervalues():
                 connector.suspend()
-            if not self._thread:
+            if not self.is_generator:
                 # Since finalizing the stopping process will not be done after
                 # connectors stop (since they are not stopped on restart, but
                 # merely suspended, we have to shut down here.
                 self.stopping = False
                 self.running = False
                 self._close()
+                self._notify_status()
         else:
             # Continue processing input in connector queues, but do not accept more incoming data on the connectors
             # Note: It is first when all connector queues are empty (and thus processed) that we can tell subscribers to stop.
-            for connector in self.connectors.itervalues():
-                connector.stop()
+            # Tell all connectors first, so they finish up in parallel, then wait for them.
+            connectors = self.connectors.values()
+            for connector in connectors:
+                connector.stop(wait=False)
+            for connector in connectors:
+                connector.join()
+        self.wakeup()
 
     def production_stopped(self, restarting=False):
-        self._runchan_count -= 1
-        if restarting or self._runchan_count == 0:
+        with self._runchan_lock:
+            self._runchan_count -= 1
+            count = self._runchan_count
+        if self.is_generator:
+            self.wakeup()  # Let the run loop see whether it is the last one running
+        if restarting or count == 0:
             # We are all done... no longer generating, and no longer receiving
             self.stopping = False
             self.running = False
             self._close()
+            self._notify_status()
             if not restarting:
                 # Now we can finally tell subscribers to stop
                 for subscriber in self._iter_subscribers():
@@ -630,6 +755,9 @@ class Processor(Configurable):
 
         if not self.is_generator:  # Otherwise handled in the _run() loop
             self._close()
+        else:
+            self.wakeup()
+        self._notify_status()
 
         # Cascade abort to subscribers
         for subscriber in self._iter_subscribers():
@@ -665,17 +793,31 @@ class Processor(Configurable):
         for connector in self.connectors.itervalues():
             connector.resume()
 
+        if self.is_generator:
+            self.wakeup()
+
     def wait(self):
         self._wait()
 
+    def _notify_status(self):
+        "Wake up threads waiting for us to stop running or finish restarting."
+        with self._status_changed:
+            self._status_changed.notify_all()
+
     def _wait(self, restarting=False):
         "Wait for this processor to finish."
-        while self.running or (self.restarting and not restarting):
-            time.sleep(0.1)  # wait 0.1 seconds
+        # Note: A wait without timeout cannot be interrupted with Ctrl-C in Python 2, so the main thread wakes up now
+        #       and then.
+        timeout = 1.0 if isinstance(threading.current_thread(), threading._MainThread) else None
+        with self._status_changed:
+            while self.running or (self.restarting and not restarting):
+                self._status_changed.wait(timeout)
 
         if self._thread and self._thread.isAlive():
             self._thread.join()
         self._thread = None
+        if self.scheduled:
+            self._run_done.wait()
 
     def restart(self, start=True):
         if self.stopping:
@@ -691,34 +833,108 @@ class Processor(Configurable):
             self._wait(True)
             self._start()
 
-    def congestion(self, seen=None):
+    def reconfigure(self, **changes):
         """
-        Determine whether a dependent processor down the pipeline is congested.
-        :param bool seen: Whether we have seen this proc before. To avoid infinite loops. Internal use only.
-        :return: First processor found that was congested.
-        """
-
+        Change config without stopping. The new config is compiled into a new 'settings' snapshot, which replaces
+        the old one in one go, so code reading 'settings' sees either the old or the new config, never a mix.
+        If the processor is open, on_reconfigure() is then called to rebuild state compiled from the config.
 
-        # Making sure we're not entering an eternal recursive check:
-        if not seen:
-            seen = [self]
-        elif self in seen:
-            return None #False
-        else:
-            seen.append(self)
+        :raises Exception: Whatever on_reconfigure() raised, after restoring the previous config.
+        """
+        config = self.config.__dict__
+        previous = dict((key, config[key]) for key in changes if key in config)
+        previous_settings = self.settings
+        self.config.set(**changes)
+        self.compile_config()
+        if self._initialized:
+            try:
+                self.on_reconfigure()
+            except Exception as e:
+                self.log.exception("Unhandled exception in on_reconfigure() -- restoring previous config.")
+                for key in changes:
+                    if key in previous:
+                        config[key] = previous[key]
+                    else:
+                        del config[key]
+                self.settings = previous_settings
+                raise
+        self.log.info("Reconfigured: %s" % ", ".join(sorted(changes)))
+
+    def congestion(self):
+        """
+        Determine whether a dependent processor down the pipeline (or this one) is congested.
+        This only looks at state maintained as congestion comes and goes, so it is cheap to call often.
+        :return: A processor found to be congested, or None.
+        """
+        for processor in self._congested:
+            if processor.is_congested():
+                return processor
+        return None
+
+    def set_congested(self, reason, congested):
+        """
+        Report that this processor is (or is no longer) congested for the given reason, which is any hashable
+        key. The processor is congested while it has at least one reason. Changes are propagated upstream.
+        """
+        if (reason in self._congestion_reasons) == bool(congested):
+            return  # No change; the common case, so without the lock
+        with _congestion_lock:
+            was_congested = bool(self._congestion_reasons)
+            if congested:
+                self._congestion_reasons.add(reason)
+            else:
+                self._congestion_reasons.discard(reason)
+            if bool(self._congestion_reasons) != was_congested:
+                self._propagate_congestion(not was_congested)
+
+    def _producers(self):
+        "Processors with sockets connected to our connectors."
+        return [socket.owner for connector in self.connectors.itervalues() for socket in connector.connections if socket.owner]
+
+    def _subscribers(self):
+        "Processors with connectors connected to our sockets."
+        return [connector.owner for socket in self.sockets.itervalues() for connector in socket.connections if connector.owner]
+
+    def _propagate_congestion(self, congested):
+        "Add or remove us in the set of congested processors of ourselves and everything upstream. Call with the lock held."
+        pending = [self]
+        while pending:
+            processor = pending.pop()
+            if (self in processor._congested) == congested:
+                continue  # Already seen, through another path or a loop
+            if congested:
+                processor._congested = processor._congested | frozenset([self])
+            else:
+                processor._congested = processor._congested - frozenset([self])
+            pending.extend(processor._producers())
 
-        # If any of our sockets, or their sockets again, have processors connected that are congested: report the whole shebang as congested.
-        for socket in self.sockets.values()[:]:
-            for connector in socket.connections:
-                if connector.owner:
-                    if connector.owner.is_congested():
-                        return connector.owner #True
-                    return connector.owner.congestion(seen)
+    @staticmethod
+    def _closure(processor, neighbours):
+        "Set of processors reachable from 'processor' (inclusive) by repeatedly calling 'neighbours' on them."
+        found = set([processor])
+        pending = [processor]
+        while pending:
+            for other in neighbours(pending.pop()):
+                if not other in found:
+                    found.add(other)
+                    pending.append(other)
+        return found
+
+    def _refresh_congestion(self):
+        "Recompute the sets of congested processors for us and everything upstream, after a change in connections."
+        with _congestion_lock:
+            for processor in Processor._closure(self, Processor._producers):
+                downstream = Processor._closure(processor, Processor._subscribers)
+                processor._congested = frozenset(p for p in downstream if p._congestion_reasons)
 
     def congestion_sleep(self, delay=1.0):
-        start = time.time()
-        while (time.time() - start < delay) and (not self.end_tick_reason):
-            time.sleep(self.sleep)
+        "Sleep for up to 'delay' seconds from inside a tick. Returns early if woken up, e.g. when told to stop."
+        remaining = delay
+        end = time.time() + delay
+        while remaining > 0 and not self.end_tick_reason:
+            if self._tick_event.wait(remaining):
+                break  # Leave the event set, so the run loop reacts to it too
+            remaining = end - time.time()
 
     #endregion Operation management
 
@@ -744,7 +960,7 @@ class Processor(Configurable):
         socket = self._get_socket(self, socket_name)
         if not socket:
             raise Exception("Socket not found.")
-        socket.callbacks.append(method)
+        socket.add_callback(method)
 
     #endregion Send and receive data with external methods
 
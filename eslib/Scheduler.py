@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import threading, time, heapq, itertools, atexit
+
+
+_local = threading.local()
+
+
+class Scheduler(object):
+    """
+    Runs the run loops of generators/monitors with 'scheduled' set on a small, shared pool of threads,
+    instead of one thread each. A processor's loop is only stepped when it is due, i.e. when the delay
+    it asked for after its last tick has passed, or when it is woken up with processor.wakeup().
+    Scheduled connectors are stepped the same way, when documents arrive.
+
+    Only suitable for processors whose on_tick() (or connector method) returns quickly; a call that blocks
+    holds one of the pool's threads for as long as it blocks.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        "The scheduler shared by all processors in this process."
+        with cls._shared_lock:
+            if not cls._shared:
+                cls._shared = Scheduler()
+                atexit.register(cls._shared.shutdown)
+            return cls._shared
+
+    def __init__(self, threads=4):
+        self.threads = threads
+
+        self._cond = threading.Condition()
+        self._heap = []       # Entries of (due time, sequence number, processor); some may be stale
+        self._due = {}        # Processor -> due time of its valid heap entry; None means waiting to be woken
+        self._steps = {}      # Processor -> iterator over its run loop
+        self._busy = set()    # Processors with a step in progress
+        self._woken = set()   # Processors woken while busy
+        self._seq = itertools.count()
+        self._workers = []
+        self._shutdown = False
+
+    @staticmethod
+    def in_worker():
+        "Whether the calling thread is one of a scheduler's worker threads."
+        return getattr(_local, "worker", False)
+
+    def add(self, processor):
+        "Start stepping the processor's run loop."
+        with self._cond:
+            self._steps[processor] = processor._run_steps()
+            if not processor in self._busy:
+                self._schedule(processor, time.time())
+            else:
+                self._woken.add(processor)  # Its previous run loop is finishing; start the new one after that
+            while len(self._workers) < self.threads:
+                worker = threading.Thread(target=self._work, name="scheduler-%d" % len(self._workers))
+                # Daemon threads, so that a processor left running cannot keep the interpreter from exiting. (They
+                # also exit by themselves when there are no more run loops to step.) Wait for the processors instead.
+                worker.daemon = True
+                self._workers.append(worker)
+                worker.start()
+            self._cond.notify()
+
+    def shutdown(self, timeout=1.0):
+        """
+        Stop stepping run loops, and wait up to 'timeout' seconds for the worker threads to finish their current
+        steps. Called at exit, so that no worker is left running while the interpreter is torn down.
+        """
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+            workers = list(self._workers)
+        deadline = time.time() + timeout
+        for worker in workers:
+            worker.join(max(0, deadline - time.time()))
+
+    def wake(self, processor):
+        "Step the processor's run loop as soon as possible."
+        with self._cond:
+            if not processor in self._steps:
+                return
+            if processor in self._busy:
+                self._woken.add(processor)
+                return
+            now = time.time()
+            due = self._due.get(processor)
+            if due is None or due > now:
+                self._schedule(processor, now)
+                self._cond.notify()
+
+    def _schedule(self, processor, due):
+        self._due[processor] = due
+        if due is not None:
+            heapq.heappush(self._heap, (due, next(self._seq), processor))
+
+    def _next(self):
+        """
+        Wait for and return the next processor due for a step, with its run loop iterator. Call with the lock held.
+        Returns (None, None) when there are no more run loops to step, in which case the calling worker should exit.
+        """
+        while True:
+            if not self._steps or self._shutdown:
+                return None, None
+            # Discard stale entries
+            while self._heap:
+                due, seq, processor = self._heap[0]
+                if processor in self._due and self._due[processor] == due:
+                    break
+                heapq.heappop(self._heap)
+            if not self._heap:
+                self._cond.wait()
+                continue
+            wait = self._heap[0][0] - time.time()
+            if wait > 0:
+                self._cond.wait(wait)
+                continue
+            due, seq, processor = heapq.heappop(self._heap)
+            del self._due[processor]
+            self._busy.add(processor)
+            return processor, self._steps[processor]
+
+    def _work(self):
+        _local.worker = True
+        while True:
+            with self._cond:
+                processor, steps = self._next()
+                if not processor:
+                    self._workers.remove(threading.current_thread())
+                    return
+
+            done = False
+            delay = None
+            try:
+                delay = next(steps)
+            except StopIteration:
+                done = True
+            except Exception as e:
+                processor.log.exception("Unhandled exception in scheduled run loop -- dropping it.")
+                done = True
+
+            with self._cond:
+                self._busy.discard(processor)
+                if self._steps.get(processor) is not steps:
+                    # The processor was added again (restarted) while this step was in progress; start the new loop
+                    if processor in self._steps:
+                        self._woken.discard(processor)
+                        self._schedule(processor, time.time())
+                        self._cond.notify()
+                    continue
+                if done:
+                    del self._steps[processor]
+                    self._woken.discard(processor)
+                    if not self._steps:
+                        self._cond.notify_all()  # Let idle workers exit
+                    continue
+                if processor in self._woken:
+                    self._woken.discard(processor)
+                    delay = 0
+                self._schedule(processor, None if delay is None else time.time() + delay)
+                self._cond.notify()
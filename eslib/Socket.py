@@ -1,6 +1,13 @@
 # -*- coding: utf-8 -*-
 
 from .Terminal import Terminal
+import threading
+
+
+# When a connector runs its method in a worker (see Connector), whatever the method sends is captured here,
+# per thread, as a list of (socket name, document) instead of being sent right away.
+_capture = threading.local()
+_capture.buffer = None
 
 
 class Socket(Terminal):
@@ -9,27 +16,59 @@ class Socket(Terminal):
     def __init__(self, name, protocol=None, mimic=None):
         super(Socket, self).__init__(name, protocol)
         self.type = Socket
-        self.callbacks = []  # List of methods for external callbacks
+        self.callbacks = []  # List of methods for external callbacks; use add_callback()/remove_callback()
         self.mimic = mimic
+        self.count = 0  # Number of documents sent
+
+        # Snapshots of 'connections' and 'callbacks' used by send(); replaced (never modified) on changes,
+        # so that send() needs neither a copy nor a lock.
+        self._subscribers = ()
+        self._callbacks = ()
+        self.has_output = False  # Whether anyone is listening; kept up to date along with the snapshots
+        self._capturing = False  # Whether a connector of the owner runs workers, whose output may have to be captured
+
+    def attach(self, terminal):
+        super(Socket, self).attach(terminal)
+        self._update_dispatch()
+
+    def detach(self, terminal):
+        super(Socket, self).detach(terminal)
+        self._update_dispatch()
+
+    def add_callback(self, method):
+        self.callbacks.append(method)
+        self._update_dispatch()
+
+    def remove_callback(self, method):
+        if method in self.callbacks:
+            self.callbacks.remove(method)
+        self._update_dispatch()
+
+    def _update_dispatch(self):
+        self._subscribers = tuple(self.connections)
+        self._callbacks = tuple(self.callbacks)
+        self.has_output = bool(self._subscribers or self._callbacks)
+        if self.owner:
+            self.owner._update_has_output()
 
     def send(self, document):
         "Send data to all subscribing connectors and callbacks."
 
-        # Send data to all accepting connectors
-        subscribers = self.connections[:]
-        for subscriber in subscribers:
-            if subscriber.accepting:
-                subscriber.receive(document)
+        if self._capturing:
+            buffer = getattr(_capture, "buffer", None)
+            if buffer is not None:
+                buffer.append((self.name, document))
+                return
+
+        self.count += 1
+
+        # Send data to all connectors; those not accepting will drop it
+        for subscriber in self._subscribers:
+            subscriber.receive(document)
         # Finally, notify all subscribing callbacks
-        for callback in self.callbacks:
+        for callback in self._callbacks:
             callback(self.owner, document)
 
-    @property
-    def has_output(self):
-        if self.connections or self.callbacks:
-            return True
-        return False
-
     def _find_mimic_proto(self, visited=None):
         if not visited:
             visited = []
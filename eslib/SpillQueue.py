@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import Queue
+import os, io, struct
+import cPickle as pickle
+from collections import deque
+
+
+class SpillQueue(Queue.Queue):
+    """
+    A queue that keeps up to 'threshold' items in memory and spills the rest, in order, to append-only segment
+    files in the directory 'path'. Segments are deleted as soon as they have been consumed.
+
+    Segments left in the directory (from a previous run, or a process that died) are picked up again, ahead of
+    anything put on the queue. On close(), items still in memory are written to a segment of their own ahead of the
+    others, and the read position in the first segment is saved, so nothing queued is lost or repeated. If the
+    process dies instead, items held in memory are lost, and items in the segment being read may be delivered again.
+    A threshold of 0 sends everything through disk.
+    """
+
+    SUFFIX = ".seg"
+    POSITION_FILE = "position"
+
+    _header = struct.Struct("<I")
+
+    def __init__(self, path, threshold=10000, maxsize=0, segment_size=64*1024*1024):
+        self.path = path
+        self.threshold = threshold
+        self.segment_size = segment_size
+        Queue.Queue.__init__(self, maxsize)
+        self.unfinished_tasks = self._qsize()  # Items recovered from disk
+
+    #region Queue implementation
+
+    def _init(self, maxsize):
+        self.queue = deque()     # Items in memory; always older than the spilled ones
+        self.closed = False
+        self._segments = deque() # Entries of [sequence number, number of unread items, read offset], oldest first
+        self._spilled = 0        # Number of unread items in segments
+        self._writer = None      # File being appended to; always the last segment
+        self._write_size = 0
+        self._reader = None      # File being read from; always the first segment
+        self._consumed = None    # Path to a fully read segment, deleted once all its items have left memory
+        self._last_seq = 999999999  # Sequence number of the last segment created; never reused while open
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        for name in sorted(os.listdir(self.path)):
+            if name.endswith(self.SUFFIX):
+                seq = int(name[:-len(self.SUFFIX)])
+                count = self._recover(self._segment_path(seq))
+                if count:
+                    self._segments.append([seq, count, 0])
+                    self._spilled += count
+                    self._last_seq = max(self._last_seq, seq)
+                else:
+                    os.remove(self._segment_path(seq))
+
+        position_path = os.path.join(self.path, self.POSITION_FILE)
+        if os.path.exists(position_path):
+            with open(position_path) as f:
+                seq, offset, count = [int(v) for v in f.read().split()]
+            for segment in self._segments:
+                if segment[0] == seq:
+                    segment[1] -= count
+                    segment[2] = offset
+                    self._spilled -= count
+            os.remove(position_path)  # If we die from here on, the segment is read from the start again
+
+    def _qsize(self, len=len):
+        return len(self.queue) + self._spilled
+
+    def _put(self, item):
+        if self.closed:
+            raise ValueError("Put to a closed SpillQueue.")
+        if self._spilled or len(self.queue) >= self.threshold:
+            self._spill(item)
+        else:
+            self.queue.append(item)
+
+    def _get(self):
+        if not self.queue:
+            self._load()
+        return self.queue.popleft()
+
+    #endregion Queue implementation
+
+    #region Segment files
+
+    def _segment_path(self, seq):
+        return os.path.join(self.path, "%010d%s" % (seq, self.SUFFIX))
+
+    def _recover(self, path):
+        "Count the items in a segment, cutting off an incomplete item at the end (from a crash during write)."
+        count = 0
+        end = 0
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            while True:
+                header = f.read(self._header.size)
+                if len(header) < self._header.size:
+                    break
+                length, = self._header.unpack(header)
+                if end + self._header.size + length > size:
+                    break
+                f.seek(length, os.SEEK_CUR)
+                end += self._header.size + length
+                count += 1
+        if end < size:
+            with open(path, "r+b") as f:
+                f.truncate(end)
+        return count
+
+    def _spill(self, item):
+        if not self._writer or self._write_size >= self.segment_size:
+            if self._writer:
+                self._writer.close()
+            # Not the number of the last segment plus one; that may be a consumed segment, not deleted yet
+            self._last_seq += 1
+            seq = self._last_seq
+            self._writer = io.open(self._segment_path(seq), "ab")
+            self._write_size = 0
+            self._segments.append([seq, 0, 0])
+        data = pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+        self._writer.write(self._header.pack(len(data)))
+        self._writer.write(data)
+        self._write_size += self._header.size + len(data)
+        self._segments[-1][1] += 1
+        self._spilled += 1
+
+    def _load(self):
+        "Read the next chunk of items from the first segment into memory."
+        if self._consumed:
+            os.remove(self._consumed)
+            self._consumed = None
+
+        segment = self._segments[0]
+        seq = segment[0]
+        writing = len(self._segments) == 1 and self._writer
+        if writing:
+            self._writer.flush()
+        if not self._reader:
+            self._reader = io.open(self._segment_path(seq), "rb")
+            self._reader.seek(segment[2])
+
+        n = min(segment[1], max(self.threshold, 1000))
+        read = self._reader.read
+        size = self._header.size
+        for i in xrange(n):
+            length, = self._header.unpack(read(size))
+            self.queue.append(pickle.loads(read(length)))
+        segment[1] -= n
+        self._spilled -= n
+
+        if not segment[1]:
+            # All read; the segment can go as soon as the items have left memory. (Do not append to it any more.)
+            self._reader.close()
+            self._reader = None
+            if writing:
+                self._writer.close()
+                self._writer = None
+            self._segments.popleft()
+            self._consumed = self._segment_path(seq)
+
+    def close(self):
+        """
+        Save everything still queued to disk and release the files. The queue appears empty after this, and must
+        not be put to; create a new one on the same path to continue.
+        """
+        with self.mutex:
+            if self.closed:
+                return
+            self.closed = True
+
+            if self._consumed:
+                os.remove(self._consumed)
+                self._consumed = None
+            if self._writer:
+                self._writer.close()
+                self._writer = None
+            if self._reader:
+                self._segments[0][2] = self._reader.tell()
+                self._reader.close()
+                self._reader = None
+            for seq, count, offset in self._segments:
+                if offset:
+                    # Partly read, now or in a previous run. (Then the position file is gone, and the segment may
+                    # come after the one saved from memory in that run.) Only one segment can be partly read.
+                    with open(os.path.join(self.path, self.POSITION_FILE), "w") as f:
+                        f.write("%d %d %d" % (seq, offset, self._recover(self._segment_path(seq)) - count))
+                    break
+
+            if self.queue:
+                # Items in memory come before everything on disk
+                seq = self._segments[0][0] - 1 if self._segments else 1000000000
+                self._writer = open(self._segment_path(seq), "wb")
+                for item in self.queue:
+                    data = pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+                    self._writer.write(self._header.pack(len(data)))
+                    self._writer.write(data)
+                self._writer.close()
+                self._writer = None
+                self.queue.clear()
+
+            # Appears empty from now on
+            self._segments.clear()
+            self._spilled = 0
+
+    #endregion Segment files
@@ -72,16 +72,27 @@ import logging
 import logging.config
 
 class _ExtendedLogger(logging.getLoggerClass()):
+
+    serviceName  = None
+    className    = None
+    instanceName = None
+
+    def __init__(self, name, *args, **kwargs):
+        super(_ExtendedLogger, self).__init__(name, *args, **kwargs)
+        # Split once here, rather than for every record
+        self._names = name.split(".")
+
     def makeRecord(self, name, level, fn, lno, msg, args, exc_info, func=None, extra=None):
         rec = logging.LogRecord(name, level, fn, lno, msg, args, exc_info, func)
 
-        rec.serviceName = self.serviceName if hasattr(self, 'serviceName') else None
-        rec.className = self.className if hasattr(self, 'className') else None
-        rec.instanceName = self.instanceName if hasattr(self, 'instanceName') else None
+        rec.serviceName = self.serviceName
+        rec.className = self.className
+        rec.instanceName = self.instanceName
 
-        rec.firstName = name.split(".")[0]
-        rec.lastName = name.split(".")[-1]
-        rec.names = name.split(".")
+        names = self._names if name == self.name else name.split(".")
+        rec.firstName = names[0]
+        rec.lastName = names[-1]
+        rec.names = names
 
         return rec
 
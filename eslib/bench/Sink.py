@@ -0,0 +1,38 @@
+from ..Processor import Processor
+import time, threading
+
+
+class Sink(Processor):
+    """
+    Receive documents and record their latency, for benchmarking. The latency is the time from a Source sent a
+    document (its '_sent' field) until it arrived here. Documents without this field are only counted.
+
+    Connectors:
+        input      (*)       : Documents to count and measure.
+    """
+
+    def __init__(self, **kwargs):
+        super(Sink, self).__init__(**kwargs)
+        self.create_connector(self._incoming, "input", None, "Documents to count and measure.", batch=True)
+
+        self.latencies = []
+        self.last_time = 0  # Time of arrival for the last document
+        self.expected = 0   # When this many documents have arrived, 'done' is set; 0 means never
+        self.done = threading.Event()
+
+    def on_open(self):
+        self.count = 0
+        self.latencies = []
+        self.last_time = 0
+        self.done.clear()
+
+    def _incoming(self, documents):
+        now = time.time()
+        for doc in documents:
+            sent = doc.get("_sent") if hasattr(doc, "get") else None
+            if sent:
+                self.latencies.append(now - sent)
+        self.count += len(documents)
+        self.last_time = now
+        if self.expected and self.count >= self.expected:
+            self.done.set()
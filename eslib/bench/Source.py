@@ -0,0 +1,69 @@
+from ..Generator import Generator
+from ..esdoc import EsDoc
+import time
+
+
+class Source(Generator):
+    """
+    Generate synthetic 'esdoc' documents as fast as possible, or at a given rate, for benchmarking.
+    The time each document was sent is stored in its '_sent' field, for a Sink to compute the latency from.
+    The text contains some HTML and a recurring word, to give cleaners such as HtmlRemover and PatternRemover
+    something to do. Stops by itself after 'total' documents.
+
+    Sockets:
+        output     (esdoc)   : Synthetic documents.
+
+    Config:
+        total             = 10000   : Number of documents to generate.
+        rate              = 0       : Documents per second; 0 means as fast as possible.
+        text_size         = 20      : Number of sentences in the 'text' field.
+        compact           = False   : Send 'esdoc.EsDoc' instead of 'dict'.
+        chunk             = 1000    : Max number of documents to send per tick.
+    """
+
+    SENTENCE = u"<p>The <b>quick</b> brown fox jumps over the <i>lazy</i> dog, again and again.</p> "
+
+    def __init__(self, **kwargs):
+        super(Source, self).__init__(**kwargs)
+        self.output = self.create_socket("output", "esdoc", "Synthetic documents.")
+
+        self.config.set_default(
+            total     = 10000,
+            rate      = 0,
+            text_size = 20,
+            compact   = False,
+            chunk     = 1000
+        )
+
+        self.sleep = 0  # Generate continuously; the rate, if any, is kept in on_tick()
+        self._text = None
+        self._started = 0
+
+    def on_open(self):
+        self.total = self.config.total
+        self.count = 0
+        self._text = self.SENTENCE * self.config.text_size
+
+    def on_startup(self):
+        self._started = time.time()
+
+    def _create(self, i):
+        source = {"title": u"Document %d" % i, "text": self._text}
+        if self.config.compact:
+            return EsDoc(_index="bench", _type="doc", _id=str(i), _source=source, _sent=time.time())
+        return {"_index": "bench", "_type": "doc", "_id": str(i), "_source": source, "_sent": time.time()}
+
+    def on_tick(self):
+        n = min(self.config.chunk, self.total - self.count)
+        if self.config.rate:
+            due = int((time.time() - self._started) * self.config.rate)
+            n = min(n, due - self.count)
+        for i in xrange(n):
+            if self.end_tick_reason or self.suspended:
+                return
+            self.output.send(self._create(self.count))
+            self.count += 1
+        if self.count >= self.total:
+            self.stop()
+        elif self.config.rate and n <= 0:
+            time.sleep(1.0 / self.config.rate)
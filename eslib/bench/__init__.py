@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+"""
+eslib.bench
+~~~~~
+
+Synthetic sources, latency recording sinks and scenario runners for measuring eslib performance.
+"""
+
+
+from .Source    import Source
+from .Sink      import Sink
+from .scenarios import SCENARIOS, pipeline, fanout, chain
+from .runner    import run, report
+
+
+__all__ = (
+    "Source",
+    "Sink",
+    "SCENARIOS",
+    "pipeline",
+    "fanout",
+    "chain",
+    "run",
+    "report"
+)
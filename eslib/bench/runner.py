@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""
+Run benchmark scenarios and report throughput, latency, CPU usage and memory.
+"""
+
+import time, resource
+from .scenarios import SCENARIOS
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[int(fraction * (len(ordered) - 1))]
+
+
+def _lifecycle(func, config, kwargs):
+    "Measure the time it takes to restart the first sink and to stop the whole graph, while documents are flowing."
+    source, sinks = func(10**9, config, **dict(kwargs, rate=1000))
+    source.start()
+    time.sleep(0.2)
+
+    started = time.time()
+    sinks[0].restart()
+    restart = time.time() - started
+
+    time.sleep(0.1)
+    started = time.time()
+    source.stop()
+    for sink in sinks:
+        sink.wait()
+    stop = time.time() - started
+
+    return restart, stop
+
+
+def run(scenario, total=10000, config=None, timeout=None, **kwargs):
+    """
+    Run a scenario, named or given as a function (see scenarios), until all its sinks have received all documents.
+
+    :param scenario: Name of a scenario in SCENARIOS, or a scenario function.
+    :param int total: Number of documents to generate.
+    :param dict config: Config overrides for all processors in the scenario.
+    :param float timeout: Max seconds to wait for the sinks; None means no limit.
+    :param kwargs: Extra arguments to the scenario function, such as 'width' or 'depth', or config for the source.
+    :return dict: Result with 'docs' (received by all sinks together), 'elapsed', 'docs_per_sec',
+                  latency 'p50' and 'p99' (seconds), 'cpu' (seconds), 'cpu_percent' and 'peak_rss' (bytes),
+                  and the time it takes to 'restart' the first sink and to 'stop' the whole graph (seconds),
+                  measured on a second instance of the graph with documents flowing at a moderate rate.
+    """
+    func = SCENARIOS[scenario] if isinstance(scenario, basestring) else scenario
+    source, sinks = func(total, config, **kwargs)
+    for sink in sinks:
+        sink.expected = total
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_before = usage.ru_utime + usage.ru_stime
+    started = time.time()
+
+    source.start()
+    for sink in sinks:
+        sink.done.wait(timeout)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = usage.ru_utime + usage.ru_stime - cpu_before
+
+    elapsed = max([sink.last_time for sink in sinks] + [started]) - started
+    docs = sum(sink.count for sink in sinks)
+    latencies = sorted(latency for sink in sinks for latency in sink.latencies)
+
+    source.stop()
+    for sink in sinks:
+        sink.wait()
+
+    restart, stop = _lifecycle(func, config, kwargs)
+
+    return {
+        "scenario"     : scenario if isinstance(scenario, basestring) else func.__name__,
+        "docs"         : docs,
+        "elapsed"      : elapsed,
+        "docs_per_sec" : docs / elapsed if elapsed else 0.0,
+        "p50"          : _percentile(latencies, 0.50),
+        "p99"          : _percentile(latencies, 0.99),
+        "cpu"          : cpu,
+        "cpu_percent"  : 100.0 * cpu / elapsed if elapsed else 0.0,
+        "peak_rss"     : usage.ru_maxrss * 1024, # Reported in kilobytes on Linux
+        "restart"      : restart,
+        "stop"         : stop
+    }
+
+
+def report(results):
+    "Format a list of results from run() as a table."
+    lines = ["%-10s %9s %9s %11s %9s %9s %7s %9s %10s %9s" % ("scenario", "docs", "elapsed", "docs/s", "p50 ms", "p99 ms", "cpu %", "rss MB", "restart ms", "stop ms")]
+    for r in results:
+        lines.append("%-10s %9d %9.2f %11.0f %9.2f %9.2f %7.0f %9.1f %10.2f %9.2f" % (
+            r["scenario"], r["docs"], r["elapsed"], r["docs_per_sec"],
+            r["p50"] * 1000, r["p99"] * 1000, r["cpu_percent"], r["peak_rss"] / 1e6,
+            r["restart"] * 1000, r["stop"] * 1000))
+    return "\n".join(lines)
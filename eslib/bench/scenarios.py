@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+"""
+Common processing graphs for benchmarking. Each scenario function takes the number of documents to generate
+and config overrides for all processors (such as 'fuse', 'workers' or 'queue_capacity'), and returns the
+source and a list of sinks; everything else is connected in between.
+"""
+
+from ..procs import HtmlRemover, PatternRemover, Transformer
+from .Source import Source
+from .Sink import Sink
+
+
+def pipeline(total, config=None, **kwargs):
+    "Reader -> cleaners -> writer: Source -> HtmlRemover -> PatternRemover -> Sink."
+    config = config or {}
+    source = Source(name="source", total=total, **dict(config, **kwargs))
+    html = HtmlRemover(name="html", **config)
+    pattern = PatternRemover(name="pattern", pattern=r"\bagain\b", **config)
+    sink = Sink(name="writer", **config)
+    html.subscribe(source)
+    pattern.subscribe(html)
+    sink.subscribe(pattern)
+    return source, [sink]
+
+
+def fanout(total, config=None, width=4, **kwargs):
+    "One source sending to 'width' sinks."
+    config = config or {}
+    source = Source(name="source", total=total, **dict(config, **kwargs))
+    sinks = []
+    for i in range(width):
+        sink = Sink(name="sink%d" % i, **config)
+        sink.subscribe(source)
+        sinks.append(sink)
+    return source, sinks
+
+
+def chain(total, config=None, depth=10, **kwargs):
+    "A source, 'depth' pass-through processors in a row, and a sink."
+    config = config or {}
+    source = Source(name="source", total=total, **dict(config, **kwargs))
+    producer = source
+    for i in range(depth):
+        link = Transformer(lambda proc, doc: [doc], name="link%d" % i, **config)
+        link.subscribe(producer)
+        producer = link
+    sink = Sink(name="sink", **config)
+    sink.subscribe(producer)
+    return source, [sink]
+
+
+SCENARIOS = {
+    "pipeline" : pipeline,
+    "fanout"   : fanout,
+    "chain"    : chain
+}
@@ -6,10 +6,12 @@ eslib.debug
 
 Module containing functions useful for debugging.
 """
-import os
+from __future__ import absolute_import
 
+import os, sys, time, threading
 
-__all__ = ("byte_size_string", "get_memory_used")
+
+__all__ = ("byte_size_string", "get_memory_used", "profile")
 
 
 if os.name == 'posix':
@@ -35,3 +37,132 @@ def get_memory_used():
     else:
         0  # Don't want to risk an exception here..
         #raise NotImplementedError
+
+
+#region Sampling profiler
+
+# Innermost frames in these modules mean that the thread is waiting, not working.
+_IDLE_FILES = frozenset(["threading.py", "Queue.py", "queue.py", "SocketServer.py", "selectors.py", "socket.py"])
+
+_profile_lock = threading.Lock()
+
+
+def _owner(frame, Processor, Connector):
+    """
+    Find the processor and terminal a stack belongs to, from the innermost 'self' that is a processor or
+    connector. Connectors are fused into the sender's thread and processors are stepped by scheduler and
+    worker pool threads, so the stack tells more than the thread does.
+    """
+    processor = None
+    f = frame
+    while f:
+        code = f.f_code
+        if code.co_argcount and code.co_varnames[0] == "self":
+            obj = f.f_locals.get("self")
+            if isinstance(obj, Connector) and obj.owner is not None and processor in (None, obj.owner):
+                return obj.owner.name, obj.name
+            if processor is None and isinstance(obj, Processor):
+                processor = obj
+            if processor is not None and obj is processor and code.co_name == "_run_steps":
+                return processor.name, "(run loop)"
+        f = f.f_back
+    if processor is not None:
+        return processor.name, "(other)"
+    return None, None
+
+
+def _frame_label(code):
+    return "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+def profile(seconds=5.0, interval=0.01, idle=False):
+    """
+    Sample the stacks of all threads in this process every 'interval' seconds for 'seconds' seconds.
+    Nothing is hooked into the interpreter, so there is no cost when not profiling.
+
+    Each sample is attributed to the processor and terminal that owns the stack. Samples of threads
+    that are waiting (innermost frame in threading, Queue, socket, etc.) are left out unless 'idle' is set.
+
+    Returns a dict with:
+        collapsed  : Collapsed stacks, one "processor;terminal;frame;...;frame count" per line, outermost
+                     frame first, as used by flame graph tools.
+        processors : Per processor, the number of samples, their share of all samples, the share of the
+                     process CPU time spent in the period this corresponds to, and samples per terminal.
+        samples, seconds, cpu_seconds : Totals for the period.
+
+    :raises RuntimeError: A profile is already being taken.
+    """
+
+    from .Processor import Processor
+    from .Connector import Connector
+
+    if not _profile_lock.acquire(False):
+        raise RuntimeError("A profile is already being taken.")
+    try:
+        me = threading.current_thread().ident
+        names = {}
+        stacks = {}
+        owners = {}
+        total = 0
+
+        cpu_start = sum(os.times()[:2])
+        started = time.time()
+        deadline = started + seconds
+        while True:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if not idle and os.path.basename(frame.f_code.co_filename) in _IDLE_FILES:
+                    continue
+                proc_name, terminal_name = _owner(frame, Processor, Connector)
+                if proc_name is None:
+                    if not ident in names:
+                        names = dict((t.ident, t.name) for t in threading.enumerate())
+                    proc_name, terminal_name = "(none)", names.get(ident, "thread-%d" % ident)
+
+                labels = []
+                f = frame
+                while f:
+                    labels.append(_frame_label(f.f_code))
+                    f = f.f_back
+                labels.append(terminal_name)
+                labels.append(proc_name)
+                key = ";".join(reversed(labels))
+                stacks[key] = stacks.get(key, 0) + 1
+
+                terminals = owners.setdefault(proc_name, {})
+                terminals[terminal_name] = terminals.get(terminal_name, 0) + 1
+                total += 1
+            frame = f = None  # Don't keep the stacks alive while sleeping
+
+            now = time.time()
+            if now >= deadline:
+                break
+            time.sleep(min(interval, deadline - now))
+        elapsed = time.time() - started
+        cpu = sum(os.times()[:2]) - cpu_start
+    finally:
+        _profile_lock.release()
+
+    processors = {}
+    for proc_name, terminals in owners.iteritems():
+        count = sum(terminals.itervalues())
+        share = float(count) / total
+        processors[proc_name] = {
+            "samples"    : count,
+            "share"      : share,
+            "cpu_seconds": cpu * share,
+            "terminals"  : terminals
+        }
+
+    collapsed = "\n".join("%s %d" % (key, count) for key, count in sorted(stacks.iteritems()))
+
+    return {
+        "seconds"    : elapsed,
+        "samples"    : total,
+        "cpu_seconds": cpu,
+        "processors" : processors,
+        "collapsed"  : collapsed
+    }
+
+#endregion Sampling profiler
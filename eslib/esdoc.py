@@ -8,12 +8,13 @@ Module containing operations on "Elasticsearch type" documents (really just a di
 """
 
 
-__all__ = ("tojson", "createdoc", "getfield", "putfield")
+__all__ = ("tojson", "createdoc", "getfield", "getfields", "putfield", "shallowputfield", "FieldPath", "compile_path",
+           "Overlay", "EsDoc", "isdoc")
 
 
 from datetime import datetime
 from .time import date2iso
-import json
+import json, collections
 
 def _json_serializer_isodate(obj):
     """Default JSON serializer."""
@@ -23,68 +24,347 @@ def _json_serializer_isodate(obj):
             obj = obj - obj.utcoffset()
             obj = obj.replace(tzinfo=None)
         s = date2iso(obj)
+    elif isinstance(obj, EsDoc):
+        s = dict(obj)
     return s
 
 def tojson(doc):
     return json.dumps(doc, default=_json_serializer_isodate)
 
 
+class FieldPath(object):
+    """
+    A field path, such as "_source.user.name", split once. Code that handles the same path for many documents should
+    compile it with compile_path(), typically in on_open(), and use the FieldPath instead of the string. It can be
+    passed anywhere a field path string is accepted in this module.
+    """
+
+    __slots__ = ("path", "names", "_parents", "_last")
+
+    def __init__(self, path):
+        self.path = path
+        self.names = tuple(path.split("."))
+        self._parents = self.names[:-1]
+        self._last = self.names[-1]
+
+    def __repr__(self):
+        return "FieldPath(%r)" % self.path
+
+    def __str__(self):
+        return self.path
+
+    def __nonzero__(self):
+        return bool(self.path)
+
+    def get(self, doc, default=None):
+        "Get value for this path in 'doc' if it exits and is not None, otherwise return the default."
+        if doc is None:
+            return default
+        if not self.path:
+            return doc
+        d = doc
+        for f in self._parents:
+            if not d or not f in d:
+                return default
+            d = d[f]
+            if not isinstance(d, dict):
+                return default
+        v = d.get(self._last)
+        return default if v is None else v
+
+    def getmany(self, docs, default=None):
+        "Get the value for this path from each of 'docs', as a list, with 'default' where missing or None."
+        get = self.get
+        return [get(doc, default) for doc in docs]
+
+    def put(self, doc, value):
+        "Add or update this path in 'doc' with 'value'."
+        if doc is None:
+            return
+        d = doc
+        for i, f in enumerate(self._parents):
+            if f in d:
+                d = d[f]
+                if not isinstance(d, dict):
+                    raise AttributeError("Node at '%s' is not a dict." % ".".join(self.names[:i+1]))
+            else:
+                dd = {}
+                d[f] = dd
+                d = dd
+        d[self._last] = value  # OBS: This also overwrites a node if this is was a node
+
+
+_compiled_paths = {}  # Path string -> FieldPath
+_MAX_COMPILED_PATHS = 10000
+
+def compile_path(fieldpath):
+    "Return a FieldPath for 'fieldpath', reusing the one from earlier calls with the same string."
+    if isinstance(fieldpath, FieldPath):
+        return fieldpath
+    fp = _compiled_paths.get(fieldpath)
+    if fp is None:
+        if len(_compiled_paths) >= _MAX_COMPILED_PATHS:
+            _compiled_paths.clear()  # Paths built from data rather than config; do not grow forever
+        fp = _compiled_paths[fieldpath] = FieldPath(fieldpath)
+    return fp
+
+
 def getfield(doc, fieldpath, default=None):
     "Get value for 'fieldpath' if it exits and is not None, otherwise return the default."
-    if doc is None or fieldpath is None:
-        return default
-    if fieldpath == "":
-        return doc
-    fp = fieldpath.split(".")
-    d = doc
-    for f in fp[:-1]:
-        if not d or not f in d or not isinstance(d[f], dict):
-            return default
-        d = d[f]
-    if d is None:
+    if fieldpath is None:
         return default
-    v = d.get(fp[-1])
-    return default if v is None else v
+    return compile_path(fieldpath).get(doc, default)
+
+def getfields(docs, fieldpath, default=None):
+    "Get value for 'fieldpath' from each of 'docs', as a list, with the default where missing or None."
+    if fieldpath is None:
+        return [default] * len(docs)
+    return compile_path(fieldpath).getmany(docs, default)
 
 
 def putfield(doc, fieldpath, value):
     "Add or update 'fieldpath' with 'value'."
-    if doc is None or fieldpath is None:
+    if fieldpath is None:
         return
-    fp = fieldpath.split(".")
-    d = doc
-    for i, f in enumerate(fp[:-1]):
-        if f in d:
-            d = d[f]
-            if not isinstance(d, dict):
-                raise AttributeError("Node at '%s' is not a dict." % ".".join(fp[:i+1]))
-        else:
-            dd = {}
-            d[f] = dd
-            d = dd
-    d[fp[-1]] = value  # OBS: This also overwrites a node if this is was a node
+    compile_path(fieldpath).put(doc, value)
 
 def shallowputfield(doc, fieldpath, value):
     "Clone as little as needed of 'doc' and add the field from 'fieldpath'. Returns the new cloned doc"
     if not doc or not fieldpath: return
-    fp = fieldpath.split(".")
-    doc_clone = doc.copy()  # Shallow clone
-    d = doc
-    d_clone = doc_clone
-    for i, f in enumerate(fp[:-1]):
-        if f in d:
-            d = d[f]
-            if not type(d) is dict:
-                raise Exception("Node at '%s' is not a dict." % ".".join(fp[:i+1]))
-            d_clone[f] = d.copy()  # Create shallow clone of the next level
-            d_clone = d_clone[f]
+    return Overlay(doc).putfield(fieldpath, value).materialize()
+
+
+_REMOVED = object()  # Marks a field removed in an Overlay
+
+class Overlay(object):
+    """
+    Modifications to a document that must not be changed itself, typically because it is shared with other
+    subscribers of the same socket. Nothing is copied while modifications are recorded. materialize() then
+    returns a new document where only the nodes on the paths to modified fields are cloned, each only once
+    no matter how many fields are modified below it, and everything else is shared with the original.
+
+    Example:
+        overlay = Overlay(doc)
+        overlay.putfield("_source.title", title)
+        overlay.putfield("_source.text", text)
+        doc = overlay.materialize()
+    """
+
+    def __init__(self, doc):
+        self.doc = doc
+        self._fields = []  # List of (FieldPath, value), in order of modification
+
+    @property
+    def modified(self):
+        return bool(self._fields)
+
+    def putfield(self, fieldpath, value):
+        "Add or update 'fieldpath' with 'value'. Returns self."
+        self._fields.append((compile_path(fieldpath), value))
+        return self
+
+    def removefield(self, fieldpath):
+        "Remove 'fieldpath', if it exists. Returns self."
+        self._fields.append((compile_path(fieldpath), _REMOVED))
+        return self
+
+    def getfield(self, fieldpath, default=None):
+        """
+        Get value for 'fieldpath' as modified, or from the original document, as with getfield().
+        Note that a node above modified fields is returned as in the original document.
+        """
+        if isinstance(fieldpath, FieldPath):
+            fieldpath = fieldpath.path
+        for path, value in reversed(self._fields):
+            path = path.path
+            if path == fieldpath:
+                return default if value is _REMOVED or value is None else value
+            if fieldpath.startswith(path + "."):
+                if value is _REMOVED:
+                    return default
+                return getfield(value, fieldpath[len(path)+1:], default)
+        return getfield(self.doc, fieldpath, default)
+
+    def materialize(self):
+        "Return the modified document; the original itself if there are no modifications."
+        if not self._fields:
+            return self.doc
+        root = self.doc.copy()
+        owned = {id(root): root}  # Nodes cloned or created here, that we may modify
+        for fieldpath, value in self._fields:
+            fp = fieldpath.names
+            if value is _REMOVED and not Overlay._exists(root, fp):
+                continue  # Nothing to remove, and nothing to clone
+            d = root
+            for i, f in enumerate(fp[:-1]):
+                node = d.get(f)
+                if node is None:
+                    node = {}
+                    owned[id(node)] = node
+                    d[f] = node
+                elif not isinstance(node, dict):
+                    raise AttributeError("Node at '%s' is not a dict." % ".".join(fp[:i+1]))
+                elif not id(node) in owned:
+                    node = node.copy()
+                    owned[id(node)] = node
+                    d[f] = node
+                d = node
+            if value is _REMOVED:
+                del d[fp[-1]]
+            else:
+                d[fp[-1]] = value  # OBS: This also overwrites a node if this is was a node
+        return root
+
+    @staticmethod
+    def _exists(d, fp):
+        for f in fp[:-1]:
+            d = d.get(f)
+            if not isinstance(d, dict):
+                return False
+        return fp[-1] in d
+
+_MISSING = object()
+
+class EsDoc(object):
+    """
+    Compact alternative to a 'dict' for "esdoc" documents, with the common meta fields and '_source' stored in
+    slots instead of a hash table. It behaves as a mutable mapping, so getfield(), putfield(), Overlay, tojson()
+    and processors reading documents like dicts work with it. Any other top level fields are kept in a dict of
+    their own, only created when needed. Use isdoc() rather than checking for 'dict' when either will do.
+    """
+
+    FIELDS = ("_index", "_type", "_id", "_version", "_score", "_parent", "_timestamp", "_retry", "_source")
+    __slots__ = FIELDS + ("_other",)
+
+    def __init__(self, *args, **kwargs):
+        self._other = None
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, key):
+        if key in _ESDOC_FIELDS:
+            value = getattr(self, key, _MISSING)
+            if value is not _MISSING:
+                return value
+        elif self._other and key in self._other:
+            return self._other[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in _ESDOC_FIELDS:
+            setattr(self, key, value)
+        else:
+            if self._other is None:
+                self._other = {}
+            self._other[key] = value
+
+    def __delitem__(self, key):
+        if key in _ESDOC_FIELDS:
+            if getattr(self, key, _MISSING) is _MISSING:
+                raise KeyError(key)
+            delattr(self, key)
+        elif self._other and key in self._other:
+            del self._other[key]
         else:
-            dd = {}  # Create a new node
-            d_clone.update({f:dd})
-            d_clone = dd
-    d_clone[fp[-1]] = value  # OBS: This also overwrites a node if this is was a node
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in _ESDOC_FIELDS:
+            return getattr(self, key, _MISSING) is not _MISSING
+        return bool(self._other) and key in self._other
+
+    def __iter__(self):
+        for key in EsDoc.FIELDS:
+            if getattr(self, key, _MISSING) is not _MISSING:
+                yield key
+        if self._other:
+            for key in self._other:
+                yield key
+
+    def __len__(self):
+        n = len(self._other) if self._other else 0
+        for key in EsDoc.FIELDS:
+            if getattr(self, key, _MISSING) is not _MISSING:
+                n += 1
+        return n
+
+    def __eq__(self, other):
+        if isinstance(other, (dict, EsDoc)):
+            return dict(self.iteritems()) == dict(other.iteritems())
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None  # Mutable
+
+    def __repr__(self):
+        return "EsDoc(%r)" % dict(self.iteritems())
+
+    def __reduce__(self):
+        return (EsDoc, (dict(self.iteritems()),))
+
+    def get(self, key, default=None):
+        if key in _ESDOC_FIELDS:
+            value = getattr(self, key, _MISSING)
+            return default if value is _MISSING else value
+        if self._other:
+            return self._other.get(key, default)
+        return default
+
+    def pop(self, key, default=_MISSING):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            if default is _MISSING:
+                raise KeyError(key)
+            return default
+        del self[key]
+        return value
+
+    def setdefault(self, key, default=None):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            self[key] = value = default
+        return value
+
+    def update(self, *args, **kwargs):
+        for other in args + (kwargs,):
+            items = other.iteritems() if hasattr(other, "iteritems") else other
+            for key, value in items:
+                self[key] = value
+
+    def copy(self):
+        "Shallow copy, as for a 'dict'."
+        return EsDoc(self.iteritems())
+
+    def iterkeys(self):
+        return iter(self)
+
+    def itervalues(self):
+        for key in self:
+            yield self[key]
+
+    def iteritems(self):
+        for key in self:
+            yield (key, self[key])
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+_ESDOC_FIELDS = frozenset(EsDoc.FIELDS)
+collections.MutableMapping.register(EsDoc)
+
+
+def isdoc(doc):
+    "Whether 'doc' is a document; a 'dict' or an 'EsDoc'."
+    return isinstance(doc, (dict, EsDoc))
 
-    return doc_clone
 
 def createdoc(source, index=None, doctype=None, id=None):
     doc = {"_source": source}
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+"""
+eslib.logs
+~~~~~~~~~~
+
+Logging handlers and filters that keep logging out of the way of document processing.
+"""
+from __future__ import absolute_import
+
+import logging, threading, time, os, Queue
+
+
+__all__ = ("AsyncHandler", "RateLimitFilter", "install_async")
+
+
+class AsyncHandler(logging.Handler):
+    """
+    Handler that puts records on a queue and leaves it to a background thread to pass them on to 'handlers'.
+    The message is formatted before the record is queued, so it is not affected by later changes to the arguments.
+
+    If more than 'maxsize' records are waiting, new records are dropped rather than blocking the thread that logs.
+    The number of dropped records is counted in 'dropped', and reported with the next record that gets through.
+
+    The background thread does not exist in a forked child process, so records logged there are passed on directly,
+    in the thread that logs. (They would otherwise never be written, or be lost when the child exits.)
+    """
+
+    def __init__(self, handlers, maxsize=10000):
+        logging.Handler.__init__(self)
+        self.handlers = list(handlers)
+        self.dropped = 0
+        self._reported = 0
+        self._queue = Queue.Queue(maxsize)
+        self._pid = os.getpid()  # Process the background thread runs in
+        self._forked_pid = None  # Child process the handlers have been prepared for, when forked
+        self._fork_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="AsyncHandler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging._defaultFormatter.formatException(record.exc_info)
+            record.exc_info = None  # Do not keep the frames alive in the queue
+        return record
+
+    def emit(self, record):
+        if os.getpid() != self._pid:
+            self._emit_forked(record)
+            return
+        try:
+            self._queue.put_nowait(self.prepare(record))
+        except Queue.Full:
+            self.dropped += 1
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+    def _emit_forked(self, record):
+        pid = os.getpid()
+        if self._forked_pid != pid:
+            with self._fork_lock:
+                if self._forked_pid != pid:
+                    # The background thread may have held handler locks when we were forked; it never releases them here
+                    for handler in self.handlers:
+                        handler.createLock()
+                    self._forked_pid = pid
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _run(self):
+        queue = self._queue
+        while True:
+            record = queue.get()
+            try:
+                if record is None:
+                    return
+                dropped = self.dropped
+                if dropped != self._reported:
+                    record.msg = "(%d log records dropped) %s" % (dropped - self._reported, record.msg)
+                    self._reported = dropped
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+            except:
+                pass  # Nowhere to report it; the handlers report their own errors
+            finally:
+                queue.task_done()
+
+    def flush(self):
+        "Wait until all queued records have been handled."
+        if self._thread.is_alive():
+            self._queue.join()
+        for handler in self.handlers:
+            handler.flush()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        for handler in self.handlers:
+            handler.flush()
+        logging.Handler.close(self)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Filter that lets through at most 'rate' records per second, with bursts of up to 'burst' records, for each logger
+    at or below 'name'. Records from other loggers pass freely. When over the limit, every 'sample'th record is still
+    let through (0 means none). The number of records suppressed is reported with the next record that gets through.
+
+    Put it on a handler rather than a logger, so that it also applies to records from loggers below 'name'.
+    'clock' returns the current time in seconds.
+    """
+
+    def __init__(self, name="", rate=10.0, burst=100, sample=0, clock=time.time):
+        logging.Filter.__init__(self, name)
+        self.rate = rate
+        self.burst = burst
+        self.sample = sample
+        self.clock = clock
+        self._buckets = {}  # Logger name -> [tokens, time of last refill, number suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not logging.Filter.filter(self, record):
+            return True  # Not ours to limit
+
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(record.name)
+            if bucket is None:
+                bucket = self._buckets[record.name] = [self.burst, now, 0]
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+            else:
+                bucket[0] = tokens
+                bucket[2] += 1
+                if not self.sample or bucket[2] % self.sample:
+                    return False
+                bucket[2] -= 1  # This one is a sample, not suppressed
+            suppressed = bucket[2]
+            bucket[2] = 0
+
+        if suppressed:
+            record.msg = "(%d similar log records suppressed) %s" % (suppressed, record.getMessage())
+            record.args = None
+        return True
+
+
+def install_async(logger_names=("servicelog", "proclog", "doclog", ""), maxsize=10000):
+    """
+    Move the handlers of the named loggers behind AsyncHandlers. Loggers with the same handlers share one
+    AsyncHandler, and thereby one thread. Returns the AsyncHandlers created.
+    """
+
+    async_handlers = {}
+    for name in logger_names:
+        logger = logging.getLogger(name)
+        handlers = [h for h in logger.handlers if not isinstance(h, AsyncHandler)]
+        if not handlers:
+            continue
+        key = tuple(handlers)
+        async_handler = async_handlers.get(key)
+        if not async_handler:
+            async_handler = async_handlers[key] = AsyncHandler(handlers, maxsize)
+        for handler in handlers:
+            logger.removeHandler(handler)
+        logger.addHandler(async_handler)
+    return async_handlers.values()
@@ -61,11 +61,12 @@ class BlacklistFilter(Processor):
     def on_open(self):
 
         # Create field list
-        self._fields = []
+        fields = []
         if self.config.field:
-            self._fields.append(self.config.field)
+            fields.append(self.config.field)
         if self.config.fields:
-            self._fields.extend(self.config.fields)
+            fields.extend(self.config.fields)
+        self._fields = [esdoc.compile_path(field) for field in fields]
 
         # Create filter regexes
         self._filters = []
@@ -115,7 +116,7 @@ class BlacklistFilter(Processor):
             if self._global_whitelist_regex and self._global_whitelist_regex.search(doc):
                 return True  # Hit in global whitelist
             return self._check_text(doc)
-        elif not type(doc) is dict:
+        elif not esdoc.isdoc(doc):
             self.doclog.debug("Unsupported document type '%s'." % type(doc))
             return True  # So this silly document will pass through unfiltered...
 
@@ -123,8 +124,8 @@ class BlacklistFilter(Processor):
         if not source:
             return True  # Missing source section; don't do anything and let it pass through unfiltered...
 
-        for field in self._fields:
-            text = esdoc.getfield(source, field)
+        for path in self._fields:
+            text = path.get(source)
             if text and type(text) in [str, unicode]:
                 if self._global_whitelist_regex and self._global_whitelist_regex.search(text):
                     return True  # Hit in global whitelist
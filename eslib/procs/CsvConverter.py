@@ -2,6 +2,7 @@ __author__ = 'Hans Terje Bakke'
 
 import csv, codecs
 from ..Processor import Processor
+from ..esdoc import EsDoc
 
 class CsvConverter(Processor):
     """
@@ -25,6 +26,7 @@ class CsvConverter(Processor):
         columns           = None     : List of columns to pick from the CSV input. Use None for columns to ignore.
         skip_first_line   = False    : Skip first line of the input. (Typically column headers you don't want.
         delimiter         = ","      : CSV column delimiter character.
+        compact           = False    : Send documents as 'esdoc.EsDoc' instead of 'dict', to save memory.
 
         id_field          = "_id"    : Name of field to map to meta field '_id'.
         index_field       = "_index" : Name of field to map to meta field '_index'.
@@ -42,6 +44,7 @@ class CsvConverter(Processor):
             columns         = None,
             skip_first_line = False,
             delimiter       = ",",
+            compact         = False,
 
             id_field        = "_id",
             index_field     = "_index",
@@ -98,6 +101,9 @@ class CsvConverter(Processor):
                 doc.update({self._columns[i]: csvrow[i]})
 
         # Convert to Elasticsearch type document
-        esdoc = {"_index":self.config.index or index, "_type":self.config.doctype or doctype, "_id":id, "_source":doc}
+        if self.config.compact:
+            esdoc = EsDoc(_index=self.config.index or index, _type=self.config.doctype or doctype, _id=id, _source=doc)
+        else:
+            esdoc = {"_index":self.config.index or index, "_type":self.config.doctype or doctype, "_id":id, "_source":doc}
 
         self.output.send(esdoc)
@@ -30,7 +30,7 @@ class DateExpander(Processor):
     """
     def __init__(self, **kwargs):
         super(DateExpander, self).__init__(**kwargs)
-        self._input = self.create_connector(self._incoming, 'input', 'esdoc', "Incoming.")
+        self._input = self.create_connector(self._incoming, 'input', 'esdoc', "Incoming.", batch=True)
         self._output = self.create_socket('output', 'esdoc', "Outgoing, with configured date field expanded.")
 
         self.config.set_default(
@@ -38,12 +38,27 @@ class DateExpander(Processor):
             target_field='date_fields'
         )
 
-    def _incoming(self, doc):
+        self._source_path = None
+        self._target_path = None
+
+    def on_open(self):
+        self._source_path = esdoc.compile_path("_source." + self.config.source_field)
+        self._target_path = esdoc.compile_path("_source." + self.config.target_field)
+
+    def _incoming(self, docs):
         if self._output.has_output:
-            self._output.send(self._process(doc))
+            for doc in docs:
+                try:
+                    expanded = self._process(doc)
+                except Exception as e:
+                    msg = "Unhandled exception in processor '%s' while expanding a date -- dropped." % self.name
+                    self.doclog.exception(msg)
+                    self.log.exception(msg)
+                    continue
+                self._output.send(expanded)
 
     def _process(self, doc):
-        value = esdoc.getfield(doc, "_source." + self.config.source_field)
+        value = self._source_path.get(doc)
         if value is None:
             self.doclog.warning(
                 "Document '%s' is missing field or value in '%s'."
@@ -65,4 +80,4 @@ class DateExpander(Processor):
 
         # Create a new document (if necessary) with just the minimum cloning necessary,
         # leaving references to the rest.
-        return esdoc.shallowputfield(doc, '_source.' + self.config.target_field, date_dict)
+        return esdoc.shallowputfield(doc, self._target_path, date_dict)
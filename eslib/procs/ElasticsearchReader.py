@@ -3,7 +3,7 @@ __author__ = 'Hans Terje Bakke'
 import elasticsearch
 from ..Generator import Generator
 from ..time import date2iso
-from ..esdoc import getfield
+from ..esdoc import getfield, EsDoc
 from time import sleep
 
 class ElasticsearchReader(Generator):
@@ -19,6 +19,7 @@ class ElasticsearchReader(Generator):
         doctype           = False   : Document type override. If set, use this type instead of documents' '_type' (if any).
         update_fields     = []      : If specified, only this list of fields will be updated in existing documents.
         batchsize         = 1000    : Size of batch to send to Elasticsearch; will queue up until batch is ready to send.
+        compact           = False   : Send documents as 'esdoc.EsDoc' instead of 'dict', to save memory.
     """
 
     def __init__(self, **kwargs):
@@ -36,7 +37,8 @@ class ElasticsearchReader(Generator):
             timefield  = "_timestamp",
             size       = 50, # Number of items to retrieve *per shard* per call to Elasticsearch
             scroll_ttl = "10m", # Must be long enough to process one batch of results (and suspend..)
-            scan       = True # For efficiency; disable this when sorting
+            scan       = True, # For efficiency; disable this when sorting
+            compact    = False
         )
 
         self._es = None
@@ -169,7 +171,7 @@ class ElasticsearchReader(Generator):
                         if "fields" in hit:
                             del hit["fields"]
 
-                        self.output.send(hit)
+                        self.output.send(EsDoc(hit) if self.config.compact else hit)
                         self.count += 1
                         if self.config.limit and self.count >= self.config.limit:
                             if (remaining > 0):
@@ -1,16 +1,64 @@
 __author__ = 'Hans Terje Bakke'
 
-# TODO: 'config.hosts': WTF... what happens with the indexing result if there are multiple hosts?? Is only the first
-# TODO:  one answering really used?
-
 # TODO: Test update_fields with new documents, and see if all fields are created or only those listed.
 # TODO: Also verify that only mentioned fields are changed in existing documents.
 
 import elasticsearch
-from Queue import Queue
-from threading import Lock
-import copy, time
+import json
+from Queue import Queue, Empty
+from threading import Lock, Condition
+import threading, inspect
+import time, random, heapq, itertools
+from collections import deque
 from ..Generator import Generator
+from ..Processor import ProcessorStatistics
+from .. import esdoc
+
+
+_RETRYABLE_STATUS = frozenset([429, 502, 503, 504])  # Rejected by an overloaded cluster, or a node not available
+
+# One compact encoder for all bulk lines; json.dumps() with 'default' creates a new encoder for each call
+_encode = json.JSONEncoder(default=esdoc._json_serializer_isodate, separators=(",", ":")).encode
+
+
+class BulkStatistics(ProcessorStatistics):
+    "Processor statistics with counters for the bulk requests of an ElasticsearchWriter."
+
+    def __init__(self, owner):
+        super(BulkStatistics, self).__init__(owner)
+        self._lock = Lock()
+        self.bulk_count     = 0    # Number of bulk requests completed, including failed ones
+        self.bulk_failed    = 0    # Number of bulk requests that failed (after resubmits)
+        self.bulk_documents = 0    # Number of documents in the bulk requests
+        self.bulk_bytes     = 0    # Size of the bulk request bodies
+        self.bulk_time      = 0.0  # Total time spent in bulk requests, in seconds; more than elapsed when concurrent
+        self.retried        = 0    # Number of documents scheduled for another attempt
+
+    def add_bulk(self, documents, size, duration, failed):
+        with self._lock:
+            self.bulk_count += 1
+            self.bulk_documents += documents
+            self.bulk_bytes += size
+            self.bulk_time += duration
+            if failed:
+                self.bulk_failed += 1
+
+    def get(self):
+        stats = super(BulkStatistics, self).get()
+        elapsed = stats["elapsed"]
+        stats["bulk"] = {
+            "count"                : self.bulk_count,
+            "failed"               : self.bulk_failed,
+            "documents"            : self.bulk_documents,
+            "bytes"                : self.bulk_bytes,
+            "batch_limit"          : self.processor._batch_limit,
+            "time"                 : self.bulk_time,
+            "inflight"             : len(self.processor._inflight),
+            "retried"              : self.retried,
+            "retry_queue"          : len(self.processor._retries) + self.processor._held_count,
+            "documents_per_second" : self.bulk_documents / elapsed if elapsed else 0.0
+        }
+        return stats
 
 
 class ElasticsearchWriter(Generator):
@@ -34,13 +82,50 @@ class ElasticsearchWriter(Generator):
         doctype           = None    : Document type override. If set, use this type instead of documents' '_type' (if any).
         update_fields     = []      : If specified, only this list of fields will be updated in existing documents.
         batchsize         = 1000    : Size of batch to send to Elasticsearch; will queue up until batch is ready to send.
+        batch_bytes       = 10485760 : Max size of a batch, as serialized for the bulk request. (At least one document.)
+        target_latency    = 0       : If set, adjust the batch size between 'min_batchsize' and 'batchsize' to have bulk
+                                      requests take about this many seconds.
+        min_batchsize     = 10      : Lower limit when adjusting the batch size.
         batchtime         = 5.0     : Submit an incomplete batch if 'batchtime' seconds have elapsed since last shipment.
-        max_resubmits     = 0       : Number of resubmits allowed per failed batch or failed document before giving up.
+        max_retries       = 3       : Number of times to retry a document that failed for a reason that may pass.
+        retry_delay       = 0.5     : Delay in seconds before the first retry; doubled for each attempt, with jitter.
+        retry_max_delay   = 30.0    : Max delay in seconds between retries.
+        max_resubmits     = 0       : Documents fed back with a '_retry' count above this are dropped.
+        connections       = 10      : Max number of kept-alive HTTP connections per host.
+        timeout           = 60.0    : Timeout in seconds for each bulk request.
+        sniff             = False   : Discover the other nodes in the cluster from 'hosts', on open and when a node fails.
+        compress          = False   : Compress bulk request bodies with gzip.
+        max_inflight      = 1       : Max number of bulk requests in flight at the same time.
+
+    One client is kept open from on_open() to on_close(), keeping its connections alive between batches. Requests
+    are spread round-robin over the hosts, and a host that fails is left out for a while, with the request retried on
+    another host.
+
+    Documents are serialized to bulk request lines as they arrive, in the thread of the sender, so a batch is sent as
+    the lines joined. Batches are limited both by number of documents and by size in bytes. With 'target_latency', the number of
+    documents is adjusted after each bulk request, shrinking when requests are slow or documents are rejected by an
+    overloaded cluster (HTTP 429), and growing when requests are fast.
+
+    A document that fails because the cluster is overloaded (HTTP 429) or a node is unavailable (HTTP 502-504, or a
+    connection error or timeout for the whole request) is retried up to 'max_retries' times. The retries are sent with
+    exponential backoff, ahead of new documents, and never before an earlier failed version of the same '_id'. A
+    document is not retried if a later version of it was written in the same batch, since the retry would overwrite
+    it. Other failures, and documents out of retries, go to the 'error' socket right away, with their '_retry' count
+    increased.
+    The writer reports congestion while it has documents waiting to be retried, so producers upstream slow down.
+
+    With 'max_inflight' above 1, batches are sent from separate worker threads, so that the next batches can be sent
+    while waiting for a response. A batch is held back while another batch in flight has a document with the same
+    '_id', so writes to a document are still done in order. Results are sent to the 'output' and 'error' sockets in
+    the order the batches were taken from the queue. Throughput is reported under "bulk" in stats.get().
+
+    With 'spill_dir' set (see Processor), incoming documents are held back while the bulk queue is congested, so that
+    a backlog builds up in the connector queue, which spills to disk, instead of in memory.
     """
 
     def __init__(self, **kwargs):
         super(ElasticsearchWriter, self).__init__(**kwargs)
-        self.create_connector(self._incoming, "input", "esdoc", "Incoming documents for writing to configured index.")
+        self.create_connector(self._incoming, "input", "esdoc", "Incoming documents for writing to configured index.", batch=True)
         self.output = self.create_socket("output", "esdoc", "Modified documents successfully written to Elasticsearch.")
         self.error_output = self.create_socket("error", "esdoc", "Modified documents that failed a write to Elasticsearch.")
 
@@ -51,29 +136,114 @@ class ElasticsearchWriter(Generator):
             update_fields = [],
             batchsize     = 1000,
             batchtime     = 5.0,
-            max_resubmits = 0
+            batch_bytes   = 10*1024*1024,
+            target_latency = 0,
+            min_batchsize = 10,
+            max_retries   = 3,
+            retry_delay   = 0.5,
+            retry_max_delay = 30.0,
+            max_resubmits = 0,
+            connections   = 10,
+            timeout       = 60.0,
+            sniff         = False,
+            compress      = False,
+            max_inflight  = 1
             # TODO: SHALL WE USE AN OPTIONAL ALTERNATIVE TIMESTAMP FIELD FOR PROCESSED/INDEXED TIME? (OR NOT?)
             #timefield    = "_timestamp"
         )
 
         self._queue = Queue()
         self._queue_lock = Lock()
+        self._queue_room = Condition(self._queue_lock)  # Notified when documents are taken off the queue
+        self._queue_bytes = 0  # Size of the serialized documents in the queue
         self._last_batch_time = 0
+        self._batch_limit = self.config.batchsize  # Current max number of documents per batch; set with the queue lock
+        self._es = None
+
+        self.stats = BulkStatistics(self)
+
+        # Concurrent bulk requests
+        self._batches = Queue()                     # Tuples of (seq, items, body) for the bulk workers
+        self._bulk_workers = []
+        self._inflight = {}                         # Sequence number -> set of '_id's, for each batch in flight
+        self._inflight_ids = set()
+        self._completed = {}                        # Sequence number -> (items, response, error), waiting to be emitted
+        self._inflight_changed = Condition(Lock())  # Guards the above; notified when a batch is done
+        self._emit_lock = Lock()
+        self._next_seq = 0
+        self._next_emit = 0
+
+        # Retries; guarded by the queue lock
+        self._retries = []                          # Heap of (due time, sequence number, entry, attempt)
+        self._held = {}                             # '_id' with an entry to retry -> deque of (entry, attempt) behind it
+        self._held_count = 0                        # Number of entries in '_held'
+        self._retry_seq = itertools.count()
+
+        # Tick only when woken by incoming documents or when a batch timer is due
+        self.sleep = None
+
+    @staticmethod
+    def _client_supports_compress():
+        "Whether the installed elasticsearch client can gzip request bodies. (Older clients reject 'http_compress'.)"
+        try:
+            return "http_compress" in inspect.getargspec(elasticsearch.Urllib3HttpConnection.__init__).args
+        except (AttributeError, TypeError):
+            return False
+
+    def _create_client(self):
+        settings = self.settings
+        options = {}
+        if settings.compress:
+            options["http_compress"] = True
+        return elasticsearch.Elasticsearch(
+            settings.hosts if settings.hosts else None,
+            maxsize                  = settings.connections,
+            timeout                  = settings.timeout,
+            retry_on_timeout         = True,
+            sniff_on_start           = settings.sniff,
+            sniff_on_connection_fail = settings.sniff,
+            sniffer_timeout          = 60 if settings.sniff else None,
+            **options
+        )
+
+    def _close_client(self):
+        if self._es:
+            try:
+                self._es.transport.close()
+            except Exception as e:
+                self.log.warning("Failed to close Elasticsearch connections: %s: %s" % (e.__class__.__name__, e))
+            self._es = None
+
+    def _queue_limit(self):
+        return self.settings.batchsize * 10 if self.settings.batchsize else 10000
 
     def is_congested(self):
-        if super(ElasticsearchWriter, self).is_congested():
-            return True
-        if self.config.batchsize:
-            if self._queue.qsize() > self.config.batchsize * 10:
-                return True
-        elif self._queue.qsize() > 10000:
-            return True
-        return False
+        self.set_congested("queue", self._queue.qsize() + len(self._retries) + self._held_count > self._queue_limit())
+        self.set_congested("cluster", bool(self._retries or self._held))
+        return super(ElasticsearchWriter, self).is_congested()
+
+    def _wait_for_room(self):
+        "Hold back while the queue is congested. (Not while stopping; the queue is only emptied after the input.)"
+        limit = self._queue_limit()
+        with self._queue_room:
+            while self._queue.qsize() > limit and self.running and not self.stopping:
+                self._queue_room.wait(1.0)
+
+    def _incoming(self, documents):
+        entries = []
+        for document in documents:
+            entry = self._prepare(document)
+            if entry:
+                entries.append(entry)
+        if entries:
+            self._add_many(entries)
+
+    def _prepare(self, document):
+        "Return a tuple of (document, bulk lines) for the bulk queue, or None if the document cannot be written."
 
-    def _incoming(self, document):
         id = document.get("_id")
-        index = self.config.index or document.get("_index")
-        doctype = self.config.doctype or document.get("_type")
+        index = self.settings.index or document.get("_index")
+        doctype = self.settings.doctype or document.get("_type")
 
         if not index:
             self.doclog.error("Missing '_index' field in input and no override.")
@@ -91,135 +261,503 @@ class ElasticsearchWriter(Generator):
             if parent:
                 meta["_parent"] = parent
 
-            if self.config.update_fields:
+            if self.settings.update_fields:
                 # Use the partial 'update' API
                 update_fields = {}
                 for key, value in fields.iteritems():
-                    if key in self.config.update_fields:
+                    if key in self.settings.update_fields:
                         update_fields.update({key: value})
                 meta["_id"] = id
-                self._add(document, {"update": meta}, {"doc": update_fields})
+                return (document, self._serialize({"update": meta}, {"doc": update_fields}))
             else:
                 # Use the normal partial API
                 if id: meta.update({"_id": id})
-                self._add(document, {"index": meta}, fields)
+                return (document, self._serialize({"index": meta}, fields))
+        return None
+
+    @staticmethod
+    def _serialize(action, source):
+        return _encode(action) + "\n" + _encode(source) + "\n"
 
-    def _add(self, doc, part1, part2):
+    def _add(self, doc, data):
+        self._add_many([(doc, data)])
+
+    def _add_many(self, entries):
+        if self.settings.spill_dir:
+            self._wait_for_room()
         self._queue_lock.acquire()
-        self._queue.put((doc, part1, part2))
+        for entry in entries:
+            self._queue.put(entry)
+            self._queue_bytes += len(entry[1])
+        size = self._queue.qsize()
         self._queue_lock.release()
+        self._wakeup_if_due(size, len(entries))
+        self.is_congested()
+
+    def _batch_ready(self):
+        "Whether there is a full batch in the queue, by number of documents or by size."
+        if self._batch_limit and self._queue.qsize() >= self._batch_limit:
+            return True
+        return self.settings.batch_bytes and self._queue_bytes >= self.settings.batch_bytes
+
+    def _wakeup_if_due(self, size, added):
+        "Wake up the run loop if the queue was empty (to start the batch timer) or a batch is ready."
+        if not added:
+            return
+        if size == added or not self._batch_limit or self._batch_ready():
+            self.wakeup()
 
     def _send(self):
+        "Take a batch off the queue and submit it; wait for it to complete unless 'max_inflight' allows more."
 
-        # Create a batch
+        items, body = self._take_batch()
+        self._last_batch_time = time.time()
+        if not items:
+            return  # Nothing to do
+        if self.settings.max_inflight > 1:
+            self._submit(items, body)
+        else:
+            self._complete(items, *self._bulk(len(items), body))
+
+    def _take_batch(self):
+        """
+        Return a tuple of (items, body) for a batch, with retries that are due first, then from the queue.
+        'items' is a list of (entry, attempt, retry), and 'body' a list with the bulk lines for each.
+        """
+
+        max_bytes = self.settings.batch_bytes
+        max_resubmits = self.settings.max_resubmits
+        items = []
+        body = []
+        size = 0
+        full = False
         self._queue_lock.acquire()
-        docs = []
-        payload = []
-        while (self.config.batchsize and len(docs) <= self.config.batchsize) and not self._queue.empty():
-            (doc,l1,l2) = self._queue.get() # TODO: Or get_nowait() ?
-            self._queue.task_done()
+        limit = self._batch_limit
+
+        # Retries that are due go first; they came before everything in the queue
+        retries = self._retries
+        now = time.time()
+        while retries and retries[0][0] <= now:
+            due, seq, entry, attempt = retries[0]
+            data = entry[1]
+            if (limit and len(items) >= limit) or (max_bytes and items and size + len(data) > max_bytes):
+                full = True
+                break
+            heapq.heappop(retries)
+            items.append((entry, attempt, True))
+            body.append(data)
+            size += len(data)
+
+        queued = self._queue.queue  # Peek at the next entry; all puts happen with the lock held
+        while not full and (not limit or len(items) < limit) and queued:
+            entry = queued[0]
+            doc = entry[0]
+            id = doc.get("_id")
             retry = doc.get("_retry") or 0
-            if retry > self.config.max_resubmits:
+            if retry > max_resubmits:
                 self.doclog.warning(
                     "Retry attempts exceeded (%d) for document with id '%s'. Giving up." %
-                    (self.config.max_resubmits, doc.get("_id"))
+                    (max_resubmits, id)
                 )
+            elif id is not None and id in self._held:
+                self._held[id].append((entry, 0))  # Keep it behind the earlier version waiting to be retried
+                self._held_count += 1
             else:
-                docs.append(doc)
-                payload.append(l1)
-                payload.append(l2)
+                data = entry[1]
+                if max_bytes and items and size + len(data) > max_bytes:
+                    break  # Leave it for the next batch
+                items.append((entry, 0, False))
+                body.append(data)
+                size += len(data)
+            self._queue_bytes -= len(entry[1])
+            self._queue.get()
+            self._queue.task_done()
+        self._queue_room.notify_all()
         self._queue_lock.release()
+        self.is_congested()
+        return items, body
 
-        if not len(payload):
-            self._last_batch_time = time.time()
-            return # Nothing to do
+    def _bulk(self, count, body):
+        "Send a batch of 'count' documents to Elasticsearch. Returns a tuple of (response, error), one of them None."
 
         self.log.trace("Sending batch to Elasticsearch.")
-        es = elasticsearch.Elasticsearch(self.config.hosts if self.config.hosts else None)
+        es = self._es
+        if not es:
+            self.log.error("Batch of %d documents not sent; the writer is closed." % count)
+            return None, Exception("Writer is closed.")
+        payload = "".join(body)
+
+        started = time.time()
+        res = error = None
+        try:
+            res = es.bulk(payload)
+        except elasticsearch.TransportError as e:
+            error = e
+            self.log.warning("Batch of %d documents failed: %s: %s" % (count, e.__class__.__name__, e))
+        except Exception as e:
+            error = e
+            self.log.exception("Batch of %d documents failed with exception." % count)
+        duration = time.time() - started
 
-        submit_attempts = 0
-        res = None
-        while res is None and (submit_attempts <= self.config.max_resubmits):
-            submit_attempts += 1
-            try:
-                res = es.bulk(payload)
-            except:
-                self.log.exception("Batch failed with exception. Submit attempt %d out of %d." % (submit_attempts, self.config.max_resubmits +1))
-                if submit_attempts <= self.config.max_resubmits:
-                    self.log.info("Resubmitting failed batch (%d documents)." % len(docs))
+        if res:
+            rejected = res.get("errors") and any(item.values()[0].get("status") == 429 for item in res["items"])
+        else:
+            rejected = getattr(error, "status_code", None) == 429
+        self.stats.add_bulk(count, len(payload), duration, error is not None)
+        if self.settings.target_latency:
+            self._adapt_batch_limit(count, duration, rejected)
+        return res, error
+
+    def _adapt_batch_limit(self, count, duration, rejected):
+        "Adjust the number of documents per batch after a bulk request of 'count' documents."
+        settings = self.settings
+        target = settings.target_latency
+        # Bulk workers adjust this concurrently, so read, change and write it back under the lock
+        with self._queue_lock:
+            previous = self._batch_limit
+            limit = previous or count
+            if rejected:
+                limit //= 2  # The cluster is overloaded; back off quickly
+            elif duration > target * 1.25:
+                limit = int(limit * min(0.8, target / duration))
+            elif duration < target * 0.75 and count >= limit:
+                limit = int(limit * 1.25) + 1  # Only grow when batches are actually limited by the count
+            else:
+                return
+            limit = max(limit, settings.min_batchsize)
+            if settings.batchsize:
+                limit = min(limit, settings.batchsize)
+            self._batch_limit = limit
+        if limit != previous:
+            self.log.debug("Batch size adjusted from %s to %d documents." % (previous, limit))
+
+    #region Retries
+
+    def _is_retryable_error(self, error):
+        "Whether a batch that failed with 'error' for the whole request may pass if retried."
+        if isinstance(error, elasticsearch.ConnectionError):
+            return True  # Including timeouts
+        return getattr(error, "status_code", None) in _RETRYABLE_STATUS
+
+    def _backoff(self, attempt):
+        delay = min(self.settings.retry_max_delay, self.settings.retry_delay * 2 ** (attempt - 1))
+        return random.uniform(delay / 2.0, delay)
+
+    def _push_retry(self, entry, attempt, delay):
+        "Call with the queue lock held."
+        heapq.heappush(self._retries, (time.time() + delay, next(self._retry_seq), entry, attempt))
+
+    def _settle(self, retries, done):
+        """
+        Schedule 'retries', a list of (entry, attempt, retry). For each '_id' in 'done', where a retried entry has
+        succeeded or been given up, release the next entry held behind it.
+
+        Only one entry per '_id' is waiting for, or in, a retry at a time. Later entries with the same '_id' are held
+        behind it until it is done, so that writes to the same document stay in order.
+        """
+
+        with self._queue_lock:
+            for entry, attempt, retry in retries:
+                id = entry[0].get("_id")
+                if retry or id is None:
+                    self._push_retry(entry, attempt, self._backoff(attempt))
+                elif id in self._held:
+                    self._held[id].append((entry, attempt))  # Behind an earlier entry in the same batch
+                    self._held_count += 1
+                else:
+                    self._held[id] = deque()
+                    self._push_retry(entry, attempt, self._backoff(attempt))
+            for id in done:
+                held = self._held.get(id)
+                if held:
+                    entry, attempt = held.popleft()
+                    self._held_count -= 1
+                    self._push_retry(entry, attempt, 0)
+                elif held is not None:
+                    del self._held[id]
+        self.stats.retried += len(retries)
+        self.is_congested()
+        if retries or done:
+            self.wakeup()  # To schedule a tick for when they are due
+
+    def _next_retry_due(self):
+        with self._queue_lock:
+            return self._retries[0][0] if self._retries else None
+
+    def _divert_held(self, items, body):
+        """
+        Hold back items whose '_id' has got an entry to retry since the batch was made. Returns the remaining
+        (items, body).
+        """
+        with self._queue_lock:
+            if not self._held:
+                return items, body
+            kept_items = []
+            kept_body = []
+            for item, data in zip(items, body):
+                entry, attempt, retry = item
+                held = self._held.get(entry[0].get("_id"))
+                if held is not None and not retry:
+                    held.append((entry, attempt))
+                    self._held_count += 1
                 else:
-                    self.log.info("Max resubmits (%d) exeeded. Giving up on batch (dropping %d documents.)" % (self.config.max_resubmits, len(docs)))
+                    kept_items.append(item)
+                    kept_body.append(data)
+        self.is_congested()
+        return kept_items, kept_body
+
+    def _drain(self):
+        "Send everything queued, including retries as they become due, and wait for all of it to complete."
+        while not self.aborted:
+            while self._queue.qsize() or (self._retries and self._next_retry_due() <= time.time()):
+                self._send()
+            self._wait_inflight()
+            due = self._next_retry_due()
+            if due is None:
+                if not self._queue.qsize() and not self._held:
                     break
-
-        if res:
+            else:
+                time.sleep(min(max(0, due - time.time()), 1.0))
+
+    #endregion Retries
+
+    #region Concurrent bulk requests
+
+    def _submit(self, items, body):
+        """
+        Hand a batch to a bulk worker thread. Waits while 'max_inflight' batches are already in flight, and while any
+        of them has a document with the same '_id', so that writes to the same document are done in order.
+        """
+
+        ids = set(entry[0].get("_id") for entry, attempt, retry in items)
+        ids.discard(None)  # Ids generated by Elasticsearch can not clash
+        with self._inflight_changed:
+            while len(self._inflight) >= self.settings.max_inflight or not self._inflight_ids.isdisjoint(ids):
+                self._inflight_changed.wait()
+            # A document that was in flight may have failed and be waiting for a retry by now
+            items, body = self._divert_held(items, body)
+            if not items:
+                return
+            ids = set(entry[0].get("_id") for entry, attempt, retry in items)
+            ids.discard(None)
+            seq = self._next_seq
+            self._next_seq += 1
+            self._inflight[seq] = ids
+            self._inflight_ids.update(ids)
+            self._start_bulk_workers()
+        self._batches.put((seq, items, body))
+
+    def _start_bulk_workers(self):
+        self._bulk_workers = [w for w in self._bulk_workers if w.is_alive()]
+        while len(self._bulk_workers) < self.settings.max_inflight:
+            worker = threading.Thread(target=self._run_bulk_worker, name="%s.bulk" % self.name)
+            worker.daemon = True
+            worker.start()
+            self._bulk_workers.append(worker)
+
+    def _stop_bulk_workers(self):
+        "Stop the bulk workers once they have sent the batches handed to them. When aborted, pending batches are dropped."
+        if self.aborted:
+            dropped = 0
+            while True:
+                try:
+                    batch = self._batches.get_nowait()
+                except Empty:
+                    break
+                if batch:
+                    dropped += len(batch[1])
+            if dropped:
+                self.log.warning("Aborted; dropped %d documents in batches not yet sent." % dropped)
+        workers = self._bulk_workers
+        for worker in workers:
+            self._batches.put(None)
+        for worker in workers:
+            worker.join()  # Before the client is closed
+        self._bulk_workers = []
+
+    def _run_bulk_worker(self):
+        while True:
+            batch = self._batches.get()
+            if batch is None:
+                return
+            seq, items, body = batch
+            res = error = None
+            try:
+                res, error = self._bulk(len(items), body)
+            finally:
+                with self._inflight_changed:
+                    self._completed[seq] = (items, res, error)
+                self._emit_completed()
+
+    def _emit_completed(self):
+        "Handle the results of completed batches, in the order the batches were submitted."
+        with self._emit_lock:
+            while True:
+                with self._inflight_changed:
+                    completed = self._completed.pop(self._next_emit, None)
+                if completed is None:
+                    break
+                try:
+                    self._complete(*completed)
+                except Exception as e:
+                    self.log.exception("Unhandled exception when handling bulk result -- proceeding.")
+                with self._inflight_changed:
+                    self._inflight_ids.difference_update(self._inflight.pop(self._next_emit))
+                    self._next_emit += 1
+                    self._inflight_changed.notify_all()
+
+    def _wait_inflight(self):
+        "Wait until all submitted batches have completed."
+        with self._inflight_changed:
+            while self._inflight:
+                self._inflight_changed.wait()
+
+    #endregion Concurrent bulk requests
+
+    def _complete(self, items, res, error):
+        """
+        Send the documents of a completed batch to the 'output' or 'error' socket, according to the result, or
+        schedule them for retry.
+        """
+
+        retries = []
+        if res is None:
+            retryable = self._is_retryable_error(error)
+            reason = "%s: %s" % (error.__class__.__name__, error) if error else "unknown error"
+            for item in items:
+                self._fail(item, retryable, reason, retries)
+        else:
             self.log.trace("Processing batch result.")
 
+            resdocs = [docop.get("index") or docop.get("create") or docop.get("update") for docop in res["items"]]
             if res["errors"]:
                 self.log.debug("Batch returned with error(s).")
 
-            for i, docop in enumerate(res["items"]):
-                if   "index"  in docop: resdoc = docop["index"]
-                elif "create" in docop: resdoc = docop["create"]
-                elif "update" in docop: resdoc = docop["update"]
-                if resdoc:
-                    self.count += 1
-
-                    id      = resdoc["_id"]
-                    version = resdoc.get("_version")
-                    index   = resdoc["_index"]
-                    doctype = resdoc["_type"]
-                    has_error = (resdoc.get("error") is not None)
-
-                    if has_error:
-                        self.doclog.error("Document with id '%s' in batch failed." % id)
-
-                    #print "*** ID : OLD=%s, NEW=%s" % (docs[i].get("_id"), id) # DEBUG
-
-                    # Only do the following cloning etc if there are actual subscribers:
-                    if has_error:
-                        if self.error_output.has_output:
-                            original_doc = docs[i]
-                            original_doc["_retry"] = (original_doc.get("_retry") or 0) + 1
-                            self.error_output.send(original_doc)
-                    elif self.output.has_output:
-                        original_doc = docs[i]
-                        original_doc.pop("_retry", None)  # Get rid of this field if it exists
-                        doc = copy.copy(original_doc) # Shallow clone
-                        doc.update({"_id"     : id     }) # Might have changed, in case of new document created, without id
-                        doc.update({"_index"  : index  }) # Might have changed to self.config.index
-                        doc.update({"_type"   : doctype}) # Might have changed to self.config.doctype
-                        doc.update({"_version": version}) # Might have changed, in case of update
-                        # Send to socket
-                        self.output.send(doc)
-                else:
+            superseded = set()  # Positions of items with a later write of the same '_id' that succeeded in this batch
+            if any(resdoc and resdoc.get("error") is not None for resdoc in resdocs):
+                written = set()
+                for i in reversed(xrange(len(items))):
+                    doc_id = items[i][0][0].get("_id")
+                    if doc_id is None or not resdocs[i]:
+                        continue
+                    if doc_id in written:
+                        superseded.add(i)
+                    elif resdocs[i].get("error") is None:
+                        written.add(doc_id)
+
+            for i, (item, resdoc) in enumerate(zip(items, resdocs)):
+                entry = item[0]
+                if not resdoc:
                     # TODO: Perhaps send failed documents to another (error) socket(?)
-                    self.doclog.debug("No document %d" % i)
-
-        self._last_batch_time = time.time()
+                    self.doclog.debug("No result for document with id '%s'.", entry[0].get("_id"))
+                    continue
+
+                error = resdoc.get("error")
+                if error is not None:
+                    if isinstance(error, dict):
+                        error = "%s: %s" % (error.get("type"), error.get("reason"))
+                    if i in superseded:
+                        # A retry would overwrite the later version
+                        self._fail(item, False, "%s (not retried; a later version was written)" % error, retries)
+                    else:
+                        self._fail(item, resdoc.get("status") in _RETRYABLE_STATUS, error, retries)
+                    continue
+
+                self.count += 1
+
+                # Only do the following cloning etc if there are actual subscribers.
+                # Note: The incoming document may be shared with other subscribers, so it is never modified.
+                if self.output.has_output:
+                    overlay = esdoc.Overlay(entry[0])
+                    overlay.removefield("_retry")                    # Get rid of this field if it exists
+                    overlay.putfield("_id"     , resdoc["_id"])       # Might have changed, in case of new document created, without id
+                    overlay.putfield("_index"  , resdoc["_index"])    # Might have changed to self.config.index
+                    overlay.putfield("_type"   , resdoc["_type"])     # Might have changed to self.config.doctype
+                    overlay.putfield("_version", resdoc.get("_version"))  # Might have changed, in case of update
+                    doc = overlay.materialize()
+                    # Send to socket
+                    self.output.send(doc)
+
+        if retries or self._held:
+            retried = set(id(item[0]) for item in retries)
+            done = [entry[0].get("_id") for entry, attempt, retry in items if retry and id(entry) not in retried]
+            self._settle(retries, done)
+
+    def _fail(self, item, retryable, reason, retries):
+        "Add a failed item to 'retries' if it may pass and has attempts left, or else send it to the 'error' socket."
+
+        entry, attempt, retry = item
+        doc = entry[0]
+        if retryable and attempt < self.settings.max_retries:
+            self.doclog.debug("Document with id '%s' failed (%s). Retry %d of %d.", doc.get("_id"), reason, attempt + 1, self.settings.max_retries)
+            retries.append((entry, attempt + 1, retry))
+            return
+
+        self.count += 1
+        self.doclog.error("Document with id '%s' in batch failed: %s", doc.get("_id"), reason)
+        if self.error_output.has_output:
+            doc = esdoc.Overlay(doc).putfield("_retry", (doc.get("_retry") or 0) + 1).materialize()
+            self.error_output.send(doc)
 
     #region Generator
 
-    def on_start(self):
+    def on_open(self):
+        if self.settings.compress and not self._client_supports_compress():
+            raise ValueError("Config 'compress' needs an elasticsearch client with 'http_compress'; this is version %s." % elasticsearch.__versionstr__)
+        self._batch_limit = self.settings.batchsize
+        # Batches dropped on abort are forgotten
+        self._inflight.clear()
+        self._inflight_ids.clear()
+        self._completed.clear()
+        self._next_seq = self._next_emit = 0
+        self._es = self._create_client()
+
+    def on_close(self):
+        self._stop_bulk_workers()
+        self._close_client()
+
+    def on_startup(self):
         self.count = 0
         self._last_batch_time = time.time()  # Not 0, in that case we would attempt a zero batch immediately upon start
 
     def on_shutdown(self):
         # Send remaining queue to Elasticsearch (still in batches)
         self.log.info("Submitting all remaining batches.")
-        while self._queue.qsize():
-            self._send()
+        self._drain()
+        bulk = self.stats.get()["bulk"]
+        self.log.info("Wrote %d documents in %d bulk requests; %.0f documents/s." % (bulk["documents"], bulk["count"], bulk["documents_per_second"]))
 
     def on_tick(self):
-        if self._queue.qsize() and not self.config.batchsize and not self.config.batchtime:
+        settings = self.settings
+        limit = self._batch_limit
+        if self._queue.qsize() and not limit and not settings.batchtime:
             self.log.trace("Submitting single document.")
             self._send()
-        elif self.config.batchsize and (self._queue.qsize() >= self.config.batchsize):
-            self.log.debug("Submitting full batch (%d)." % self.config.batchsize)
+        elif self._batch_ready():
+            self.log.debug("Submitting full batch (%d documents, %d bytes queued)." % (self._queue.qsize(), self._queue_bytes))
             self._send()
             self.log.trace("Batch submitted.")  # TODO: DEBUG: REMOVE
-        elif self.config.batchtime and self._queue.qsize() and (time.time() - self._last_batch_time > self.config.batchtime):
+        elif settings.batchtime and self._queue.qsize() and (time.time() - self._last_batch_time > settings.batchtime):
             self.log.trace("Submitting partial batch (%d) due to batch timeout." % self._queue.qsize())
             self._send()
+        elif self._retries and self._next_retry_due() <= time.time():
+            self.log.trace("Submitting batch with retries.")
+            self._send()
+
+        retry_due = self._next_retry_due()
+        if retry_due is not None:
+            self.schedule_tick(retry_due - time.time())
+
+        if self._queue.qsize():
+            if self._batch_ready():
+                self.schedule_tick(0)
+            elif settings.batchtime:
+                self.schedule_tick(self._last_batch_time + settings.batchtime - time.time())
+
+    def on_reconfigure(self):
+        with self._queue_lock:
+            self._batch_limit = self.settings.batchsize
+        self.wakeup()  # Apply new batch size and time right away
 
     #endregion Generator
 
@@ -227,8 +765,15 @@ class ElasticsearchWriter(Generator):
 
     def flush(self):
         self.log.info("Submitting all (%d) queued documents with 'flush'." % self._queue.qsize())
-        while self._queue.qsize():
-            self._send()
+        opened = not self._es
+        if opened:
+            self._es = self._create_client()  # Not open; use a client for this flush only
+        try:
+            self._drain()
+        finally:
+            if opened:
+                self._stop_bulk_workers()
+                self._close_client()
         self.log.info("Flush completed.")
 
     #endregion Utility methods
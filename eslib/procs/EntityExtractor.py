@@ -2,7 +2,7 @@ __author__ = 'Hans Terje Bakke'
 
 from ..Processor import Processor
 from .. import esdoc
-import re, copy
+import re
 
 
 class EntityExtractor(Processor):
@@ -72,29 +72,76 @@ class EntityExtractor(Processor):
             target         = "entities"
         )
 
-        self._regex_exact = {}
+        self._matchers = []  # Tuples of (category, name, type, pattern, weight, language weights, regex)
+        self._language_path = None
+        self._field_paths = []  # Tuples of (field, FieldPath)
+        self._target_path = None
 
     def on_open(self):
-        # Create a dictionary of all regexes for exact matching
-        for conf in self.config.entities or []:
+        """
+        :raises ValueError, if failed to parse a pattern as regex
+        """
+
+        settings = self.settings
+
+        # Compile the entity config into a flat list of matchers, with a regex for each
+        regexes = {}
+        matchers = []
+        for conf in settings.entities or []:
+            category = conf.get("category")
+            entity_name = conf.get("name")
             for match in conf.get("match") or []:
+                name = entity_name
                 t = match.get("type")
+                pattern = match.get("pattern")
+                weight = match.get("weight")
+                if weight is None:
+                    weight = 1.0
+                # Skip 0-weights
+                if weight == 0.0:
+                    continue
+
                 if t == "exact":
-                    pattern = match.get("pattern")
-                    if pattern and not pattern in self._regex_exact:
-                        self._regex_exact[pattern] =\
-                            re.compile(
+                    if not pattern:
+                        continue
+                    regex = regexes.get(pattern)
+                    if not regex:
+                        try:
+                            regex = regexes[pattern] = re.compile(
                                 self._regex_exact_format % pattern.replace("*", ".*?"),  # Non greedy
                                 flags=self._regex_exact_flags
                             )
+                        except re.error as e:
+                            raise ValueError("Error parsing pattern for entity '%s': %s\nPattern was: %s" % (entity_name, e, pattern))
+                elif t == "email":
+                    regex = self._regex_email
+                    name = None  # Use extracted element text instead
+                elif t == "iprange":
+                    regex = self._regex_ipaddr  # Very simple IP version 4 parser
+                    name = None  # Use extracted element text instead
+                elif t == "creditcard":
+                    regex = self._regex_creditcard
+                    name = None  # Use extracted element text instead
+                else:
+                    continue  # Unsupported type
+
+                matchers.append((category, name, t, pattern, weight, match.get("weights") or {}, regex))
+
+        self._matchers = matchers
+        self._language_path = esdoc.compile_path("_source." + settings.language_field) if settings.language_field else None
+        self._field_paths = [(field, esdoc.compile_path("_source." + field)) for field in settings.fields or []]
+        self._target_path = esdoc.compile_path("_source." + settings.target)
+
+    def on_reconfigure(self):
+        self.on_open()
 
     def _incoming_esdoc(self, doc):
         if self.has_output:
-            lang = esdoc.getfield(doc, "_source." + self.config.language_field) if self.config.language_field else None
+            lang = self._language_path.get(doc) if self._language_path else None
 
             extracted = []
-            for field in self.config.fields:
-                text = esdoc.getfield(doc, "_source." + field)
+            for field, path in self._field_paths:
+                text = path.get(doc)
                 if text is not None:
                     if not isinstance(text, basestring):
                         self.doclog.warning("Configured field '%s' of unsupported type '%s'. Doc id='%s'." % (field, type(text), doc.get("_id")))
@@ -102,13 +149,12 @@ class EntityExtractor(Processor):
                     for e in ee:
                         extracted.append(e)
 
-            # If the 'entities' part already exists, make a deep clone of it and add to it.
-            existing = esdoc.getfield(doc, "_source." + self.config.target)
-            target = copy.deepcopy(existing) if existing else {}
+            # If the 'entities' part already exists, add to a copy of it; _merge() copies the category lists it adds to.
+            existing = self._target_path.get(doc)
+            target = dict(existing) if existing else {}
+            entities = self._merge(extracted, target, shared=existing)
             # Create a new document by cloning only necessary parts; otherwise use object references.
-            merged_doc = esdoc.shallowputfield(doc, "_source." + self.config.target, target)
-
-            entities = self._merge(extracted, target)
+            merged_doc = esdoc.Overlay(doc).putfield(self._target_path, target).materialize()
             if extracted:
                 self.output_entities.send(extracted) ##entities)
             self.output_esdoc.send(merged_doc)
@@ -129,8 +175,11 @@ class EntityExtractor(Processor):
                 self.output_entities.send(extracted) ##entities)
 
 
-    def _merge(self, extracted, entities=None):
-        "Convert a list of extracted entities (generator) to a merged dictionary."
+    def _merge(self, extracted, entities=None, shared=None):
+        """
+        Convert a list of extracted entities (generator) to a merged dictionary.
+        Category lists in 'entities' that also appear in 'shared' are copied before they are added to.
+        """
 
         if entities is None:
             entities = {}
@@ -138,6 +187,8 @@ class EntityExtractor(Processor):
             category = entities.get(e_category)
             if category is None:
                 category = entities[e_category] = []
+            elif shared and category is shared.get(e_category):
+                category = entities[e_category] = list(category)
             category.append(e_match)
 
         return entities
@@ -149,98 +200,26 @@ class EntityExtractor(Processor):
         Return type is a tuple of (category, name, match), where match is a dict.
         """
 
-        for conf in self.config.entities or []:
-            category = conf.get("category")
-            entity_name = conf.get("name")
-            for match in conf.get("match") or []:
-                name = entity_name
-                t = match.get("type")
-                pattern = match.get("pattern")
-                weight = match.get("weight")
-                if weight is None:
-                    weight = 1.0
-                language_weights = match.get("weights") or {}
-                language_weight = 1.0
-
-                if lang in language_weights:
-                    language_weight=language_weights[lang]
-                elif "*" in language_weights:
-                    language_weight = language_weights["*"]
-                # Skip 0-weights
-                if language_weights == 0.0 or weight == 0.0:
-                    continue
-
-                if t == "exact":
-                    extracted = self._extract_exact(pattern, text)
-                elif t == "email":
-                    extracted = self._extract_email(text)
-                    name = None  # Use extracted element text instead
-                elif t == "iprange":
-                    extracted = self._extract_iprange(pattern, text)
-                    name = None  # Use extracted element text instead
-                elif t == "creditcard":
-                    extracted = self._extract_creditcard(text)
-                    name = None  # Use extracted element text instead
-                else:
-                    continue  # Unsupported type
-
-                for txt, span, score in extracted:
-                    # One item to follow...
-                    yield (
-                        category,
-                        {
-                            "name"   : name or txt,
-                            "type"   : t,
-                            "pattern": pattern,
-                            "value"  : txt,
-                            "indices": span,
-                            "field"  : field,
-                            "score"  : score * weight * language_weight
-                        }
-                    )
-
-    def _extract_exact(self, pattern, text):
-        "An extremely simple implementation for now.."
-
-        for match in self._regex_exact[pattern].finditer(text):
-            yield (
-                match.group(),
-                match.span(),
-                1.0,  # Score
-            )
-
-        # i = text.lower().find(pattern.lower())
-        # if i >= 0:
-        #     i_to = i + len(pattern)
-        #     yield (
-        #         text[i:i_to],
-        #         (i, i_to),
-        #         1.0  # Match score, disregarding case mismatch
-        #     )
-
-    def _extract_email(self, text):
-
-        for match in self._regex_email.finditer(text):
-            yield (
-                match.group(),
-                match.span(),
-                1.0,  # Score
-            )
-
-    def _extract_creditcard(self, text):
-
-        for match in self._regex_creditcard.finditer(text):
-            yield (
-                match.group(),
-                match.span(),
-                1.0,  # Score
-            )
-
-    def _extract_iprange(self, pattern, text):
-        "Very simple IP version 4 parser."
-        for match in self._regex_ipaddr.finditer(text):
-            yield (
-                match.group(),
-                match.span(),
-                1.0,  # Score
-            )
+        for category, name, t, pattern, weight, language_weights, regex in self._matchers:
+            language_weight = 1.0
+            if lang in language_weights:
+                language_weight=language_weights[lang]
+            elif "*" in language_weights:
+                language_weight = language_weights["*"]
+            score = weight * language_weight  # All matches score 1.0 by themselves
+
+            for match in regex.finditer(text):
+                # One item to follow...
+                txt = match.group()
+                yield (
+                    category,
+                    {
+                        "name"   : name or txt,
+                        "type"   : t,
+                        "pattern": pattern,
+                        "value"  : txt,
+                        "indices": match.span(),
+                        "field"  : field,
+                        "score"  : score
+                    }
+                )
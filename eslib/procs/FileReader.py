@@ -5,6 +5,7 @@ from select import select
 import codecs
 import sys, os, os.path, errno
 import json
+from ..esdoc import EsDoc
 
 
 # TODO: Windows does not support file descriptors in select()
@@ -33,6 +34,8 @@ class FileReader(Generator):
         skip_comment_line = True    : Whether to skip comment lines
         comment_prefix    = "#"     : Lines beginning with this string is considered to be a comment line if
                                       'skip_comment_line' is True.
+        compact           = False   : Send JSON objects with a '_source' field as 'esdoc.EsDoc' instead of 'dict',
+                                      to save memory.
     """
 
     def __init__(self, **kwargs):
@@ -48,6 +51,7 @@ class FileReader(Generator):
             skip_blank_line   = True,
             skip_comment_line = True,
             comment_prefix    = "#",
+            compact           = False
         )
         self._filenames = []
         self._file = None
@@ -107,6 +111,8 @@ class FileReader(Generator):
         if not self.config.raw_lines:# and data.startswith("{"):
             # NOTE: May raise ValueError:
             data = json.loads(data)
+            if self.config.compact and type(data) is dict and "_source" in data:
+                data = EsDoc(data)
         self.output.send(data)
 
 
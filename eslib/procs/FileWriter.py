@@ -4,7 +4,7 @@ __author__ = 'Hans Terje Bakke'
 
 from ..Processor import Processor
 import sys
-from ..esdoc import tojson
+from ..esdoc import tojson, isdoc
 
 
 class FileWriter(Processor):
@@ -51,7 +51,7 @@ class FileWriter(Processor):
 
     def _incoming(self, document):
         if document:
-            if type(document) is dict:
+            if isdoc(document):
                 print >> self._file, tojson(document)
             else:
                 print >> self._file, document
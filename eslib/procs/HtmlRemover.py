@@ -26,8 +26,8 @@ class HtmlRemover(Processor):
     def __init__(self, **kwargs):
         super(HtmlRemover, self).__init__(**kwargs)
 
-        m = self.create_connector(self._incoming_esdoc, "input", "esdoc", "Incoming 'esdoc'.", is_default=True)
-        self.create_connector(self._incoming_str  , "str"  , "str"  , "Incoming document of type 'str' or 'unicode'.")
+        m = self.create_connector(self._incoming_esdoc, "input", "esdoc", "Incoming 'esdoc'.", is_default=True, batch=True)
+        self.create_connector(self._incoming_str  , "str"  , "str"  , "Incoming document of type 'str' or 'unicode'.", batch=True)
         self.output_esdoc = self.create_socket("output" , "esdoc"   , "Outgoing, cleaned, 'esdoc'.", is_default=True, mimic=m)
         self.output_str   = self.create_socket("str"    , "str"     , "Outgoing, cleaned, 'str'.")
 
@@ -39,15 +39,17 @@ class HtmlRemover(Processor):
         )
 
         self._regexes = []
-        self._field_map = {}
+        self._field_paths = []  # Tuples of (source FieldPath within '_source', target FieldPath)
 
     def on_open(self):
         # Create field map
-        self._field_map = self.config.field_map or {}
-        if not self._field_map:
+        field_map = self.config.field_map or {}
+        if not field_map:
             if not self.config.source_field:
                 raise ValueError("Neither field_map nor source_field is configured.")
-            self._field_map[self.config.source_field] = (self.config.target_field or self.config.source_field)
+            field_map[self.config.source_field] = (self.config.target_field or self.config.source_field)
+        self._field_paths = [(esdoc.compile_path(source_field), esdoc.compile_path("_source." + target_field))
+                             for source_field, target_field in field_map.iteritems()]
 
 
     def _clean_text(self, text):
@@ -65,7 +67,7 @@ class HtmlRemover(Processor):
         if type(doc) in [str, unicode]:
             cleaned = self._clean_text(doc)
             return cleaned
-        elif not type(doc) is dict:
+        elif not esdoc.isdoc(doc):
             self.doclog.debug("Unsupported document type '%s'." % type(doc))
             return doc
 
@@ -73,19 +75,36 @@ class HtmlRemover(Processor):
         if not source:
             return doc  # Missing source section; don't do anything
 
-        for source_field, target_field in self._field_map.iteritems():
-            text = esdoc.getfield(source, source_field)
+        overlay = esdoc.Overlay(doc)
+        for source_path, target_path in self._field_paths:
+            text = source_path.get(source)
             if text and type(text) in [str, unicode]:
                 cleaned = self._clean_text(text)
                 if cleaned != text:
-                    # Note: This may lead to a few strictly unnecessary shallow clonings...
-                    doc = esdoc.shallowputfield(doc, "_source." + target_field, cleaned)
-        return doc
+                    overlay.putfield(target_path, cleaned)
+        # Clones only the path down to the changed fields, and only once
+        return overlay.materialize()
 
-    def _incoming_esdoc(self, doc):
+    def _incoming_esdoc(self, docs):
         if self.output_esdoc.has_output:
-            self.output_esdoc.send(self._clean(doc))
-
-    def _incoming_str(self, doc):
+            for doc in docs:
+                try:
+                    cleaned = self._clean(doc)
+                except Exception as e:
+                    msg = "Unhandled exception in processor '%s' while cleaning a document -- dropped." % self.name
+                    self.doclog.exception(msg)
+                    self.log.exception(msg)
+                    continue
+                self.output_esdoc.send(cleaned)
+
+    def _incoming_str(self, docs):
         if self.output_str.has_output:
-            self.output_str.send(self._clean(doc))
+            for doc in docs:
+                try:
+                    cleaned = self._clean(doc)
+                except Exception as e:
+                    msg = "Unhandled exception in processor '%s' while cleaning a document -- dropped." % self.name
+                    self.doclog.exception(msg)
+                    self.log.exception(msg)
+                    continue
+                self.output_str.send(cleaned)
@@ -44,6 +44,9 @@ class Neo4jWriter(Generator):
         self._user_queue = []
         self._last_user_commit = time.time()
 
+        # Tick only when woken by incoming documents or when a batch timer is due
+        self.sleep = None
+
     def on_open(self):
         """
         Instantiates both a neo4j-instance and a twitter-instance.
@@ -79,12 +82,19 @@ class Neo4jWriter(Generator):
         else:
             query = self._neo4j.get_edge_query(from_id, edge_type, to_id)
             self._edge_queue.append(query)
+            self._wakeup_if_due(self._edge_queue)
 
     def _incoming_user(self, document):
         if self.doclog.isEnabledFor(logging.TRACE):
             self.doclog.trace("Incoming user '%s' ('%s')." % (document["screen_name"], document["id"]))
         query, params = self._neo4j.get_node_merge_query(document)
         self._user_queue.append((query, params))
+        self._wakeup_if_due(self._user_queue)
+
+    def _wakeup_if_due(self, queue):
+        "Wake up the run loop if the queue was empty (to start the batch timer) or a batch is ready."
+        if len(queue) == 1 or len(queue) >= self.config.batchsize:
+            self.wakeup()
 
     def on_tick(self):
         """
@@ -103,6 +113,13 @@ class Neo4jWriter(Generator):
                 self._user_queue)):
             self._user_send()
 
+        # Have the next tick when the oldest of the remaining batches is due
+        for queue, last_commit in ((self._edge_queue, self._last_edge_commit), (self._user_queue, self._last_user_commit)):
+            if len(queue) >= self.config.batchsize:
+                self.schedule_tick(0)
+            elif queue:
+                self.schedule_tick(last_commit + self.config.batchtime - time.time())
+
     def on_shutdown(self):
         """ Clear out the rest of the items in the queue """
         self.log.info("Processing remaining edge queue.")
@@ -30,8 +30,8 @@ class PatternRemover(Processor):
     def __init__(self, **kwargs):
         super(PatternRemover, self).__init__(**kwargs)
 
-        m = self.create_connector(self._incoming_esdoc, "input", "esdoc", "Incoming 'esdoc'.", is_default=True)
-        self.create_connector(self._incoming_str  , "str"  , "str"  , "Incoming document of type 'str' or 'unicode'.")
+        m = self.create_connector(self._incoming_esdoc, "input", "esdoc", "Incoming 'esdoc'.", is_default=True, batch=True)
+        self.create_connector(self._incoming_str  , "str"  , "str"  , "Incoming document of type 'str' or 'unicode'.", batch=True)
         self.output_esdoc = self.create_socket("output" , "esdoc"   , "Outgoing, cleaned, 'esdoc'.", is_default=True, mimic=m)
         self.output_str   = self.create_socket("str"    , "str"     , "Outgoing, cleaned, 'str'.")
 
@@ -46,39 +46,48 @@ class PatternRemover(Processor):
         )
 
         self._regexes = []
-        self._field_map = {}
+        self._field_paths = []  # Tuples of (source FieldPath within '_source', target FieldPath)
 
     def on_open(self):
         """
         :raises ValueError, if failed to parse a pattern as regex
         """
 
+        settings = self.settings
+
         # Create list of regexes
         patterns = []
-        if self.config.pattern:
-            patterns = [self.config.pattern]
-        if self.config.patterns:
-            patterns.extend(self.config.patterns)
-        self._regexes = []
+        if settings.pattern:
+            patterns = [settings.pattern]
+        if settings.patterns:
+            patterns.extend(settings.patterns)
+        regexes = []
         for pattern in patterns:
             try:
-                regex = re.compile(r"(%s)" % pattern, self.config.regex_options)
-                self._regexes.append(regex)
+                regex = re.compile(r"(%s)" % pattern, settings.regex_options)
+                regexes.append(regex)
             except Exception as e:
                 raise ValueError("Error parsing pattern: %s\nPattern was: %s" % (e.message, pattern))
 
         # Create field map
-        self._field_map = self.config.field_map or {}
-        if not self._field_map:
-            if not self.config.source_field:
+        field_map = dict(settings.field_map or {})
+        if not field_map:
+            if not settings.source_field:
                 raise ValueError("Neither field_map nor source_field is configured.")
-            self._field_map[self.config.source_field] = (self.config.target_field or self.config.source_field)
+            field_map[settings.source_field] = (settings.target_field or settings.source_field)
+
+        self._regexes = regexes
+        self._field_paths = [(esdoc.compile_path(source_field), esdoc.compile_path("_source." + target_field))
+                             for source_field, target_field in field_map.iteritems()]
+
+    def on_reconfigure(self):
+        self.on_open()
 
 
     def _clean_text(self, text):
         for regex in self._regexes:
             text = regex.sub("", text)
-            if self.config.strip:
+            if self.settings.strip:
                 text = text.strip().replace("  ", " ")
         return text
 
@@ -91,7 +100,7 @@ class PatternRemover(Processor):
         if type(doc) in [str, unicode]:
             cleaned = self._clean_text(doc)
             return cleaned
-        elif not type(doc) is dict:
+        elif not esdoc.isdoc(doc):
             self.doclog.debug("Unsupported document type '%s'." % type(doc))
             return doc
 
@@ -99,19 +108,36 @@ class PatternRemover(Processor):
         if not source:
             return doc  # Missing source section; don't do anything
 
-        for source_field, target_field in self._field_map.iteritems():
-            text = esdoc.getfield(source, source_field)
+        overlay = esdoc.Overlay(doc)
+        for source_path, target_path in self._field_paths:
+            text = source_path.get(source)
             if text and type(text) in [str, unicode]:
                 cleaned = self._clean_text(text)
                 if cleaned != text:
-                    # Note: This may lead to a few strictly unnecessary shallow clonings...
-                    doc = esdoc.shallowputfield(doc, "_source." + target_field, cleaned)
-        return doc
+                    overlay.putfield(target_path, cleaned)
+        # Clones only the path down to the changed fields, and only once
+        return overlay.materialize()
 
-    def _incoming_esdoc(self, doc):
+    def _incoming_esdoc(self, docs):
         if self.output_esdoc.has_output:
-            self.output_esdoc.send(self._clean(doc))
-
-    def _incoming_str(self, doc):
+            for doc in docs:
+                try:
+                    cleaned = self._clean(doc)
+                except Exception as e:
+                    msg = "Unhandled exception in processor '%s' while cleaning a document -- dropped." % self.name
+                    self.doclog.exception(msg)
+                    self.log.exception(msg)
+                    continue
+                self.output_esdoc.send(cleaned)
+
+    def _incoming_str(self, docs):
         if self.output_str.has_output:
-            self.output_str.send(self._clean(doc))
+            for doc in docs:
+                try:
+                    cleaned = self._clean(doc)
+                except Exception as e:
+                    msg = "Unhandled exception in processor '%s' while cleaning a document -- dropped." % self.name
+                    self.doclog.exception(msg)
+                    self.log.exception(msg)
+                    continue
+                self.output_str.send(cleaned)
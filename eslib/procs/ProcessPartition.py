@@ -0,0 +1,230 @@
+from ..Generator import Generator
+import multiprocessing, threading
+
+# Message kinds passed across the process boundary
+_DOCS    = 0
+_STOP    = 1
+_ABORT   = 2
+_SUSPEND = 3
+_RESUME  = 4
+_STOPPED = 5
+_ABORTED = 6
+
+def _partition_main(factory, inbox, outbox, parent_ends, batchsize, batchtime):
+    "Entry point for the child process. Runs the partition until stopped or aborted."
+
+    # Close the parent's ends of the pipes, so that we see EOF if the parent dies
+    for conn in parent_ends:
+        conn.close()
+
+    head, tail = factory()
+
+    output = []
+    output_lock = threading.Lock()
+    flush_wanted = threading.Event()
+    finished = threading.Event()
+    result = [_STOPPED]
+
+    def on_output(proc, document):
+        with output_lock:
+            output.append(document)
+            if len(output) >= batchsize:
+                flush_wanted.set()
+
+    def on_aborted(proc):
+        result[0] = _ABORTED
+        finished.set()
+
+    tail.add_callback(on_output)
+    tail.event_stopped.append(lambda proc: finished.set())
+    tail.event_aborted.append(on_aborted)
+
+    def read_inbox():
+        while True:
+            try:
+                kind, payload = inbox.recv()
+            except (EOFError, IOError):
+                head.abort()  # Parent is gone
+                return
+            try:
+                if kind == _DOCS:
+                    for document in payload:
+                        head.put(document)
+                elif kind == _STOP:
+                    head.stop()
+                    return
+                elif kind == _ABORT:
+                    head.abort()
+                    return
+                elif kind == _SUSPEND:
+                    head.suspend()
+                elif kind == _RESUME:
+                    head.resume()
+            except Exception as e:
+                # Without us, the partition would never hear from the parent again; give up instead of hanging
+                head.log.exception("Failed to pass message from parent to partition head -- aborting.")
+                head.abort()
+                return
+
+    reader = threading.Thread(target=read_inbox)
+    reader.daemon = True
+
+    def flush():
+        with output_lock:
+            if not output:
+                return
+            batch = output[:]
+            del output[:]
+        outbox.send((_DOCS, batch))
+
+    head.start()
+    reader.start()
+    try:
+        while not finished.is_set():
+            flush_wanted.wait(batchtime)
+            flush_wanted.clear()
+            flush()
+        flush()
+        outbox.send((result[0], None))
+    except (EOFError, IOError):
+        head.abort()  # Parent is gone
+
+class ProcessPartition(Generator):
+    """
+    Run part of a processing graph in a separate OS process, to spread CPU heavy work over several cores.
+
+    The 'factory' function is called in the child process and must return a tuple of (head, tail) processors,
+    already linked together. Documents received on the 'input' connector are passed in batches over a pipe to
+    the head, and documents coming out of the tail's default socket are passed back in batches and sent on the
+    'output' socket. Documents must be picklable.
+
+    Stop, abort, suspend and resume are passed on to the head of the partition. If the partition stops or aborts
+    on its own (e.g. when the head is a generator that has finished), this processor does the same.
+
+    Connectors:
+        input      (*)       : Documents to pass to the head of the partition.
+    Sockets:
+        output     (*)       : Documents coming out of the tail of the partition.
+
+    Config:
+        batchsize  = 500     : Max number of documents to pass across the process boundary in one message.
+        batchtime  = 0.05    : Max time to hold back a partially filled batch of output from the partition, in seconds.
+    """
+    def __init__(self, factory=None, **kwargs):
+        super(ProcessPartition, self).__init__(**kwargs)
+
+        self.factory = factory  # Not part of config, but set in constructor; must be callable in the child process
+
+        self._input  = self.create_connector(self._incoming, "input", None, "Documents to pass to the head of the partition.", batch=True)
+        self._output = self.create_socket("output", None, "Documents coming out of the tail of the partition.")
+
+        self.config.set_default(
+            batchsize = 500,
+            batchtime = 0.05
+        )
+
+        self._child = None
+        self._inbox = None    # Our end of the pipe to the child
+        self._outbox = None   # Our end of the pipe from the child
+        self._inbox_lock = threading.Lock()
+        self._child_result = None
+
+    def on_open(self):
+        if not self.factory:
+            msg = "No 'factory' function set for creating the partition."
+            self.log.critical(msg)
+            raise ValueError(msg)
+
+        self._input.max_batch = self.config.batchsize
+        self._child_result = None
+
+        inbox_recv, self._inbox = multiprocessing.Pipe(duplex=False)
+        self._outbox, outbox_send = multiprocessing.Pipe(duplex=False)
+        self._child = multiprocessing.Process(
+            target=_partition_main,
+            args=(self.factory, inbox_recv, outbox_send, (self._inbox, self._outbox), self.config.batchsize, self.config.batchtime))
+        self._child.daemon = True
+        self._child.start()
+        # The child has its own copies of these
+        inbox_recv.close()
+        outbox_send.close()
+        self.log.info("Started partition in process %d." % self._child.pid)
+
+    def on_close(self):
+        self._end_child()
+        if self._inbox:
+            self._inbox.close()
+            self._inbox = None
+        if self._outbox:
+            self._outbox.close()
+            self._outbox = None
+
+    def _end_child(self, timeout=None):
+        if not self._child:
+            return
+        self._child.join(timeout)
+        if self._child.is_alive():
+            self.log.warning("Terminating partition process %d." % self._child.pid)
+            self._child.terminate()
+            self._child.join()
+        self._child = None
+
+    def _post(self, kind, payload=None):
+        with self._inbox_lock:
+            if not self._inbox:
+                return False
+            try:
+                self._inbox.send((kind, payload))
+                return True
+            except (EOFError, IOError) as e:
+                self.log.error("Failed to pass message to partition process: %s: %s" % (e.__class__.__name__, e))
+                return False
+
+    def _receive(self, timeout):
+        "Pass on output from the partition. Returns False when the partition has finished."
+        if self._child_result is not None:
+            return False
+        if not self._outbox.poll(timeout):
+            return True
+        try:
+            kind, payload = self._outbox.recv()
+        except (EOFError, IOError):
+            self.log.error("Partition process ended unexpectedly.")
+            kind = _ABORTED
+        if kind == _DOCS:
+            for document in payload:
+                self._output.send(document)
+            return True
+        self._child_result = kind
+        return False
+
+    def _incoming(self, documents):
+        self._post(_DOCS, documents)
+
+    def on_tick(self):
+        while not (self.end_tick_reason or self.suspended):
+            if not self._receive(self.config.batchtime):
+                # The partition finished on its own
+                if self._child_result == _ABORTED:
+                    self.abort()
+                else:
+                    self.stop()
+                return
+
+    def on_suspend(self):
+        self._post(_SUSPEND)
+
+    def on_resume(self):
+        self._post(_RESUME)
+
+    def on_abort(self):
+        if self._child_result is None:
+            self._post(_ABORT)
+        self._end_child(1.0)
+
+    def on_shutdown(self):
+        # Our connector has already passed everything on to the partition; tell it to finish and collect the rest
+        if self._child_result is None and self._post(_STOP):
+            while self._receive(1.0):
+                pass
+        self._end_child()
@@ -138,8 +138,12 @@ class ProcessWrapper(Generator):
                         self._writeline(self._process.stdin, doc)
                     except Exception as e:
                         self.log.exception("Error writing to subprocess: %s: %s" % (e.__class__.__name__, e.message))
-                        self._process = None
-                        self.stop()
+                        # The subprocess no longer listens, but it may still have output for us. Stop writing and
+                        # keep reading until it hangs up (EoF), which will stop us.
+                        try:
+                            self._process.stdin.close()
+                        except:
+                            pass  # Ignore; it is closed regardless
                         return
 
     def _incoming(self, document):
@@ -2,7 +2,7 @@ __author__ = 'Hans Terje Bakke'
 
 from ..Processor import Processor
 from .RabbitmqBase import RabbitmqBase
-from ..esdoc import tojson
+from ..esdoc import tojson, EsDoc
 import time
 
 
@@ -40,7 +40,6 @@ class RabbitmqWriter(Processor, RabbitmqBase):
         max_queue_size    = 100000     : If the output queue exceeds this number, this processor is considered congested.
     """
 
-    MAX_CONNECTOR_QUEUE_SIZE = 10000
     CHECK_QUEUE_INTERVAL = 5 # 5 seconds; how often to check whether the message queue is "congested"
 
     _is_reader = False  # This is a writer
@@ -83,7 +82,7 @@ class RabbitmqWriter(Processor, RabbitmqBase):
         elif isinstance(document, (int, long, float)):
             data = str(document)
             msg_type = type(document).__name__
-        elif isinstance(document, (list, dict)):
+        elif isinstance(document, (list, dict, EsDoc)):
             try:
                 data = tojson(document)
             except TypeError as e:
@@ -98,12 +97,12 @@ class RabbitmqWriter(Processor, RabbitmqBase):
         if self._publish(msg_type, data):
             self.count += 1
 
+        self.is_congested()  # Keep the message queue congestion state up to date; the check itself is throttled
+
     def is_congested(self):
-        if super(RabbitmqWriter, self).is_congested():
-            return True
-        if self._connector.queue.qsize() > self.MAX_CONNECTOR_QUEUE_SIZE:
-            return True
-        elif not self.config.exchange or self.config.persisting:
+        # Note: Our connector queue is covered by the 'congestion_limit' config, like for any processor.
+        congested = False
+        if not self.config.exchange or self.config.persisting:
             if self.config.max_queue_size:
                 now = time.time()
                 if now - self._last_check_queue_time > self.CHECK_QUEUE_INTERVAL:
@@ -113,7 +112,6 @@ class RabbitmqWriter(Processor, RabbitmqBase):
                         self.log.warning("Failed to get queue size for queue '%s': %s" % (self._queue_name, e))
                     self._last_check_queue_time = now
 
-                if self._last_known_queue_size > self.config.max_queue_size:
-                    return True
-
-        return False
+                congested = self._last_known_queue_size > self.config.max_queue_size
+        self.set_congested("queue", congested)
+        return super(RabbitmqWriter, self).is_congested()
@@ -259,13 +259,9 @@ class RssMonitor(Monitor):
                 if self.config.include_linked_page:
                     self._add_linked_page(item)
 
-                self.log.debug("***YIELD ITEM BEGIN")
                 yield item
-                self.log.debug("***YIELD ITEM END")
 
-                self.log.debug("***PUT ITEM BEING")
                 new, replaced = self._put_item(es, name, item, simulate)
-                self.log.debug("***PUT ITEM END")
                 nNewItems += new
                 nReplacedItems += replaced
 
@@ -352,7 +348,7 @@ class RssMonitor(Monitor):
             self._output.send(doc)
             new = 1  # Consider it new; don't bother checking
         elif simulate:
-            self.doclog.debug("Simulating new item in %-10s: %s" % (channel_name, doc["_source"]["title"]))
+            self.doclog.debug("Simulating new item in %-10s: %s", channel_name, doc["_source"]["title"])
             new = 1
         elif self._item_index:
             ok = False
@@ -377,9 +373,9 @@ class RssMonitor(Monitor):
             if not ok:
                 self.doclog.warning("Failed to write item in channel '%s': %s" % (channel_name, title))
             elif new:
-                self.doclog.debug("New      item in %-10s: %s" % (channel_name, doc["_source"]["title"]))
+                self.doclog.debug("New      item in %-10s: %s", channel_name, doc["_source"]["title"])
             elif replaced:
-                self.doclog.trace("Replaced item in %-10s: %s" % (channel_name, doc["_source"]["title"]))
+                self.doclog.trace("Replaced item in %-10s: %s", channel_name, doc["_source"]["title"])
 
         return (new, replaced)
 
@@ -571,7 +567,7 @@ class RssMonitor(Monitor):
         elif "published_parsed" in item and type(item["published_parsed"]) is time.struct_time:
             t = item["published_parsed"]
         elif self.log.isEnabledFor(logging.DEBUG):
-            self.doclog.debug("Warning: An item in channel '%s' is missing both update and publish time in item data. Using processing time." % channel_name)
+            self.doclog.debug("Warning: An item in channel '%s' is missing both update and publish time in item data. Using processing time.", channel_name)
         return time.strftime("%Y-%m-%dT%H:%M:%SZ", t)
 
     def _get_rss(self, channel_name, url, skip_items=False):
@@ -622,7 +618,7 @@ class RssMonitor(Monitor):
                 rid += i["id"]
             elif "link" in i:
                 rid += i["link"]
-                self.doclog.debug("Found item in channel '%s' without 'id', using 'link' instead." % channel_name)
+                self.doclog.debug("Found item in channel '%s' without 'id', using 'link' instead.", channel_name)
             else:
                 self.doclog.warning("Dropping item from channel '%s' with neither 'id' nor 'link'." % channel_name)
                 continue
@@ -10,8 +10,7 @@ class Timer(Monitor):
     The time units are in seconds ('float'). The 'document' is *whatever* you want on to output,
     typically a string or a dict. type.
 
-    Note that if you have very short intervals, you might want to adjust the run loop delay 'sleep' (not in 'config').
-    (It defaults to 0.5 seconds for this processor.)
+    The timer runs its ticks on the shared Scheduler, and only ticks when the next action is due.
 
     Sockets:
         output     (*)       : Output occurring at configured intervals. From the 'document' part of the configured action.
@@ -23,8 +22,9 @@ class Timer(Monitor):
         super(Timer, self).__init__(**kwargs)
         self._output = self.create_socket("output", None, "Output occurring at configured intervals. From the 'document' part of the configured action.")
 
-        # (Override) Let ticks last half a second here by default... there's generally no rush, unless intervals are very short:
-        self.sleep = 0.5
+        # (Override) No fixed tick interval; each tick schedules the next one for when the next action is due.
+        self.sleep = None
+        self.scheduled = True
 
         self.config.set_default(actions=[]) # A list of tuples of (initial_offset, interval, document)
 
@@ -54,3 +54,11 @@ class Timer(Monitor):
                 a[0] = now + a[1]
                 # Then send the action/document
                 self._output.send(a[2])
+        self._schedule_next()
+
+    def on_startup(self):
+        self._schedule_next()
+
+    def _schedule_next(self):
+        if self._actions:
+            self.schedule_tick(min(a[0] for a in self._actions) - time.time())
@@ -40,13 +40,20 @@ class TweetEntityRemover(Processor):
             remove_mentions = False
         )
 
+        self._source_path = None
+        self._target_path = None
+
+    def on_open(self):
+        self._source_path = esdoc.compile_path(self.config.source_field)
+        self._target_path = esdoc.compile_path("_source." + (self.config.target_field or self.config.source_field))
+
     def _clean(self, doc):
 
         source = doc.get("_source")
         if not source:
             return doc
 
-        text = esdoc.getfield(source, self.config.source_field)
+        text = self._source_path.get(source)
 
         coords = []
         entities = source.get("entities")
@@ -63,7 +70,7 @@ class TweetEntityRemover(Processor):
             # The removal from coords most often leaves two spaces, so remove them, too, and strip border spaces.
             cleaned = remove_parts(text, coords).replace("  ", " ").strip()
 
-        return esdoc.shallowputfield(doc, "_source." + (self.config.target_field or self.config.source_field), cleaned)
+        return esdoc.shallowputfield(doc, self._target_path, cleaned)
 
     def _incoming(self, doc):
         if not self.output.has_output:
@@ -1,6 +1,7 @@
 __author__ = 'Hans Terje Bakke'
 
 from ..Processor import Processor
+from ..esdoc import isdoc
 
 
 class TweetExtractor(Processor):
@@ -56,7 +57,7 @@ class TweetExtractor(Processor):
 
     def _incoming(self, doc):
 
-        if not doc or not type(doc) is dict or not self.has_output:
+        if not doc or not isdoc(doc) or not self.has_output:
             return
 
         tweet, users, links = self._extract(doc)
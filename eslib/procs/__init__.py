@@ -40,6 +40,7 @@ from .Timer                 import Timer
 from .DateExpander          import DateExpander
 from .SmtpMailer            import SmtpMailer
 from .FourChanMonitor       import FourChanMonitor
+from .ProcessPartition      import ProcessPartition
 
 __all__ = (
     "ElasticsearchReader",
@@ -73,5 +74,6 @@ __all__ = (
     "Timer",
     "DateExpander",
     "SmtpMailer",
-    "FourChanMonitor"
+    "FourChanMonitor",
+    "ProcessPartition"
 )
@@ -11,12 +11,21 @@ Helper functions for running as an executable program.
 __all__ = ( "progname", "initlogs")
 
 import os, sys, logging.config, yaml
+from . import logs
 
 
 def progname():
     return os.path.basename(sys.argv[0])
 
-def initlogs(config_file=None):
+def initlogs(config_file=None, asynchronous=True, doclog_rate=100.0, doclog_burst=1000):
+    """
+    Set up logging from a config file (YAML, in logging.config.dictConfig format), or to the console by default.
+
+    With 'asynchronous', log records are written by a background thread instead of the thread that logs (see
+    eslib.logs.AsyncHandler). Unless 'doclog_rate' is None, each doclog logger is limited to 'doclog_rate' records
+    per second, with bursts of up to 'doclog_burst' (see eslib.logs.RateLimitFilter).
+    """
+
     # if config_file:
     #     config_file = os.path.join(os.getcwd(), config_file)
     # else:
@@ -54,3 +63,11 @@ def initlogs(config_file=None):
         rootlog = logging.getLogger()
         rootlog.setLevel(logging.WARNING)
         rootlog.addHandler(console)
+
+    doclog = logging.getLogger("doclog")
+    if asynchronous:
+        logs.install_async()
+    if doclog_rate is not None:
+        rate_limit = logs.RateLimitFilter("doclog", doclog_rate, doclog_burst)
+        for handler in doclog.handlers:
+            handler.addFilter(rate_limit)
@@ -73,6 +73,10 @@ class HttpService(Service):
         POST metadata              Receive changeset and *altered* metadata sections according to subscription.
     """
 
+    # Upper bounds for the "/debug/profile" route, which holds a management thread for the whole period
+    max_profile_seconds  = 300.0
+    max_profile_interval = 1.0
+
     metadata_keys = []
 
     def __init__(self, **kwargs):
@@ -113,6 +117,7 @@ class HttpService(Service):
         self.add_route(self._mgmt_metadata_update, "PUT|POST", "/metadata"  , None)
 
         self.add_route(self._mgmt_debug_free, "DELETE", "/debug/free"     , None)
+        self.add_route(self._mgmt_debug_profile, "GET|POST", "/debug/profile", ["?seconds:float", "?interval:float", "?idle:bool"])
 
         self._receiver = HttpMonitor(service=self, name="receiver", hook=self._hook)
         self.register_procs(self._receiver)
@@ -404,4 +409,20 @@ class HttpService(Service):
 
         return {"message": msg}
 
+    def _mgmt_debug_profile(self, request_handler, payload, seconds=None, interval=None, idle=None, **kwargs):
+        self.log.trace("called: debug/profile")
+
+        from .. import debug
+        seconds = 5.0 if seconds is None else seconds
+        interval = 0.01 if interval is None else interval
+        if not seconds > 0 or not interval > 0:
+            return {"error": "Parameters 'seconds' and 'interval' must be positive."}
+        seconds = min(seconds, self.max_profile_seconds)
+        interval = min(interval, self.max_profile_interval)
+        self.log.info("Profiling for %.1f seconds." % seconds)
+        try:
+            return debug.profile(seconds, interval, bool(idle))
+        except RuntimeError as e:
+            return {"error": str(e)}
+
     #endregion Command handlers
@@ -71,6 +71,11 @@ class PipelineService(Service):
         self.tail.wait()
         return True
 
+    def processing_wait(self, raise_on_error=False):
+        if self.tail:
+            self.tail.wait()  # Returns as soon as the tail stops, instead of polling
+        return super(PipelineService, self).processing_wait(raise_on_error)
+
     def on_processing_suspend(self):
         self.head.suspend()
         return True
@@ -193,7 +193,7 @@ class Service(Configurable):
         registered = 0
         for proc in procs:
             if proc in self._registered_procs:
-                self._registered_procs.append(proc)
+                self._registered_procs.remove(proc)
                 registered += 1
         return registered
 
@@ -641,6 +641,9 @@ class Service(Configurable):
         # velocity, dps
         stats["dps"] = self.stat_dps
 
+        # Per processor statistics, for the registered processors. Names are not unique, so keep them in a list.
+        stats["processors"] = [dict(proc.stats.get(), name=proc.name) for proc in self._registered_procs]
+
         # Allow implementations to add their custom stats
         self.on_stats(stats)
 
@@ -46,7 +46,7 @@ setup(
     author_email='hans.terje.bakke@comperio.no',
     url='https://github.com/comperiosearch/elasticsearch-eslib',
     keywords="document processing docproc",
-    packages=['eslib', 'eslib.procs', 'eslib.service'],
+    packages=['eslib', 'eslib.procs', 'eslib.service', 'eslib.bench'],
 #    package_data={'': ['LICENSE', 'README.md', 'PROTOCOLS.md']},
     scripts=glob('bin/*'),
     include_package_data=True,
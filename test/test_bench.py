@@ -0,0 +1,29 @@
+import unittest
+from eslib.bench import run, report
+
+class TestBench(unittest.TestCase):
+
+    def test_scenarios(self):
+        results = [
+            run("pipeline", 100, timeout=30),
+            run("fanout", 100, width=3, timeout=30),
+            run("chain", 100, {"fuse": True}, depth=3, compact=True, timeout=30)
+        ]
+        print report(results)
+
+        self.assertEqual(100, results[0]["docs"])
+        self.assertEqual(300, results[1]["docs"])
+        self.assertEqual(100, results[2]["docs"])
+        for result in results:
+            self.assertGreater(result["docs_per_sec"], 0)
+            self.assertGreaterEqual(result["p99"], result["p50"])
+            self.assertGreater(result["peak_rss"], 0)
+            self.assertGreaterEqual(result["restart"], 0)
+            self.assertLess(result["stop"], 5.0)
+
+
+def main():
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 import unittest
-from eslib import Config
+from eslib import Config, Processor
 
 class TestConfig(unittest.TestCase):
 
@@ -48,6 +48,54 @@ class TestConfig(unittest.TestCase):
         print config.x
         self.assertEqual("X", config.x)
 
+    def test_snapshot(self):
+        config = Config(a="D")
+        config.set_default(a="A", b="B")
+        config["not-an-identifier"] = 1
+
+        snapshot = config.snapshot()
+        config.a = "E"
+
+        self.assertEqual("D", snapshot.a)
+        self.assertEqual("B", snapshot.b)
+        self.assertEqual(1, snapshot["not-an-identifier"])
+        self.assertEqual(None, snapshot.get("x"))
+        with self.assertRaises(AttributeError):
+            snapshot.a = "F"
+        self.assertEqual("E", config.snapshot().a)
+
+    def test_reconfigure(self):
+
+        class MyProcessor(Processor):
+            def __init__(self, **kwargs):
+                super(MyProcessor, self).__init__(**kwargs)
+                self.create_connector(lambda doc: None, "input")
+                self.config.set_default(word="a")
+                self.compiled = None
+            def on_open(self):
+                self.compiled = self.settings.word.upper()
+            def on_reconfigure(self):
+                if not self.settings.word:
+                    raise ValueError("Missing word.")
+                self.on_open()
+
+        p = MyProcessor()
+        p.start()
+        self.assertEqual("A", p.compiled)
+
+        p.reconfigure(word="b")
+        self.assertEqual("b", p.settings.word)
+        self.assertEqual("B", p.compiled)
+
+        with self.assertRaises(ValueError):
+            p.reconfigure(word=None)
+        self.assertEqual("b", p.config.word)
+        self.assertEqual("b", p.settings.word)
+        self.assertEqual("B", p.compiled)
+
+        p.stop()
+        p.wait()
+
 def main():
     unittest.main()
 
@@ -110,6 +110,30 @@ class TestConnections(unittest.TestCase, Connections):
         self.assertTrue(len(self.d.connectors["input_anything"].connections) == 0)
         self.assertTrue(len(self.d.connectors["input_ext"].connections) == 0)
 
+    def test_has_output(self):
+        self.create_processors()
+        self.create_terminals()
+
+        self.assertFalse(self.a.has_output)
+        self.assertFalse(self.a.sockets["output"].has_output)
+
+        self.b.subscribe(self.a)
+        self.assertTrue(self.a.has_output)
+        self.assertTrue(self.a.sockets["output"].has_output)
+        self.assertEqual(self.a.sockets["output"]._subscribers, (self.b.connectors["input"],))
+
+        self.b.unsubscribe()
+        self.assertFalse(self.a.has_output)
+        self.assertEqual(self.a.sockets["output"]._subscribers, ())
+
+        callback = lambda proc, doc: None
+        self.c.add_callback(callback, "output_ext")
+        self.assertTrue(self.c.has_output)
+        self.assertFalse(self.c.sockets["output_doc"].has_output)
+        self.assertTrue(self.c.sockets["output_ext"].has_output)
+        self.c.sockets["output_ext"].remove_callback(callback)
+        self.assertFalse(self.c.has_output)
+
 
 def main():
     unittest.main()
@@ -0,0 +1,39 @@
+import unittest, time
+from eslib import Processor
+from eslib.debug import profile
+
+class Spinner(Processor):
+    def __init__(self, **kwargs):
+        super(Spinner, self).__init__(**kwargs)
+        self.create_connector(self._incoming, "input")
+
+    def _incoming(self, doc):
+        t = time.time() + doc
+        while time.time() < t:
+            pass
+
+class TestDebug(unittest.TestCase):
+
+    def test_profile(self):
+        p = Spinner(name="spinner")
+        p.start()
+        p.put(1.0)
+        try:
+            res = profile(0.3, 0.01)
+        finally:
+            p.stop()
+            p.wait()
+        print res["collapsed"]
+
+        self.assertGreater(res["samples"], 0)
+        self.assertIn("spinner", res["processors"])
+        self.assertIn("input", res["processors"]["spinner"]["terminals"])
+        self.assertTrue(any(line.startswith("spinner;input;") for line in res["collapsed"].splitlines()))
+        self.assertIn("_incoming (test_debug.py:", res["collapsed"])
+
+
+def main():
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
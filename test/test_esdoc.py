@@ -0,0 +1,119 @@
+import unittest
+from eslib import esdoc
+
+class TestEsdoc(unittest.TestCase):
+
+    def _doc(self):
+        return {
+            "_id": "1",
+            "_retry": 2,
+            "_source": {
+                "title": "old title",
+                "text": "old text",
+                "entities": {"tags": ["a"]},
+                "user": {"name": "someone"}
+            }
+        }
+
+    def test_overlay_shares_unmodified(self):
+        doc = self._doc()
+        overlay = esdoc.Overlay(doc)
+        self.assertIs(overlay.materialize(), doc)  # Nothing modified
+
+        overlay.putfield("_source.title", "new title")
+        overlay.putfield("_source.text", "new text")
+        overlay.putfield("_source.meta.lang", "en")
+        self.assertEqual("new title", overlay.getfield("_source.title"))
+        self.assertEqual("someone", overlay.getfield("_source.user.name"))
+        new = overlay.materialize()
+
+        # The original is untouched
+        self.assertEqual(self._doc(), doc)
+        # Modified
+        self.assertEqual("new title", new["_source"]["title"])
+        self.assertEqual("new text", new["_source"]["text"])
+        self.assertEqual("en", new["_source"]["meta"]["lang"])
+        # Cloned path, and shared rest
+        self.assertIsNot(doc["_source"], new["_source"])
+        self.assertIs(doc["_source"]["entities"], new["_source"]["entities"])
+        self.assertIs(doc["_source"]["user"], new["_source"]["user"])
+
+    def test_overlay_remove(self):
+        doc = self._doc()
+        new = esdoc.Overlay(doc).removefield("_retry").removefield("_source.missing.field").putfield("_id", "2").materialize()
+        self.assertEqual(2, doc["_retry"])
+        self.assertFalse("_retry" in new)
+        self.assertFalse("missing" in new["_source"])
+        self.assertEqual("2", new["_id"])
+        self.assertIs(doc["_source"], new["_source"])
+
+    def test_field_path(self):
+        doc = self._doc()
+        path = esdoc.compile_path("_source.user.name")
+        self.assertIs(path, esdoc.compile_path("_source.user.name"))
+        self.assertEqual(("_source", "user", "name"), path.names)
+        self.assertEqual("someone", path.get(doc))
+        self.assertEqual("someone", esdoc.getfield(doc, path))
+        self.assertEqual("x", esdoc.compile_path("_source.title.x").get(doc, "x"))
+        self.assertIs(doc, esdoc.getfield(doc, ""))
+
+        docs = [doc, {"_source": {"user": {}}}, None]
+        self.assertEqual(["someone", "none", "none"], path.getmany(docs, "none"))
+        self.assertEqual(["someone", None, None], esdoc.getfields(docs, "_source.user.name"))
+
+        path.put(doc, "someone else")
+        self.assertEqual("someone else", doc["_source"]["user"]["name"])
+        esdoc.putfield(doc, esdoc.compile_path("_source.new.field"), 1)
+        self.assertEqual({"field": 1}, doc["_source"]["new"])
+        self.assertRaises(AttributeError, esdoc.putfield, doc, "_source.title.x", 1)
+
+        overlay = esdoc.Overlay(doc).putfield(path, "third")
+        self.assertEqual("third", overlay.getfield("_source.user.name"))
+        self.assertEqual("third", overlay.getfield(path))
+        self.assertEqual("third", overlay.materialize()["_source"]["user"]["name"])
+
+    def test_shallowputfield(self):
+        doc = self._doc()
+        new = esdoc.shallowputfield(doc, "_source.user.name", "someone else")
+        self.assertEqual("someone", doc["_source"]["user"]["name"])
+        self.assertEqual("someone else", new["_source"]["user"]["name"])
+        self.assertIs(doc["_source"]["entities"], new["_source"]["entities"])
+        self.assertRaises(AttributeError, esdoc.shallowputfield, doc, "_source.title.x", 1)
+
+    def test_esdoc_mapping(self):
+        doc = esdoc.EsDoc(self._doc())
+        doc["extra"] = "x"
+        self.assertTrue(esdoc.isdoc(doc))
+        self.assertFalse(hasattr(doc, "__dict__"))
+        self.assertEqual(dict(self._doc(), extra="x"), dict(doc))
+        self.assertEqual(dict(self._doc(), extra="x"), doc)
+        self.assertEqual(4, len(doc))
+        self.assertTrue("_id" in doc)
+        self.assertFalse("_parent" in doc)
+        self.assertIsNone(doc.get("_parent"))
+        self.assertRaises(KeyError, lambda: doc["_parent"])
+
+        self.assertEqual("someone", esdoc.getfield(doc, "_source.user.name"))
+        esdoc.putfield(doc, "_source.user.name", "someone else")
+        self.assertEqual("someone else", doc["_source"]["user"]["name"])
+
+        self.assertEqual(2, doc.pop("_retry"))
+        self.assertEqual("x", doc.pop("extra"))
+        self.assertFalse("_retry" in doc)
+        self.assertEqual(['_id', '_source'], doc.keys())
+
+        new = esdoc.Overlay(doc).putfield("_id", "2").materialize()
+        self.assertIsInstance(new, esdoc.EsDoc)
+        self.assertEqual("1", doc["_id"])
+        self.assertEqual("2", new["_id"])
+
+        self.assertEqual(esdoc.tojson(dict(doc)), esdoc.tojson(doc))
+        import pickle
+        self.assertEqual(doc, pickle.loads(pickle.dumps(doc)))
+
+
+def main():
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
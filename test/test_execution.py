@@ -1,7 +1,7 @@
-import unittest, time
+import unittest, time, threading
 from test_connections import Connections
 from eslib import Processor, Generator
-from eslib.procs import Timer
+from eslib.procs import Timer, Transformer
 from eslib.service import Service
 
 
@@ -38,6 +38,15 @@ class MyGenerator(Generator):
             time.sleep(self.stopping_delay)
 
 
+def wait_until(condition, timeout=10.0):
+    "Wait until 'condition' returns True, or fail after 'timeout' seconds."
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("Condition not met within %s seconds." % timeout)
+        time.sleep(0.01)
+
+
 class MyInOut(Processor):
     def __init__(self, **kwargs):
         super(MyInOut, self).__init__(**kwargs)
@@ -57,9 +66,17 @@ class MyRestartable(Generator):
         self.create_connector(self.proc_input, "input", "proto_str")
         self.create_socket("output", "proto_str")
         self.count = 0
+        self.shutdown_until = None  # If set, shutdown lasts until this returns True, instead of 2 seconds
+        self.opened = []  # (pending, count) when opened, i.e. before the connector is resumed after a restart
+
+    def on_open(self):
+        self.opened.append((self.connectors["input"].pending, self.count))
 
     def on_shutdown(self):
-        time.sleep(2)
+        if self.shutdown_until:
+            wait_until(self.shutdown_until)
+        else:
+            time.sleep(2)
 
     def proc_input(self, document):
         print "%s: incoming document: %s" % (self.name, document)
@@ -67,6 +84,23 @@ class MyRestartable(Generator):
         self.sockets["output"].send("%s.%s" % (self.name, document))
 
 
+class MyDrainer(Generator):
+    "Holds incoming documents until shutdown, and sends them then."
+    def __init__(self, **kwargs):
+        super(MyDrainer, self).__init__(**kwargs)
+        self.create_connector(self.proc_input, "input", "proto_str")
+        self.create_socket("output", "proto_str")
+        self.held = []
+
+    def on_shutdown(self):
+        held, self.held = self.held, []
+        for document in held:
+            self.sockets["output"].send(document)
+
+    def proc_input(self, document):
+        self.held.append(document)
+
+
 class TestExecution(unittest.TestCase, Connections):
 
     def callback(self, proc, document):
@@ -214,6 +248,39 @@ class TestExecution(unittest.TestCase, Connections):
         self.assertTrue("p4.p3.p2.p1.hello1" in self.seq, "Expected p4.p3.p2.p1.hello1 to have been generated.")
         self.assertTrue("p4.p3.p2.hello2"    in self.seq, "Expected p4.p3.p2.hello2 to have been generated.")
 
+    def test_shutdown_drain_repeated(self):
+        # The run loop must be counted as running before the connector can stop, or the processor
+        # may close without calling on_shutdown() and the held documents are lost.
+        p = MyDrainer()
+        self.addCleanup(p.abort)
+        docs = []
+        p.add_callback(lambda proc, doc: docs.append(doc))
+
+        # Busy threads competing for the interpreter make the race likely
+        done = threading.Event()
+        def burn():
+            while not done.is_set():
+                pass
+        burners = [threading.Thread(target=burn) for i in range(3)]
+        for burner in burners:
+            burner.daemon = True
+            burner.start()
+        def stop_burning():
+            done.set()
+            for burner in burners:
+                burner.join()
+        self.addCleanup(stop_burning)
+
+        for run in range(50):
+            del docs[:]
+            p.start()
+            for i in range(25):
+                p.put("doc%d" % i)
+            p.stop()
+            p.wait()
+            self.assertEqual(["doc%d" % i for i in range(25)], docs, "Lost documents in run %d." % run)
+            self.assertEqual([], p.held)
+
     def test_no_keepalive(self):
 
         g = MyGenerator(name="generator")
@@ -302,6 +369,8 @@ class TestExecution(unittest.TestCase, Connections):
     def test_startup(self):
         gen = SeqGen()
         gen.start()
+        # on_startup() is not guaranteed to run before the connector delivers, so do not race it
+        self.assertTrue(gen.started.wait(10))
         gen.put("Hello")
         gen.stop()
         gen.wait()
@@ -319,6 +388,8 @@ class TestExecution(unittest.TestCase, Connections):
         p2 = MyRestartable(name="p2")
         p3 = MyInOut(name="p3")
         p1.attach(p2.attach(p3))
+        for p in (p1, p2, p3):
+            self.addCleanup(p.abort)  # A failure must not leave the timer running
 
         docs1 = []
         docs2 = []
@@ -329,7 +400,7 @@ class TestExecution(unittest.TestCase, Connections):
 
         print "** starting pipeline"
         p1.start()
-        time.sleep(2)  # Two docs should be created meanwhile
+        wait_until(lambda: len(docs2) == 2)  # Two docs should be created and passed on meanwhile
 
         print "** making sure all are running"
         self.assertTrue(p1.running)
@@ -342,47 +413,50 @@ class TestExecution(unittest.TestCase, Connections):
         self.assertEqual(pending, 0)
 
         print "** restarting p2"
+        p2.shutdown_until = lambda: len(docs1) == 4  # Shutdown lasts until p1 has sent two more docs
         p2.restart()
         print "** p2 restarted"
 
-        # Shutdown is set to take 2 seconds, so things should have queued up now
         print "** making sure all are running"
         self.assertTrue(p1.running)
         self.assertTrue(p2.running)
         self.assertTrue(p3.running)
-        print "** making sure we have 2 pending"
-        pending = p2.connectors["input"].pending
+        print "** making sure the 2 docs queued up during restart were pending when p2 opened again"
+        # Note: By the time restart() returns, the resumed connector is already woken up to process them, so the
+        #       queue is looked at as p2 opens, just before its connector is resumed.
+        pending, count = p2.opened[-1]
         print "** pending =", pending
         self.assertEqual(pending, 2)
         print "** making sure we have the expected throughput"
         print "** throughput = %2d %2d %2d" % (len(docs1), len(docs2), len(docs3))
         self.assertEqual(len(docs1), 4)
-        self.assertEqual(len(docs2), 2)
+        self.assertEqual(count, 2)
 
-        time.sleep(2)
+        wait_until(lambda: len(docs2) == 4)
         # It should have caught up by now
         print "** making sure we have 0 pending"
         pending = p2.connectors["input"].pending
         print "** pending =", pending
         self.assertEqual(pending, 0)
+        wait_until(lambda: len(docs2) == 6)
         print "** making sure we have the expected throughput"
         print "** throughput = %2d %2d %2d" % (len(docs1), len(docs2), len(docs3))
         self.assertEqual(len(docs1), 6)
         self.assertEqual(len(docs2), 6)
 
         print "** stopping p2"
+        p2.shutdown_until = lambda: len(docs1) == 8  # So p1 will get two more documents that p2 does not get
         p2.stop()
         print "** waiting for p3 to finish"
         p3.wait()
 
-        # Shutdown is set to take 2 seconds, so p1 will get two more documents that p2 did not get
         print "** making sure we have the expected throughput"
         print "** throughput = %2d %2d %2d" % (len(docs1), len(docs2), len(docs3))
         self.assertEqual(len(docs1), 8)
         self.assertEqual(len(docs2), 6)
 
-        time.sleep(2)
-        # Two more documents should be generated by p1 during this time, that p2 is not getting
+        wait_until(lambda: len(docs1) == 10)
+        # Two more documents were generated by p1 during this time, that p2 is not getting
         print "** stopping p1"
         p1.stop()
         print "** waiting for p1 to finish"
@@ -468,6 +542,357 @@ class TestExecution(unittest.TestCase, Connections):
         print "DOCS =", docs
         self.assertItemsEqual(['Ax', 'Axx', 'Axxx', 'bx', 'bxx', 'bxxx'], docs)
 
+    def test_chain_latency(self):
+
+        from eslib.procs import Transformer
+
+        chain = [Transformer(lambda proc, doc: [doc], name="trans_%d" % i) for i in range(6)]
+        for prev, proc in zip(chain, chain[1:]):
+            proc.subscribe(prev)
+
+        arrived = []
+        chain[-1].add_callback(lambda proc, doc: arrived.append((doc, time.time())))
+
+        chain[0].start()
+        time.sleep(0.1)  # Let all connector threads settle in
+        latencies = []
+        for i in range(10):
+            sent = time.time()
+            chain[0].put("doc%d" % i)
+            while len(arrived) <= i and time.time() - sent < 5.0:
+                time.sleep(0.001)
+            latencies.append(arrived[i][1] - sent)
+        chain[0].stop()
+        chain[-1].wait()
+
+        print "LATENCIES =", latencies
+        # With connectors sleep-polling their queues this would be up to 0.1 s per hop.
+        self.assertLess(max(latencies), 0.1)
+
+    def test_batch_connector(self):
+
+        batches = []
+        p = Processor(name="batcher")
+        p.create_connector(lambda docs: batches.append(docs), "input", batch=True, max_batch=100)
+
+        p.start()
+        p.suspend()
+        for i in range(250):
+            p.put("doc%d" % i)
+        p.resume()
+        p.stop()
+        p.wait()
+
+        print "BATCH SIZES =", [len(b) for b in batches]
+        self.assertTrue(all(len(b) <= 100 for b in batches))
+        self.assertEqual(["doc%d" % i for i in range(250)], [doc for b in batches for doc in b])
+
+    def test_bounded_queue(self):
+
+        received = []
+        depths = []
+        def slow(doc):
+            depths.append(consumer.connectors["input"].pending)
+            time.sleep(0.005)
+            received.append(doc)
+
+        consumer = Processor(name="consumer")
+        consumer.create_connector(slow, "input", capacity=5)
+        producer = Transformer(lambda proc, doc: [doc], name="producer")
+        consumer.subscribe(producer)
+
+        producer.start()
+        for i in range(50):
+            producer.put("doc%d" % i)
+        producer.stop()
+        consumer.wait()
+
+        self.assertEqual(["doc%d" % i for i in range(50)], received)
+        self.assertLessEqual(max(depths), 5)
+
+    def test_bounded_queue_release_on_abort(self):
+
+        consumer = Processor(name="consumer", queue_capacity=2)
+        consumer.create_connector(lambda doc: None, "input")
+        consumer.start()
+        consumer.suspend()
+
+        def produce():
+            for i in range(5):
+                consumer.put("doc%d" % i)  # Blocks on the third document
+        producer = threading.Thread(target=produce)
+        producer.start()
+        time.sleep(0.1)
+        self.assertTrue(producer.isAlive())
+        self.assertEqual(2, consumer.connectors["input"].pending)
+
+        consumer.abort()
+        producer.join(1.0)
+        self.assertFalse(producer.isAlive())
+
+    def test_congestion(self):
+
+        source = Transformer(lambda proc, doc: [doc], name="source")
+        fast = Processor(name="fast")
+        fast.create_connector(lambda doc: None, "input")
+        slow = Processor(name="slow", congestion_limit=10, congestion_low=2)
+        slow.create_connector(lambda doc: None, "input")
+        fast.subscribe(source)
+        slow.subscribe(source)
+
+        source.start()
+        slow.suspend()
+        self.assertIsNone(source.congestion())
+        for i in range(11):
+            source.put("doc%d" % i)
+        time.sleep(0.1)
+        # Congestion in the second branch is seen, too
+        self.assertIs(source.congestion(), slow)
+        self.assertTrue(slow.connectors["input"].congested)
+
+        slow.resume()
+        time.sleep(0.1)
+        self.assertIsNone(source.congestion())
+
+        # A new subscriber inherits and reports the congestion state of its subscribers
+        slow.suspend()
+        for i in range(11):
+            source.put("doc%d" % i)
+        time.sleep(0.1)
+        head = Transformer(lambda proc, doc: [doc], name="head")
+        source.subscribe(head)
+        self.assertIs(head.congestion(), slow)
+        source.unsubscribe(head)
+        self.assertIsNone(head.congestion())
+
+        source.stop()
+        slow.resume()
+        slow.wait()
+
+    def test_fused_chain(self):
+
+        threads = set()
+        def func(proc, doc):
+            threads.add(threading.current_thread())
+            yield doc + "x"
+
+        head = Transformer(func, name="head")
+        middle = Transformer(func, name="middle", fuse=True)
+        tail = Transformer(func, name="tail", fuse=True)
+        head.attach(middle.attach(tail))
+        docs = []
+        tail.add_callback(lambda proc, doc: docs.append(doc))
+
+        head.start()
+        for i in range(100):
+            head.put("doc%d" % i)
+        head.stop()
+        tail.wait()
+
+        self.assertEqual(["doc%dxxx" % i for i in range(100)], docs)
+        # Everything was processed in the head's connector thread
+        self.assertEqual(1, len(threads))
+        self.assertFalse(middle.running)
+        self.assertFalse(tail.running)
+
+    def test_workers_ordered(self):
+
+        import random
+        def func(proc, doc):
+            time.sleep(random.random() * 0.02)
+            yield doc + "x"
+
+        p = Transformer(func, name="parallel", workers=4)
+        docs = []
+        p.add_callback(lambda proc, doc: docs.append(doc))
+
+        p.start()
+        self.assertTrue(p.sockets["output"]._capturing)  # Output from the workers is captured
+        started = time.time()
+        for i in range(100):
+            p.put("doc%d" % i)
+        p.stop()
+        p.wait()
+        elapsed = time.time() - started
+
+        self.assertEqual(["doc%dx" % i for i in range(100)], docs)
+        self.assertLess(elapsed, 100 * 0.01)  # Sequential processing would average 1 second
+        self.assertFalse(p.sockets["output"]._capturing)
+
+    def test_workers_unordered(self):
+
+        p = Transformer(lambda proc, doc: [doc + "x"], name="parallel", workers=4, workers_ordered=False)
+        docs = []
+        p.add_callback(lambda proc, doc: docs.append(doc))
+
+        p.start()
+        for i in range(100):
+            p.put("doc%d" % i)
+        p.stop()
+        p.wait()
+
+        self.assertItemsEqual(["doc%dx" % i for i in range(100)], docs)
+
+    def test_workers_process(self):
+
+        import os
+        p = Transformer(lambda proc, doc: [(doc, os.getpid())], name="parallel", workers=2, worker_backend="process")
+        docs = []
+        p.add_callback(lambda proc, doc: docs.append(doc))
+
+        p.start()
+        for i in range(20):
+            p.put("doc%d" % i)
+        p.stop()
+        p.wait()
+
+        self.assertEqual(["doc%d" % i for i in range(20)], [doc for doc, pid in docs])
+        self.assertNotIn(os.getpid(), [pid for doc, pid in docs])
+
+    def test_statistics(self):
+
+        p1 = Transformer(lambda proc, doc: [doc, doc], name="double")
+        p2 = Transformer(lambda proc, doc: [doc], name="copy", batch=True)
+        p2.subscribe(p1)
+        t = Timer(actions=[(0, 0.1, "tick")])
+        t.sleep = 0.01
+
+        p1.start()
+        t.start()
+        for i in range(10):
+            p1.put("doc%d" % i)
+        p1.stop()
+        p2.wait()
+        time.sleep(0.2)
+        t.stop()
+        t.wait()
+
+        stats = p1.stats.get()
+        self.assertEqual(stats["status"], "stopped")
+        self.assertEqual(stats["iteration"], 1)
+        self.assertEqual(stats["input_count"], 10)
+        self.assertEqual(stats["output_count"], 20)
+        self.assertEqual(stats["pending_count"], 0)
+        self.assertEqual(stats["connectors"]["input"]["count"], 10)
+        self.assertEqual(sum(stats["connectors"]["input"]["latency"].values()), 10)
+        self.assertEqual(stats["sockets"]["output"]["count"], 20)
+
+        stats = p2.stats.get()
+        self.assertEqual(stats["input_count"], 20)
+        self.assertEqual(stats["output_count"], 20)
+
+        stats = t.stats.get()
+        self.assertGreater(stats["tick_count"], 0)
+        self.assertGreaterEqual(stats["output_count"], 2)
+
+        # Processors with the same name must not overwrite each other's stats in the service
+        p3 = Transformer(lambda proc, doc: [doc], name="copy")
+        s = Service()
+        s.register_procs(p1, p2, p3)
+        stats = s.get_stats()["processors"]
+        self.assertEqual(["double", "copy", "copy"], [x["name"] for x in stats])
+        self.assertEqual([20, 0], [x["input_count"] for x in stats[1:]])
+
+    def test_scheduled_tick(self):
+
+        class Sleeper(Generator):
+            def __init__(self, **kwargs):
+                super(Sleeper, self).__init__(**kwargs)
+                self.sleep = None
+                self.scheduled = True
+                self.ticks = 0
+            def on_startup(self):
+                self.schedule_tick(0.1)
+            def on_tick(self):
+                self.ticks += 1
+
+        p = Sleeper()
+        p.start()
+        time.sleep(0.3)
+        self.assertEqual(p.ticks, 1)  # Only the one scheduled tick
+        p.wakeup()
+        time.sleep(0.1)
+        self.assertEqual(p.ticks, 2)
+        p.stop()
+        p.wait()
+        self.assertFalse(p.running)
+
+        t = Timer(actions=[(0, 0.1, "tick")])
+        output = []
+        t.add_callback(lambda proc, doc: output.append(doc))
+        t.start()
+        time.sleep(0.35)
+        t.stop()
+        t.wait()
+        self.assertTrue(3 <= len(output) <= 5)
+        self.assertLessEqual(t.stats.get()["tick_count"], 6)
+
+    def test_stop_latency(self):
+
+        procs = [Transformer(lambda proc, doc: [doc], name="t%d" % i) for i in range(20)]
+        for a, b in zip(procs, procs[1:]):
+            a.attach(b)
+        procs[0].start()
+        procs[0].put("doc")
+
+        started = time.time()
+        procs[0].stop()
+        procs[-1].wait()
+        # Connectors are stopped in parallel, and wait() is signalled rather than polling every 0.1 seconds
+        self.assertLess(time.time() - started, 0.1)
+        self.assertFalse(any(p.running for p in procs))
+
+    def test_scheduled_connectors(self):
+
+        threads = set()
+        def func(proc, doc):
+            threads.add(threading.current_thread().name)
+            yield doc + "x"
+
+        procs = [Transformer(func, name="t%d" % i, scheduled_connectors=True) for i in range(20)]
+        for a, b in zip(procs, procs[1:]):
+            a.attach(b)
+        docs = []
+        procs[-1].add_callback(lambda proc, doc: docs.append(doc))
+
+        before = threading.active_count()
+        procs[0].start()
+        for i in range(500):
+            procs[0].put("doc%d" % i)
+        self.assertLessEqual(threading.active_count(), before + 4)  # Only the shared scheduler threads
+        self.assertTrue(all(t.daemon for t in threading.enumerate() if t.name.startswith("scheduler-")))  # Never keep the process alive
+        procs[0].stop()
+        procs[-1].wait()
+
+        self.assertEqual(["doc%d%s" % (i, "x" * 20) for i in range(500)], docs)
+        self.assertTrue(all(name.startswith("scheduler-") for name in threads))
+        self.assertFalse(any(p.running for p in procs))
+
+        # Start over again
+        docs[:] = []
+        procs[0].start()
+        procs[0].put("again")
+        procs[0].stop()
+        procs[-1].wait()
+        self.assertEqual(["again" + "x" * 20], docs)
+
+    def test_scheduled_connectors_bounded(self):
+
+        # More bounded queues in a chain than there are scheduler threads; senders on those threads must not block
+        procs = [Transformer(lambda proc, doc: [doc], name="t%d" % i, scheduled_connectors=True, queue_capacity=2) for i in range(10)]
+        for a, b in zip(procs, procs[1:]):
+            a.attach(b)
+        docs = []
+        procs[-1].add_callback(lambda proc, doc: docs.append(doc))
+
+        procs[0].start()
+        for i in range(2000):
+            procs[0].put("doc%d" % i)
+        procs[0].stop()
+        procs[-1].wait()
+
+        self.assertEqual(["doc%d" % i for i in range(2000)], docs)
+        self.assertFalse(any(p.running for p in procs))
 
 from threading import Lock
 
@@ -477,6 +902,7 @@ class SeqGen(Generator):
         self.create_connector(self.incoming, "input")
         self.seq = []
         self.lock = Lock()
+        self.started = threading.Event()  # Set once on_startup() holds the lock
 
     def on_open(self):
         with self.lock:
@@ -484,6 +910,7 @@ class SeqGen(Generator):
 
     def on_startup(self):
         with self.lock:
+            self.started.set()
             time.sleep(1)
             self.seq.append("on_startup")
             time.sleep(1)
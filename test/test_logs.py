@@ -0,0 +1,111 @@
+import unittest, logging, os, shutil, tempfile
+from eslib.logs import AsyncHandler, RateLimitFilter, install_async
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+class TestLogs(unittest.TestCase):
+
+    def _logger(self, name, handler):
+        log = logging.getLogger(name)
+        log.handlers = []
+        log.addHandler(handler)
+        log.setLevel(logging.DEBUG)
+        log.propagate = False
+        return log
+
+    def test_extended_record(self):
+        target = ListHandler()
+        log = self._logger("testlogs.svc.proc", target)
+        log.className = "MyProcessor"
+        log.info("hello")
+        rec = target.records[0]
+        self.assertEqual(rec.firstName, "testlogs")
+        self.assertEqual(rec.lastName, "proc")
+        self.assertEqual(rec.names, ["testlogs", "svc", "proc"])
+        self.assertEqual(rec.className, "MyProcessor")
+        self.assertIsNone(rec.instanceName)
+
+    def test_async_handler(self):
+        target = ListHandler()
+        log = self._logger("testlogs.async", target)
+        handlers = install_async(["testlogs.async"])
+        self.assertEqual(len(handlers), 1)
+        self.assertIsInstance(log.handlers[0], AsyncHandler)
+
+        doc = {"id": 1}
+        log.info("doc %s", doc)
+        doc["id"] = 2  # Formatted before queued; must not show
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            log.exception("failed")
+        log.handlers[0].flush()
+
+        self.assertEqual([r.getMessage() for r in target.records], ["doc {'id': 1}", "failed"])
+        self.assertIn("ValueError: boom", target.records[1].exc_text)
+        handlers[0].close()
+
+    def test_async_handler_forked(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, "log")
+        target = logging.FileHandler(path)
+        self.addCleanup(target.close)
+        log = self._logger("testlogs.forked", target)
+        handlers = install_async(["testlogs.forked"])
+        self.addCleanup(handlers[0].close)
+        log.info("parent")
+        handlers[0].flush()
+
+        pid = os.fork()
+        if not pid:
+            # No background thread here; the record must still be written, and before we exit
+            try:
+                log.info("child")
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+
+        with open(path) as f:
+            self.assertEqual(["parent", "child"], f.read().splitlines())
+
+    def test_rate_limit(self):
+        now = [1000.0]
+        target = ListHandler()
+        target.addFilter(RateLimitFilter("testlogs.limited", rate=10, burst=10, clock=lambda: now[0]))
+        log = self._logger("testlogs", target)
+        limited = logging.getLogger("testlogs.limited.proc")
+
+        for i in range(100):
+            limited.warning("doc %d", i)
+            log.warning("free %d", i)
+        self.assertEqual(len([r for r in target.records if r.name == "testlogs"]), 100)
+        self.assertEqual([r.getMessage() for r in target.records if r.name != "testlogs"], ["doc %d" % i for i in range(10)])
+
+        now[0] += 0.25  # Room for two more
+        for i in range(3):
+            limited.warning("after %d", i)
+        self.assertEqual([r.getMessage() for r in target.records[-2:]],
+                         ["(90 similar log records suppressed) after 0", "after 1"])
+
+    def test_rate_limit_sample(self):
+        target = ListHandler()
+        target.addFilter(RateLimitFilter(rate=0.001, burst=1, sample=10))
+        log = self._logger("testlogs.sampled", target)
+        for i in range(31):
+            log.warning("doc %d", i)
+        self.assertEqual([r.getMessage() for r in target.records],
+                         ["doc 0", "(9 similar log records suppressed) doc 10",
+                          "(9 similar log records suppressed) doc 20", "(9 similar log records suppressed) doc 30"])
+
+def main():
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
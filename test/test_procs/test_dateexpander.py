@@ -38,6 +38,7 @@ class TestDateFields(unittest.TestCase):
 
     def setUp(self):
         self.expander = DateExpander()
+        self.expander.on_open()
 
     def test_missing_source_section(self):
         # if the dict doesn't have source it should be returned
@@ -65,3 +66,10 @@ class TestDateFields(unittest.TestCase):
         doc = self.expander._process(dict_w_ok_date)
         print doc
         self.assertEqual(doc, dict_w_ok_date)
+
+    def test_bad_document_in_batch(self):
+        # A document that fails is dropped alone, not with the rest of its batch
+        output = []
+        self.expander.add_callback(lambda proc, doc: output.append(doc))
+        self.expander._incoming([dict_w_ok_date, 42, dict_wo_ok_date])
+        self.assertEqual([dict_w_ok_date, dict_wo_ok_date], output)
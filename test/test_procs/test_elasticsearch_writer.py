@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+
+import unittest, threading, time, json
+import elasticsearch
+from datetime import datetime
+from eslib.procs import ElasticsearchWriter
+
+class FakeTransport(object):
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+class FakeElasticsearch(object):
+    "Stands in for the Elasticsearch client, answering bulk requests with success for all items."
+
+    def __init__(self, delay=0, reject=None, status=None):
+        self.transport = FakeTransport()
+        self.bulks = []
+        self.delay = delay
+        self.reject = reject  # Function (number of docs) -> whether to reject all with status 429
+        self.status = status  # Function (action, source) -> status for the item
+        self.lock = threading.Lock()
+        self.active_ids = set()  # Ids in requests in flight
+        self.active = 0
+        self.max_active = 0
+        self.id_clashes = 0
+        self.after_close = 0  # Requests made after the client was closed
+
+    def bulk(self, body):
+        body = [json.loads(line) for line in body.splitlines()]
+        if self.transport.closed:
+            self.after_close += 1
+        ids = set(action.values()[0].get("_id") for action in body[0::2])
+        with self.lock:
+            self.bulks.append(body)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            if self.active_ids & ids:
+                self.id_clashes += 1
+            self.active_ids |= ids
+        time.sleep(self.delay(len(ids)) if callable(self.delay) else self.delay)
+        with self.lock:
+            self.active -= 1
+            self.active_ids -= ids
+        rejected = self.reject and self.reject(len(body) // 2)
+        items = []
+        for action, source in zip(body[0::2], body[1::2]):
+            op, meta = action.items()[0]
+            item = {"_id": meta.get("_id") or "auto", "_index": meta["_index"], "_type": meta["_type"], "_version": 1, "status": 201}
+            status = 429 if rejected else (self.status(action, source) if self.status else 201)
+            if status == 429:
+                item.update(status=429, error={"type": "es_rejected_execution_exception"})
+            elif status >= 300:
+                item.update(status=status, error={"type": "mapper_parsing_exception", "reason": "failed to parse"})
+            items.append({op: item})
+        return {"errors": bool(rejected), "items": items}
+
+class Writer(ElasticsearchWriter):
+    def __init__(self, delay=0, reject=None, status=None, **kwargs):
+        super(Writer, self).__init__(**kwargs)
+        self.delay = delay
+        self.reject = reject
+        self.item_status = status
+        self.clients = []
+
+    def _create_client(self):
+        client = FakeElasticsearch(self.delay, self.reject, self.item_status)
+        self.clients.append(client)
+        return client
+
+class TestElasticsearchWriter(unittest.TestCase):
+
+    def _docs(self, n):
+        return [{"_id": str(i), "_index": "idx", "_type": "doc", "_source": {"n": i}} for i in range(n)]
+
+    def _run(self, writer, docs):
+        output = []
+        writer.add_callback(lambda proc, doc: output.append(doc), "output")
+        writer.start()
+        for doc in docs:
+            writer.put(doc)
+        writer.stop()
+        writer.wait()
+        return output
+
+    def test_persistent_client(self):
+        w = Writer(batchsize=10, batchtime=0.01)
+        output = self._run(w, self._docs(25))
+
+        self.assertEqual(1, len(w.clients))
+        self.assertTrue(w.clients[0].transport.closed)
+        self.assertGreaterEqual(len(w.clients[0].bulks), 3)
+        self.assertEqual([str(i) for i in range(25)], [doc["_id"] for doc in output])
+        self.assertEqual(1, output[0]["_version"])
+
+    def test_concurrent_bulks(self):
+        w = Writer(delay=0.02, batchsize=9, batchtime=0.01, max_inflight=4)
+        docs = self._docs(100)
+        docs += [{"_id": str(i % 10), "_index": "idx", "_type": "doc", "_source": {"n": i}} for i in range(100)]
+        output = self._run(w, docs)
+
+        es = w.clients[0]
+        self.assertGreater(es.max_active, 1)
+        self.assertLessEqual(es.max_active, 4)
+        self.assertEqual(0, es.id_clashes)  # Same '_id' never in flight twice
+        self.assertEqual([doc["_source"]["n"] for doc in docs], [doc["_source"]["n"] for doc in output])
+
+        stats = w.stats.get()["bulk"]
+        self.assertEqual(200, stats["documents"])
+        self.assertEqual(len(es.bulks), stats["count"])
+        self.assertEqual(0, stats["inflight"])
+
+    def test_abort_with_batches_in_flight(self):
+        w = Writer(delay=0.05, batchsize=5, batchtime=0.01, max_inflight=3)
+        w.start()
+        for doc in self._docs(200):
+            w.put(doc)
+        time.sleep(0.1)
+        w.abort()
+        w.wait()
+        time.sleep(0.2)  # Any worker left would have made another request by now
+
+        self.assertEqual(1, len(w.clients))  # Not created again by a worker
+        es = w.clients[0]
+        self.assertTrue(es.transport.closed)
+        self.assertEqual(0, es.after_close)
+        self.assertLess(len(es.bulks), 40)
+        self.assertEqual([], [t for t in threading.enumerate() if t.name.endswith(".bulk")])
+
+    def test_batch_bytes(self):
+        w = Writer(batchsize=1000, batch_bytes=1000)
+        docs = [{"_id": str(i), "_index": "idx", "_type": "doc", "_source": {"text": "x" * 200}} for i in range(20)]
+        docs.append({"_id": "big", "_index": "idx", "_type": "doc", "_source": {"text": "x" * 5000}})
+        output = self._run(w, docs)
+
+        sizes = [len(bulk) // 2 for bulk in w.clients[0].bulks]
+        self.assertEqual(21, sum(sizes))
+        self.assertTrue(all(n <= 4 for n in sizes))  # Each document takes about 250 bytes
+        self.assertEqual(21, len(output))
+        self.assertLessEqual(w.stats.get()["bulk"]["bytes"] // len(sizes), 1000 + 5100 // len(sizes))
+
+    def test_serialized_on_input(self):
+        w = Writer(batchsize=1000, batchtime=60.0, batch_bytes=500)
+        docs = [{"_id": str(i), "_index": "idx", "_type": "doc", "_source": {"n": i, "date": datetime(2015, 1, 2, 3, 4, 5), "text": u"bl\xe5b\xe6r"}} for i in range(20)]
+        w.on_open()
+        w._incoming(docs)
+        self.assertEqual(20, w._queue.qsize())
+        self.assertEqual(sum(len(entry[1]) for entry in w._queue.queue), w._queue_bytes)
+        self.assertTrue(w._batch_ready())  # By size, long before 'batchsize' and 'batchtime'
+        w.on_close()
+
+        started = time.time()
+        output = self._run(Writer(batchsize=1000, batchtime=60.0, batch_bytes=500), docs)
+        self.assertLess(time.time() - started, 10)
+        self.assertEqual(20, len(output))
+
+        entry = w._prepare(docs[0])
+        action, source = [json.loads(line) for line in entry[1].splitlines()]
+        self.assertEqual({"index": {"_index": "idx", "_type": "doc", "_id": "0"}}, action)
+        self.assertNotIn(" ", entry[1])  # Compact
+        self.assertEqual("2015-01-02T03:04:05Z", source["date"])
+        self.assertEqual(u"bl\xe5b\xe6r", source["text"])
+
+    def test_compress(self):
+        es = ElasticsearchWriter(hosts=["localhost:9200"], compress=True)
+        es.on_open()
+        connection = es._es.transport.get_connection()
+        self.assertTrue(connection.http_compress)
+        es.on_close()
+
+        # Not passed on at all unless set, for clients that do not know it
+        created = []
+        original = elasticsearch.Elasticsearch
+        elasticsearch.Elasticsearch = lambda *args, **kwargs: created.append(kwargs)
+        try:
+            ElasticsearchWriter(hosts=["localhost:9200"])._create_client()
+        finally:
+            elasticsearch.Elasticsearch = original
+        self.assertNotIn("http_compress", created[0])
+
+        # Fails clearly on open with a client that cannot compress
+        es = ElasticsearchWriter(compress=True)
+        es._client_supports_compress = lambda: False
+        self.assertRaises(ValueError, es.on_open)
+
+    def test_adaptive_batch_size(self):
+        # Requests take 1 ms per document; target 20 ms
+        w = Writer(delay=lambda n: n * 0.001, batchsize=100, min_batchsize=5, batchtime=0.01, target_latency=0.02)
+        w.on_open()
+        for i in range(10):
+            w._adapt_batch_limit(w._batch_limit, w._batch_limit * 0.001, False)
+        self.assertTrue(15 <= w._batch_limit <= 25, w._batch_limit)
+
+        # Rejections halve it, down to 'min_batchsize'
+        limit = w._batch_limit
+        w._adapt_batch_limit(limit, 0.001, True)
+        self.assertEqual(max(5, limit // 2), w._batch_limit)
+        for i in range(10):
+            w._adapt_batch_limit(w._batch_limit, 0.001, True)
+        self.assertEqual(5, w._batch_limit)
+
+        # Fast requests grow it, up to 'batchsize'
+        for i in range(30):
+            w._adapt_batch_limit(w._batch_limit, 0.001, False)
+        self.assertEqual(100, w._batch_limit)
+        w.on_close()
+
+    def test_adaptive_batch_size_concurrent(self):
+        # Bulk workers adjust the limit concurrently; no adjustment may be lost
+        w = Writer(batchsize=0, min_batchsize=10, target_latency=1.0)
+        w.on_open()
+        w._batch_limit = 10
+        def grow():
+            for i in range(50):
+                w._adapt_batch_limit(10**30, 0.001, False)
+        threads = [threading.Thread(target=grow) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        expected = 10
+        for i in range(200):
+            expected = int(expected * 1.25) + 1
+        self.assertEqual(expected, w._batch_limit)
+        w.on_close()
+
+    def test_adaptive_backoff_on_rejection(self):
+        w = Writer(reject=lambda n: n > 20, batchsize=100, min_batchsize=5, target_latency=10.0, max_retries=0)
+        output = []
+        w.add_callback(lambda proc, doc: output.append(doc), "error")
+        self._run(w, self._docs(300))
+        sizes = [len(bulk) // 2 for bulk in w.clients[0].bulks]
+        self.assertEqual([100, 50, 25, 12], sizes[:4])  # Halved on each rejection
+        self.assertTrue(all(n <= 25 for n in sizes[3:]), sizes)  # Then kept around the limit
+        self.assertEqual(sum(n for n in sizes if n > 20), len(output))
+
+    def _run_with_errors(self, writer, docs):
+        errors = []
+        writer.add_callback(lambda proc, doc: errors.append(doc), "error")
+        return self._run(writer, docs), errors
+
+    def test_retry_rejected(self):
+        attempts = {}
+        def status(action, source):
+            id = action["index"]["_id"]
+            attempts[id] = attempts.get(id, 0) + 1
+            return 429 if int(id) % 3 == 0 and attempts[id] <= 2 else 201
+
+        congested = []
+        w = Writer(status=status, batchsize=10, batchtime=0.01, retry_delay=0.01, max_retries=3)
+        w.add_callback(lambda proc, doc: congested.append(proc.is_congested()), "output")
+        output, errors = self._run_with_errors(w, self._docs(30))
+
+        self.assertEqual([], errors)
+        self.assertEqual(sorted(str(i) for i in range(30)), sorted(doc["_id"] for doc in output))
+        self.assertEqual(3, attempts["0"])
+        self.assertEqual(1, attempts["1"])
+        self.assertEqual(20, w.stats.get()["bulk"]["retried"])
+        self.assertIn(True, congested)  # While retries were pending
+        self.assertFalse(w.is_congested())
+
+    def test_no_retry_on_bad_document(self):
+        w = Writer(status=lambda action, source: 400 if source["n"] == 3 else 201, retry_delay=0.01)
+        output, errors = self._run_with_errors(w, self._docs(10))
+
+        self.assertEqual(9, len(output))
+        self.assertEqual(["3"], [doc["_id"] for doc in errors])
+        self.assertEqual(1, errors[0]["_retry"])
+        self.assertEqual(1, len(w.clients[0].bulks))
+
+    def test_retries_exhausted(self):
+        w = Writer(status=lambda action, source: 503 if source["n"] == 3 else 201, retry_delay=0.01, max_retries=2)
+        output, errors = self._run_with_errors(w, self._docs(10))
+
+        self.assertEqual(9, len(output))
+        self.assertEqual(["3"], [doc["_id"] for doc in errors])
+        sent = [action["index"]["_id"] for bulk in w.clients[0].bulks for action in bulk[0::2]]
+        self.assertEqual(3, sent.count("3"))
+
+    def test_retry_keeps_order_per_id(self):
+        # The first version of document "1" is rejected once; later versions must not overtake it
+        rejected = []
+        def status(action, source):
+            if source["n"] == 1 and not rejected:
+                rejected.append(True)
+                return 429
+            return 201
+
+        for max_inflight in (1, 3):
+            del rejected[:]
+            w = Writer(status=status, batchsize=2, batchtime=0.01, retry_delay=0.05, max_inflight=max_inflight)
+            docs = [{"_id": str(i % 2), "_index": "idx", "_type": "doc", "_source": {"n": i}} for i in range(1, 10)]
+            self._run(w, docs)
+
+            sent = [source["n"] for bulk in w.clients[0].bulks for source in bulk[1::2]]
+            self.assertEqual([1, 1, 3, 5, 7, 9], [n for n in sent if n % 2])
+            self.assertEqual([2, 4, 6, 8], [n for n in sent if not n % 2])
+
+    def test_no_retry_when_overwritten_in_batch(self):
+        # The first version of document "1" is rejected, but a later one in the same batch is written.
+        # Retrying the first would overwrite the later one.
+        w = Writer(status=lambda action, source: 429 if source["n"] == 1 else 201, batchsize=3, batchtime=10, retry_delay=0.01)
+        docs = [{"_id": str(i % 2), "_index": "idx", "_type": "doc", "_source": {"n": i}} for i in range(1, 4)]
+        output, errors = self._run_with_errors(w, docs)
+
+        self.assertEqual([1], [doc["_source"]["n"] for doc in errors])
+        self.assertEqual([2, 3], [doc["_source"]["n"] for doc in output])
+        self.assertEqual(1, len(w.clients[0].bulks))
+
+def main():
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
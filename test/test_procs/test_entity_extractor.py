@@ -73,6 +73,23 @@ class TestEntityExtractor(unittest.TestCase):
         self.assertEqual(len(elist), 8)
 
 
+    def test_invalid_pattern(self):
+        bad = self.entities + [{"category": "targets", "name": "bad", "match": [{"type": "exact", "pattern": "foo("}]}]
+
+        ex = EntityExtractor(entities=bad)
+        self.assertRaises(ValueError, ex.on_open)
+
+        # Reconfiguring with a bad pattern fails, and keeps the previous config and matchers
+        ex = EntityExtractor(entities=self.entities)
+        ex.start()
+        self.addCleanup(ex.abort)
+        matchers = ex._matchers
+        self.assertRaises(ValueError, ex.reconfigure, entities=bad)
+        self.assertEqual(self.entities, ex.settings.entities)
+        self.assertIs(matchers, ex._matchers)
+        elist = list(ex._extract(None, u"Comperio and nrk.no"))
+        self.assertEqual(["comperio", "nrk"], sorted(e[1]["name"] for e in elist))
+
     def _verify(self, entities):
         webpages    = unique([x["name"] for x in entities["webpage"]])
         targets     = unique([x["name"] for x in entities["targets"]])
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import unittest, os
+from eslib.procs import ProcessPartition, Transformer
+
+def _create_partition():
+    # Runs in the child process
+    head = Transformer(func=lambda proc, doc: [(doc, os.getpid())])
+    tail = Transformer(func=lambda proc, doc: [doc])
+    tail.subscribe(head)
+    return head, tail
+
+class _Head(Transformer):
+    "Reports suspend and resume as documents, and fails to accept the document 'bad'."
+    def on_suspend(self):
+        self.sockets["output"].send("suspended")
+
+    def on_resume(self):
+        self.sockets["output"].send("resumed")
+
+    def put(self, document, connector_name=None):
+        if document == "bad":
+            raise Exception("Not accepting this.")
+        super(_Head, self).put(document, connector_name)
+
+def _create_signalling_partition():
+    # Runs in the child process
+    head = _Head(func=lambda proc, doc: [doc])
+    tail = Transformer(func=lambda proc, doc: [doc])
+    tail.subscribe(head)
+    return head, tail
+
+class TestProcessPartition(unittest.TestCase):
+
+    def test_documents_and_stop(self):
+        p = ProcessPartition(factory=_create_partition, batchsize=10)
+        last = Transformer(func=lambda proc, doc: [doc])
+        last.subscribe(p)
+
+        output = []
+        last.add_callback(lambda proc, doc: output.append(doc))
+
+        p.start()
+        for i in range(1000):
+            p.put("doc%d" % i)
+        p.stop()
+        last.wait()
+
+        self.assertFalse(p.running)
+        self.assertFalse(last.running)
+        self.assertEqual([doc for doc, pid in output], ["doc%d" % i for i in range(1000)])
+        pids = set(pid for doc, pid in output)
+        self.assertEqual(len(pids), 1)
+        self.assertNotEqual(pids.pop(), os.getpid())
+
+    def test_abort(self):
+        p = ProcessPartition(factory=_create_partition)
+        p.start()
+        p.put(1)
+        p.abort()
+        p.wait()
+
+        self.assertFalse(p.running)
+        self.assertIsNone(p._child)
+
+    def test_suspend_and_resume(self):
+        p = ProcessPartition(factory=_create_signalling_partition)
+        output = []
+        p.add_callback(lambda proc, doc: output.append(doc))
+
+        p.start()
+        for i in range(10):
+            p.put("doc%d" % i)
+        p.suspend()
+        p.resume()
+        for i in range(10, 20):
+            p.put("doc%d" % i)
+        p.stop()
+        p.wait()
+
+        self.assertEqual(["suspended", "resumed"], [doc for doc in output if not doc.startswith("doc")])
+        self.assertEqual(["doc%d" % i for i in range(20)], [doc for doc in output if doc.startswith("doc")])
+
+    def test_head_refuses_document(self):
+        # The partition must abort, not hang, when the head does not take a document from the parent
+        p = ProcessPartition(factory=_create_signalling_partition)
+        p.start()
+        p.put("bad")
+        p.wait()
+
+        self.assertFalse(p.running)
+        self.assertTrue(p.aborted)
+        self.assertIsNone(p._child)
+
+def main():
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
@@ -19,6 +19,8 @@ class TestTweetEntityRemoval(unittest.TestCase):
         p_url     = TweetEntityRemover(remove_urls=True , remove_mentions=False)
         p_mention = TweetEntityRemover(remove_urls=False, remove_mentions=True)
         p_both    = TweetEntityRemover(remove_urls=True , remove_mentions=True, target_field="cleaned")
+        for p in [p_none, p_url, p_mention, p_both]:
+            p.on_open()
 
         cleaned_none    = p_none   ._clean(doc)
         cleaned_url     = p_url    ._clean(doc)
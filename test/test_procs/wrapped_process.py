@@ -1,8 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import time, sys, signal
-from select import select
+import time, sys, signal, errno
+from select import select, error as select_error
 
 #region Signal handling
 
@@ -28,7 +28,12 @@ running = True
 print "INNER/STARTING"
 
 while running:
-    r,w,e = select([sys.stdin],[],[],0)
+    try:
+        r,w,e = select([sys.stdin],[],[],0)
+    except select_error as e:
+        if e.args[0] == errno.EINTR:
+            continue  # Interrupted by one of the signals above
+        raise
     if r:
         line = sys.stdin.readline()
         line = line.strip()
@@ -192,6 +192,18 @@ class TestTestService(unittest.TestCase):
         print "Asserting '%s' (shut down)" % status.DOWN
         self.assertEqual(status.DOWN, p.status)
 
+    def test_profile_bounds(self):
+        p = HttpService()
+
+        self.assertIn("error", p._mgmt_debug_profile(None, None, seconds=0))
+        self.assertIn("error", p._mgmt_debug_profile(None, None, seconds=-1))
+        self.assertIn("error", p._mgmt_debug_profile(None, None, seconds=1, interval=0))
+
+        # Capped, so this returns instead of holding the thread
+        p.max_profile_seconds = 0.2
+        res = p._mgmt_debug_profile(None, None, seconds=1e9)
+        self.assertLess(res["seconds"], 2)
+
 def main():
     unittest.main()
 
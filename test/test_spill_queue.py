@@ -0,0 +1,119 @@
+import unittest, os, shutil, tempfile, time
+from eslib.SpillQueue import SpillQueue
+from eslib.procs import Transformer
+
+class TestSpillQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "q")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def segments(self):
+        return [name for name in os.listdir(self.path) if name.endswith(SpillQueue.SUFFIX)]
+
+    def test_order(self):
+        q = SpillQueue(self.path, threshold=10, segment_size=100)
+        for i in range(50):
+            q.put({"i": i})
+        self.assertEqual(50, q.qsize())
+        self.assertEqual(10, len(q.queue))
+        self.assertGreater(len(self.segments()), 1)
+
+        got = [q.get_nowait()["i"] for i in range(30)]
+        for i in range(50, 60):
+            q.put({"i": i})
+        while not q.empty():
+            got.append(q.get_nowait()["i"])
+        self.assertEqual(range(60), got)
+        q.close()
+        self.assertEqual([], os.listdir(self.path))  # All consumed
+
+    def test_close_and_reopen(self):
+        q = SpillQueue(self.path, threshold=5, segment_size=100)
+        for i in range(40):
+            q.put(i)
+        got = [q.get_nowait() for i in range(12)]  # Some are now loaded from disk into memory
+        q.close()
+
+        q = SpillQueue(self.path, threshold=5, segment_size=100)
+        self.assertEqual(28, q.qsize())
+        q.put(40)
+        while not q.empty():
+            got.append(q.get_nowait())
+            q.task_done()
+        self.assertEqual(range(41), got)
+
+    def test_reopen_without_reading(self):
+        q = SpillQueue(self.path, threshold=0)
+        for i in range(3000):
+            q.put(i)
+        got = [q.get_nowait() for i in range(500)]
+        q.close()
+        self.assertRaises(ValueError, q.put, 3000)
+
+        # Closed again without reading; the read position must still be kept
+        q = SpillQueue(self.path, threshold=0)
+        self.assertEqual(2500, q.qsize())
+        q.close()
+
+        q = SpillQueue(self.path, threshold=0)
+        self.assertEqual(2500, q.qsize())
+        while not q.empty():
+            got.append(q.get_nowait())
+        self.assertEqual(range(3000), got)
+
+    def test_spill_after_consumed(self):
+        q = SpillQueue(self.path, threshold=10)
+        for i in range(30):
+            q.put(i)
+        got = [q.get_nowait() for i in range(11)]  # The only segment is now read, but not yet deleted
+        q.put(30)  # Spilled to a new segment, not appended to the consumed one
+        while not q.empty():
+            got.append(q.get_nowait())
+        self.assertEqual(range(31), got)
+
+    def test_crash_recovery(self):
+        q = SpillQueue(self.path, threshold=0)
+        for i in range(10):
+            q.put(i)
+        q._writer.flush()
+        # Simulate a crash in the middle of writing the last item
+        path = os.path.join(self.path, self.segments()[0])
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) - 1)
+
+        q = SpillQueue(self.path, threshold=0)
+        self.assertEqual(9, q.qsize())
+        self.assertEqual(range(9), [q.get_nowait() for i in range(9)])
+
+    def test_connector(self):
+        docs = []
+        def func(proc, doc):
+            yield doc
+        p = Transformer(func, spill_dir=self.dir, spill_threshold=10)
+        p.add_callback(lambda proc, doc: docs.append(doc))
+
+        p.start()
+        p.suspend()
+        for i in range(100):
+            p.put("doc%d" % i)
+        self.assertEqual(100, p.connectors["input"].pending)
+        p.abort()  # Queued documents are kept on disk
+        p.wait()
+        self.assertEqual([], docs)
+
+        p.start()
+        p.put("doc100")
+        p.stop()
+        p.wait()
+        self.assertEqual(["doc%d" % i for i in range(101)], docs)
+
+
+def main():
+    unittest.main()
+
+if __name__ == "__main__":
+    main()